@@ -0,0 +1,94 @@
+from sqlalchemy import orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from contextlib import asynccontextmanager
+from app.models import Base, MODELS
+from app.migrations import check_schema, check_indexes
+from app.db_conn import ReadRouting, RoutingSession, replica_urls, replica_pool_args
+from dotenv import load_dotenv
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+
+def async_db_url():
+    """ASYNC_DB_URL if set, otherwise DB_URL with the asyncpg driver"""
+    url = os.getenv("ASYNC_DB_URL")
+    if url:
+        return url
+    return str(make_url(os.getenv("DB_URL")).set(drivername="postgresql+asyncpg"))
+
+
+def async_replica_urls():
+    """ASYNC_DB_REPLICA_URLS if set, otherwise DB_REPLICA_URLS with the asyncpg driver"""
+    urls = [url.strip() for url in os.getenv("ASYNC_DB_REPLICA_URLS", "").split(",") if url.strip()]
+    return urls or [str(make_url(url).set(drivername="postgresql+asyncpg")) for url in replica_urls()]
+
+
+class AsyncDatabase(ReadRouting):
+    """
+    asyncio version of Database (asyncpg driver)
+
+    The startup schema/index checks need a round trip to the database, so they
+    can't happen in __init__ - create instances with `await AsyncDatabase.create()`.
+
+    Reads are routed to replicas the same way as in Database: AsyncSession
+    runs a RoutingSession underneath, which picks among the sync faces of the
+    async engines.
+    """
+    # Names of migrations.EXPECTED_INDEXES the live table lacks (set by create())
+    missing_indexes = ()
+
+    def __init__(self, shared=None):
+        self.engine = create_async_engine(async_db_url(),
+                                          pool_pre_ping=True,
+                                          pool_size=int(os.getenv("POOL_SIZE")),
+                                          max_overflow=int(os.getenv("MAX_OVERFLOW")),
+                                          echo=False)
+        self.metadata = Base.metadata
+
+        self.replica_engines = [create_async_engine(url, pool_pre_ping=True, echo=False, **replica_pool_args())
+                                for url in async_replica_urls()]
+        self._init_routing(self.engine.sync_engine, [engine.sync_engine for engine in self.replica_engines], shared)
+        self._session_factory = orm.sessionmaker(
+            bind=self.engine,
+            class_=AsyncSession,
+            sync_session_class=RoutingSession,
+            router=self,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+
+    @classmethod
+    async def create(cls, shared=None):
+        self = cls(shared)
+        async with self.engine.connect() as conn:
+            await conn.run_sync(check_schema, self.metadata.sorted_tables)
+            self.missing_indexes = await conn.run_sync(check_indexes)
+        logger.info(f"Async Database Connection initialized with tables: {self.metadata.tables.keys()}")
+        return self
+
+    @asynccontextmanager
+    async def get_db(self, pin_primary=False):
+        db = self._session_factory()
+        self._start_session(db, pin_primary)
+        try:
+            yield db
+        except Exception as e:
+            logger.error(f"Error getting database session: {e}")
+            await db.rollback()
+            raise e
+        finally:
+            await db.close()
+
+    def get_table_class(self, table_name: str):
+        return MODELS[table_name]
+
+    async def db_connection_close(self):
+        await self.engine.dispose()
+        for engine in self.replica_engines:
+            await engine.dispose()
+        logger.info("Async Database connection closed")
@@ -0,0 +1,97 @@
+import aio_pika
+import asyncio
+import logging
+import os
+from dotenv import load_dotenv
+from app import message_codec
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv(dotenv_path="app/configs/.env")
+
+
+class AsyncRabbitMQHelper:
+    """
+    asyncio version of RabbitMQHelper (aio-pika)
+
+    Concept: One connection, many coroutines
+    - Everything runs on the event loop thread, so thousands of in-flight
+      requests can share one channel without locks or a pool
+    - connect_robust() reconnects (and re-opens the channel) on its own
+    """
+
+    def __init__(self):
+        self.host = os.getenv("RABBITMQ_HOST", "localhost")
+        self.port = int(os.getenv("RABBITMQ_PORT", "5672"))
+        self.username = os.getenv("RABBITMQ_USERNAME", "guest")
+        self.password = os.getenv("RABBITMQ_PASSWORD", "guest")
+
+        self.connection = None
+        self.channel = None
+
+    async def connect(self):
+        """Connect to RabbitMQ and open a channel"""
+        try:
+            self.connection = await aio_pika.connect_robust(
+                host=self.host,
+                port=self.port,
+                login=self.username,
+                password=self.password,
+                heartbeat=600,
+            )
+            # Publisher confirms: publish() only returns once the broker ACKed the
+            # message (raises on NACK). Concurrent coroutines publishing on this
+            # channel are pipelined, so this costs no extra round trip per request
+            self.channel = await self.connection.channel(publisher_confirms=True)
+            logger.info("Connected to RabbitMQ (async)!")
+            return True
+        except Exception as e:
+            logger.error("Connection failed: %s", e)
+            raise
+
+    async def setup_queue(self, queue_name="user_onboarding_queue"):
+        """Declare the queue and its DLQ - same arguments as RabbitMQHelper.setup_queue"""
+        await self.channel.declare_queue(
+            queue_name,
+            durable=True,
+            arguments={
+                'x-message-ttl': 3600000,
+                'x-dead-letter-exchange': '',
+                'x-dead-letter-routing-key': f'{queue_name}_dlq',
+            }
+        )
+        await self.channel.declare_queue(
+            f'{queue_name}_dlq',
+            durable=True,
+            arguments={
+                'x-message-ttl': 86400000,
+            }
+        )
+        logger.info("Queue '%s' created with DLQ: '%s_dlq'", queue_name, queue_name)
+
+    async def publish_message(self, queue_name, message_data):
+        """Publish a persistent message (encoded by app/message_codec.py) to queue_name through the default exchange"""
+        encoded = message_codec.encode(message_data)
+        message = aio_pika.Message(
+            body=encoded.body,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            content_type=encoded.content_type,
+            content_encoding=encoded.content_encoding,
+        )
+        await self.channel.default_exchange.publish(message, routing_key=queue_name, mandatory=True)
+        logger.debug("Message published to '%s': %s", queue_name, message_data.get('user_id', 'N/A'))
+
+    async def publish_many(self, queue_name, messages, return_exceptions=False):
+        """
+        Publish all messages at once and wait for all their confirms (pipelined).
+        With return_exceptions=True returns one error (or None) per message instead of raising
+        """
+        return await asyncio.gather(*(self.publish_message(queue_name, message) for message in messages),
+                                    return_exceptions=return_exceptions)
+
+    async def close(self):
+        """Close the connection"""
+        if self.connection and not self.connection.is_closed:
+            await self.connection.close()
+            logger.info("Connection closed")
@@ -0,0 +1,319 @@
+"""
+Bloom filter of known emails - skips the duplicate check query for new emails
+
+Concept: Bloom Filter
+- A bit array plus k hash functions; adding an item sets k bits
+- Lookup: if any of the k bits is 0 the item was DEFINITELY never added,
+  if all are 1 it was MAYBE added (false positives happen, false negatives don't)
+- Almost every signup is a new email, so most signups get a definite
+  "not present" and never run the user_exists query
+
+Concept: Keeping it up to date
+- Built once at startup by streaming every email out of users
+- Emails published by this process are added right away
+- A background refresh picks up rows written by other API workers/consumers
+  (rows created since the last refresh, with an overlap for late commits)
+- Until the first build finishes every lookup answers "maybe" (safe default)
+- API_MODE=async builds and refreshes through the async database on the
+  event loop (astart), the bit setting runs on a worker thread
+
+Concept: Other processes' inserts
+- Between another worker's publish and this worker's next refresh the filter
+  can't know the email. The publish itself is covered by the shared pending
+  reservation (409 before the filter is asked); for the commit-to-refresh
+  window the consumer marks each committed email "recent" in the shared
+  store (remember_recent) for RECENT_TTL (two refresh intervals), before it
+  releases the reservation
+- A "no" from the bits is then only trusted once the shared store confirms
+  the email isn't recent; a recent email gets the exact database check
+- Without a shared store other processes can't be heard from at all, so the
+  filter is only on by default when SHARED_STORE_URL is set (a single API
+  worker can turn it on with EMAIL_FILTER_ENABLED=true: everything it
+  publishes it has added itself)
+"""
+from app.helpers.helper import normalize_email
+from datetime import timedelta
+from dotenv import load_dotenv
+from sqlalchemy import select
+import threading
+import asyncio
+import hashlib
+import logging
+import math
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+REFRESH_SECONDS = float(os.getenv("EMAIL_FILTER_REFRESH_SECONDS", "30"))
+RECENT_TTL = 2 * REFRESH_SECONDS
+
+
+def _recent_key(email):
+    return f"email:recent:{email}"
+
+
+def remember_recent(shared, email: str):
+    """Called by the process that committed email: API workers re-check it until their filter has it"""
+    shared.set(_recent_key(normalize_email(email)), "1", RECENT_TTL)
+
+
+class BloomFilter:
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # Optimal sizes for `capacity` items at `error_rate`
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str):
+        new_bit = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                new_bit = True
+        # Re-adding a known item doesn't change the bits, so don't count it
+        if new_bit:
+            self.count += 1
+
+    def __contains__(self, item: str):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+    @property
+    def false_positive_rate(self):
+        """Expected false positive rate for the number of items added so far"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+
+class EmailFilter:
+    """BloomFilter of normalized emails in users, built from and refreshed against the database"""
+
+    def __init__(self, capacity=None, error_rate=None, refresh_interval=None, refresh_overlap=300, shared=None):
+        self.capacity = capacity or int(os.getenv("EMAIL_FILTER_CAPACITY", "1000000"))
+        self.error_rate = error_rate or float(os.getenv("EMAIL_FILTER_ERROR_RATE", "0.001"))
+        self.refresh_interval = refresh_interval or REFRESH_SECONDS
+        self.refresh_overlap = timedelta(seconds=refresh_overlap)
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._filter = BloomFilter(self.capacity, self.error_rate)
+        self._high_water = None  # newest created_on seen in the database
+        self._building = None  # filter being rebuilt, receives add()s too so none are lost on swap
+        self._stop = threading.Event()
+        self._thread = None
+        self._task = None
+        self.ready = False
+
+    def maybe_known(self, emails):
+        """
+        The emails that may be in users (run the exact check for those); the
+        others are definitely new. One shared-store round trip for all the
+        emails the bits rule out (recently committed elsewhere?)
+        """
+        if not self.ready:
+            return list(emails)
+        maybe, ruled_out = [], []
+        for email in emails:
+            (maybe if normalize_email(email) in self._filter else ruled_out).append(email)
+        if ruled_out and self.shared is not None:
+            try:
+                recent = self.shared.get_many([_recent_key(normalize_email(email)) for email in ruled_out])
+            except Exception as e:
+                logger.warning(f"Email filter recent check failed, checking the database: {e}")
+                return list(emails)
+            maybe += [email for email, mark in zip(ruled_out, recent) if mark is not None]
+        return maybe
+
+    async def amaybe_known(self, emails):
+        if self.shared is not None and self.ready:
+            return await asyncio.to_thread(self.maybe_known, emails)
+        return self.maybe_known(emails)
+
+    def might_contain(self, email: str):
+        """False = email is definitely not in users, True = run the exact check"""
+        return bool(self.maybe_known([email]))
+
+    async def amight_contain(self, email: str):
+        return bool(await self.amaybe_known([email]))
+
+    def add(self, email: str):
+        email = normalize_email(email)
+        with self._lock:
+            self._filter.add(email)
+            if self._building is not None:
+                self._building.add(email)
+
+    def _scan(self, database, since=None, batch_size=10000):
+        """Stream (email, created_on) rows, created after `since` if given"""
+        user = database.get_table_class("users")
+        query = select(user.email, user.created_on)
+        if since is not None:
+            query = query.where(user.created_on > since)
+        with database.get_db() as sess:
+            # Server-side cursor: rows arrive batch_size at a time, memory stays flat
+            result = sess.execute(query.execution_options(stream_results=True))
+            for partition in result.partitions(batch_size):
+                yield partition
+
+    async def _ascan(self, database, since=None, batch_size=10000):
+        """_scan through the async database"""
+        user = database.get_table_class("users")
+        query = select(user.email, user.created_on)
+        if since is not None:
+            query = query.where(user.created_on > since)
+        async with database.get_db() as sess:
+            result = await sess.stream(query, execution_options={"max_row_buffer": batch_size})
+            async for partition in result.partitions(batch_size):
+                yield partition
+
+    def _add_rows(self, bloom, rows, high_water):
+        with self._lock:
+            for email, created_on in rows:
+                bloom.add(normalize_email(email))
+                if created_on and (high_water is None or created_on > high_water):
+                    high_water = created_on
+        return high_water
+
+    def _load(self, bloom, database, since=None):
+        high_water = since
+        for rows in self._scan(database, since):
+            high_water = self._add_rows(bloom, rows, high_water)
+        return high_water
+
+    async def _aload(self, bloom, database, since=None):
+        high_water = since
+        async for rows in self._ascan(database, since):
+            # Hashing a partition of emails is CPU work: keep it off the event loop
+            high_water = await asyncio.to_thread(self._add_rows, bloom, rows, high_water)
+        return high_water
+
+    def _begin_build(self):
+        capacity = self.capacity
+        if self._filter.count > capacity:
+            capacity = self._filter.count * 2  # outgrown: rebuild bigger to keep the error rate
+        bloom = BloomFilter(capacity, self.error_rate)
+        with self._lock:
+            self._building = bloom
+        return bloom, capacity
+
+    def _finish_build(self, bloom, capacity, high_water, started):
+        with self._lock:
+            self._filter = bloom
+            self._high_water = high_water
+            self.capacity = capacity
+            self.ready = True
+        logger.info(f"Email filter built in {time.monotonic() - started:.2f}s: {self.stats()}")
+
+    def _end_build(self):
+        with self._lock:
+            self._building = None
+
+    def build(self, database):
+        """Full streaming scan of users into a fresh filter"""
+        started = time.monotonic()
+        bloom, capacity = self._begin_build()
+        try:
+            high_water = self._load(bloom, database)
+        finally:
+            self._end_build()
+        self._finish_build(bloom, capacity, high_water, started)
+
+    async def abuild(self, database):
+        started = time.monotonic()
+        bloom, capacity = self._begin_build()
+        try:
+            high_water = await self._aload(bloom, database)
+        finally:
+            self._end_build()
+        self._finish_build(bloom, capacity, high_water, started)
+
+    def _since(self):
+        return self._high_water - self.refresh_overlap if self._high_water else None
+
+    def _advance(self, high_water):
+        if high_water is not None:
+            self._high_water = max(high_water, self._high_water or high_water)
+
+    def refresh(self, database):
+        """Add rows created since the last build/refresh (re-reading an overlap window for late commits)"""
+        if self._filter.count > self.capacity:
+            return self.build(database)
+        self._advance(self._load(self._filter, database, self._since()))
+
+    async def arefresh(self, database):
+        if self._filter.count > self.capacity:
+            return await self.abuild(database)
+        self._advance(await self._aload(self._filter, database, self._since()))
+
+    def start(self, database_getter):
+        """Build in a background thread, then refresh every refresh_interval seconds"""
+        def run():
+            while not self._stop.is_set():
+                try:
+                    if self.ready:
+                        self.refresh(database_getter())
+                    else:
+                        self.build(database_getter())
+                except Exception as e:
+                    logger.error(f"Email filter {'refresh' if self.ready else 'build'} failed: {e}")
+                    if not self.ready:
+                        # Usually the database isn't up yet - build again soon, not a refresh interval later
+                        self._stop.wait(5)
+                        continue
+                self._stop.wait(self.refresh_interval)
+
+        self._thread = threading.Thread(target=run, name="email-filter", daemon=True)
+        self._thread.start()
+        return self
+
+    def astart(self, async_database_getter):
+        """start() for API_MODE=async: a task on the running loop, reading through the async database"""
+        async def run():
+            while not self._stop.is_set():
+                try:
+                    if self.ready:
+                        await self.arefresh(await async_database_getter())
+                    else:
+                        await self.abuild(await async_database_getter())
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Email filter {'refresh' if self.ready else 'build'} failed: {e}")
+                    if not self.ready:
+                        await asyncio.sleep(5)
+                        continue
+                await asyncio.sleep(self.refresh_interval)
+
+        self._task = asyncio.get_running_loop().create_task(run(), name="email-filter")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "items": self._filter.count,
+            "capacity": self.capacity,
+            "memory_bytes": self._filter.memory_bytes,
+            "false_positive_rate": self._filter.false_positive_rate,
+        }
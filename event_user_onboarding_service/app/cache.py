@@ -0,0 +1,198 @@
+"""
+Read-through cache for GET /users/{user_id}
+
+Concept: Read-through
+- Look in the cache first, only go to Postgres on a miss, then remember
+  the answer for next time
+
+Concept: One level, local or shared
+- Without a shared store: an LRU dict in this process (bounded size,
+  entries expire after a TTL)
+- With the shared store (see app.shared_store): only the shared store, so
+  every API worker benefits from a row another worker already loaded, and
+  an invalidation is seen by all of them at once. A per-process copy in
+  front of it would keep serving the old row in the other workers
+
+Concept: Invalidation
+- User rows only change when they are inserted (consumer) or verified
+  (PUT /users/{user_id}); both call invalidate(user_id) right after commit
+- Without a shared store other API workers can't be reached: their entries
+  stay stale for at most USER_CACHE_TTL. Run several workers with
+  SHARED_STORE_URL set
+- A read racing a write can load the old row (from a lagging replica, or
+  just before the commit) and store it after the invalidation. So while the
+  user's write marker is set (shared_store.write_marker, for
+  DB_READ_YOUR_WRITES_SECONDS after the write) the shared store is not
+  filled at all - checked and set in one atomic step (set_unless)
+"""
+from app.shared_store import write_marker
+from collections import OrderedDict
+from datetime import datetime
+from dotenv import load_dotenv
+import threading
+import asyncio
+import logging
+import time
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU dict where every entry expires after `ttl` seconds"""
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, expires_at)
+
+    def get(self, key):
+        """The cached value, or MISSING"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class UserCache:
+    """
+    Cache of user details dicts keyed by user_id.
+    A cached None means "user not found" (only when cache_not_found is on).
+    """
+
+    def __init__(self, max_size=None, ttl=None, cache_not_found=None, not_found_ttl=None, shared=None):
+        self.ttl = ttl or float(os.getenv("USER_CACHE_TTL", "60"))
+        self.cache_not_found = cache_not_found if cache_not_found is not None else os.getenv("USER_CACHE_NOT_FOUND", "false").lower() == "true"
+        self.not_found_ttl = not_found_ttl or float(os.getenv("USER_CACHE_NOT_FOUND_TTL", "5"))
+        max_size = max_size if max_size is not None else int(os.getenv("USER_CACHE_SIZE", "10000"))
+        # No local level in front of a shared store: it couldn't be invalidated from other processes
+        self.local = LRUCache(max_size=max_size if shared is None else 0, ttl=self.ttl)
+        self.shared = shared
+
+    @staticmethod
+    def _key(user_id):
+        return f"user:{user_id.strip().lower()}"
+
+    @staticmethod
+    def _guard(user_id):
+        return write_marker(user_id.strip().lower())
+
+    @staticmethod
+    def _encode(details):
+        if details is None:
+            return "null"
+        return json.dumps({**details, "created_on": details["created_on"].isoformat() if details.get("created_on") else None})
+
+    @staticmethod
+    def _decode(raw):
+        details = json.loads(raw)
+        if details and details.get("created_on"):
+            details["created_on"] = datetime.fromisoformat(details["created_on"])
+        return details
+
+    def _ttl_for(self, details):
+        return self.ttl if details is not None else self.not_found_ttl
+
+    def _lookup_local(self, key):
+        return self.local.get(key)
+
+    def _lookup_shared(self, key):
+        if self.shared is None:
+            return MISSING
+        try:
+            raw = self.shared.get(key)
+        except Exception as e:
+            logger.warning("Shared cache get failed: %s", e)
+            return MISSING
+        if raw is None:
+            return MISSING
+        details = self._decode(raw)
+        self.local.set(key, details, self._ttl_for(details))
+        return details
+
+    def _store(self, key, details, guard=None):
+        if details is None and not self.cache_not_found:
+            return
+        ttl = self._ttl_for(details)
+        self.local.set(key, details, ttl)
+        if self.shared is not None:
+            try:
+                # Not stored while the user was written recently: details may predate that write
+                self.shared.set_unless(key, self._encode(details), ttl, guard)
+            except Exception as e:
+                logger.warning("Shared cache set failed: %s", e)
+
+    def get_or_load(self, user_id, loader):
+        """Cached details for user_id, calling loader() (returns dict or None) on a miss"""
+        key = self._key(user_id)
+        details = self._lookup_local(key)
+        if details is MISSING:
+            details = self._lookup_shared(key)
+        if details is MISSING:
+            details = loader()
+            self._store(key, details, self._guard(user_id))
+        return details
+
+    async def aget_or_load(self, user_id, loader):
+        """Same as get_or_load, with an async loader. Shared store calls run off the event loop"""
+        key = self._key(user_id)
+        details = self._lookup_local(key)
+        if details is MISSING and self.shared is not None:
+            details = await asyncio.to_thread(self._lookup_shared, key)
+        if details is MISSING:
+            details = await loader()
+            if self.shared is not None:
+                await asyncio.to_thread(self._store, key, details, self._guard(user_id))
+            else:
+                self._store(key, details)
+        return details
+
+    def invalidate(self, *user_ids):
+        """Drop the user_ids from this process and from the shared store (one delete for all)"""
+        keys = [self._key(user_id) for user_id in user_ids]
+        for key in keys:
+            self.local.delete(key)
+        if self.shared is not None and keys:
+            try:
+                self.shared.delete(*keys)
+            except Exception as e:
+                logger.warning("Shared cache invalidation failed for %s: %s",
+                               user_ids[0] if len(user_ids) == 1 else f"{len(user_ids)} users", e)
+
+    async def ainvalidate(self, *user_ids):
+        if self.shared is not None:
+            await asyncio.to_thread(self.invalidate, *user_ids)
+        else:
+            self.invalidate(*user_ids)
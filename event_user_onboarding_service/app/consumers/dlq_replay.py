@@ -0,0 +1,328 @@
+"""
+DLQ Replay - Sorts out user_onboarding_queue_dlq and re-drives what can still succeed
+
+Concept: Classification
+- duplicate:  the user is already in the database (the message was committed
+              before it failed), or its email belongs to another user
+- schema:     can't be decoded, has an unknown schema version, a required
+              field is missing, or a value doesn't fit its column - it would
+              fail again every time
+- exhausted:  already replayed DLQ_REPLAY_MAX_REPLAYS times (default 3)
+- transient:  everything else (database outage, expired in the main queue...)
+- transient messages are published back to user_onboarding_queue; the others
+  are appended to a gzipped NDJSON archive (one compact line per message) and
+  removed from the DLQ
+- The archive never holds credentials: password (messages from before hashing
+  moved to the API still carry it) and password_hash are redacted, and an
+  undecodable body is recorded by its size and sha256 only
+
+Concept: Bounded prefetch
+- The DLQ is streamed with basic_qos(prefetch_count=DLQ_REPLAY_PREFETCH):
+  at most that many messages are held un-acked, whatever the DLQ's size
+- Each prefetch window is classified with one database query, then settled:
+  ACKed once it is archived or its re-drive is confirmed by the broker,
+  put back into the DLQ if the re-drive failed
+- A run handles at most the DLQ depth it found at start, so a message that
+  fails again while the tool runs is not picked up twice
+
+Concept: Token bucket
+- Re-drives are paced at DLQ_REPLAY_RATE messages/s (bursts of at most one
+  prefetch window), so replaying a day of failures doesn't flatten the
+  database that just came back
+
+Run it with:
+    python -m app.consumers.dlq_replay --dry-run        # classify a sample, change nothing
+    python -m app.consumers.dlq_replay --rate 100
+"""
+from app.helpers.helper import normalize_email, DB_MAPPERS
+from app import message_codec
+from app.resources import get_resources
+from app.views.queries import select_users_by_emails
+from app.logging_config import configure_logging
+from app.models import User
+from concurrent.futures import wait
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import argparse
+import logging
+import hashlib
+import gzip
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+REQUIRED_FIELDS = ("email", "first_name", "last_name", "user_id", "verification")
+PERMANENT = ("duplicate", "schema", "exhausted")
+SECRET_FIELDS = ("password", "password_hash")
+REDACTED = "[REDACTED]"
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` saved up"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def acquire(self, count=1):
+        """Block until `count` tokens are available, then take them"""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= count:
+                self.tokens -= count
+                return
+            time.sleep((count - self.tokens) / self.rate)
+
+
+def _column_limits():
+    """column name -> max length, from the users model"""
+    return {column.name: column.type.length for column in User.__table__.columns if getattr(column.type, "length", None)}
+
+
+def _death(headers):
+    """The first x-death entry RabbitMQ added when it dead-lettered the message"""
+    deaths = (headers or {}).get("x-death") or []
+    if not deaths:
+        return None
+    death = deaths[0]
+    return {key: str(death.get(key)) for key in ("reason", "queue", "count", "time") if death.get(key) is not None}
+
+
+def _redacted(message):
+    """The message for the archive, without its credentials"""
+    return {key: REDACTED if key in SECRET_FIELDS else value for key, value in message.items()}
+
+
+def _raw(properties, body):
+    """An undecodable message for the archive: it may hold a password we can't find, so no body"""
+    return {"content_type": properties.content_type, "content_encoding": properties.content_encoding,
+            "size": len(body), "body_sha256": hashlib.sha256(body).hexdigest()}
+
+
+class DlqReplay:
+
+    def __init__(self, database, publish, rate=None, max_replays=None, archive_dir=None, dry_run=False, burst=None):
+        """publish(messages) re-drives a list of messages, returns one error (or None) per message"""
+        self.database = database
+        self.publish = publish
+        self.max_replays = max_replays if max_replays is not None else int(os.getenv("DLQ_REPLAY_MAX_REPLAYS", "3"))
+        self.archive_dir = archive_dir or os.getenv("DLQ_ARCHIVE_DIR", "dlq-archive")
+        self.dry_run = dry_run
+        rate = rate or float(os.getenv("DLQ_REPLAY_RATE", "50"))
+        self.bucket = TokenBucket(rate, burst or int(rate))
+        self.limits = _column_limits()
+        self.counts = {"transient": 0, "duplicate": 0, "schema": 0, "exhausted": 0, "redrive_failed": 0}
+        self._archive = None
+        self.archive_path = None
+
+    # ---- classification ----
+
+    def _schema_error(self, message):
+        if not isinstance(message, dict):
+            return message if isinstance(message, str) else "not a message object"
+        if message.get("v", 1) not in DB_MAPPERS:
+            return f"unsupported schema version {message.get('v')}"
+        missing = [field for field in REQUIRED_FIELDS if not message.get(field)]
+        if not message.get("password_hash") and not message.get("password"):
+            missing.append("password_hash")
+        if missing:
+            return f"missing {', '.join(missing)}"
+        if not isinstance(message.get("replays", 0), int):
+            return "replays is not a number"
+        for field, column in (("email", "email"), ("first_name", "first_name"), ("last_name", "last_name"),
+                              ("user_id", "user_id"), ("verification", "verification_state"),
+                              ("password_hash", "password")):
+            value = message.get(field)
+            if value is not None and (not isinstance(value, str) or len(value) > self.limits.get(column, len(value))):
+                return f"{field} does not fit users.{column}"
+        return None
+
+    def _registered(self, emails):
+        """email -> user_id for the emails that are already in users, in one query"""
+        if not emails:
+            return {}
+        user = self.database.get_table_class("users")
+        with self.database.get_db(pin_primary=True) as sess:
+            rows = sess.execute(select_users_by_emails(user, emails)).all()
+        return {normalize_email(row.email): row.user_id for row in rows}
+
+    def classify(self, messages):
+        """[message, or the reason it couldn't be decoded] -> [(class, reason)] in the same order"""
+        results = [None] * len(messages)
+        valid = []
+        for i, message in enumerate(messages):
+            error = self._schema_error(message)
+            if error:
+                results[i] = ("schema", error)
+            else:
+                valid.append(i)
+
+        registered = self._registered([messages[i]["email"] for i in valid])
+        for i in valid:
+            message = messages[i]
+            owner = registered.get(normalize_email(message["email"]))
+            if owner == message["user_id"]:
+                results[i] = ("duplicate", "user already in the database")
+            elif owner:
+                results[i] = ("duplicate", f"email registered by user {owner}")
+            elif message.get("replays", 0) >= self.max_replays:
+                results[i] = ("exhausted", f"replayed {message.get('replays')} times already")
+            else:
+                results[i] = ("transient", None)
+        return results
+
+    # ---- settling ----
+
+    def _archive_lines(self, entries):
+        if self._archive is None:
+            os.makedirs(self.archive_dir, exist_ok=True)
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+            self.archive_path = os.path.join(self.archive_dir, f"dlq-{stamp}.ndjson.gz")
+            self._archive = gzip.open(self.archive_path, "at", encoding="utf-8")
+        for entry in entries:
+            self._archive.write(json.dumps(entry, separators=(",", ":"), default=str) + "\n")
+        # Flushed before the messages are ACKed, so an ACKed message is always in the archive
+        self._archive.flush()
+
+    def handle(self, deliveries):
+        """
+        deliveries: [(tag, properties, body bytes)] of one prefetch window.
+        Returns [(tag, settled)]: settled=True to ACK, False to put it back into the DLQ
+        """
+        messages = []
+        for _, properties, body in deliveries:
+            try:
+                messages.append(message_codec.decode(body, properties.content_type, properties.content_encoding))
+            except Exception as e:
+                messages.append(f"could not be decoded: {e}")
+
+        classes = self.classify(messages)
+        for kind, _ in classes:
+            self.counts[kind] += 1
+        if self.dry_run:
+            return [(tag, False) for tag, _, _ in deliveries]
+
+        settled = {}
+        archived = [(tag, {"class": kind, "reason": reason, "death": _death(properties.headers),
+                           "message": _redacted(message) if isinstance(message, dict) else _raw(properties, body),
+                           "archived_at": datetime.now(timezone.utc).isoformat()})
+                    for (tag, properties, body), message, (kind, reason) in zip(deliveries, messages, classes)
+                    if kind in PERMANENT]
+        if archived:
+            self._archive_lines([entry for _, entry in archived])
+            settled.update((tag, True) for tag, _ in archived)
+
+        redrive = [(tag, dict(message, replays=message.get("replays", 0) + 1))
+                   for (tag, _, _), message, (kind, _) in zip(deliveries, messages, classes) if kind == "transient"]
+        if redrive:
+            self.bucket.acquire(len(redrive))
+            try:
+                errors = self.publish([message for _, message in redrive])
+            except Exception as e:
+                errors = [e] * len(redrive)
+            for (tag, message), error in zip(redrive, errors):
+                if error is not None:
+                    self.counts["redrive_failed"] += 1
+                    logger.warning("Re-drive of user %s failed: %s", message.get("user_id"), error)
+                settled[tag] = error is None
+        return [(tag, settled[tag]) for tag, _, _ in deliveries]
+
+    def close(self):
+        if self._archive is not None:
+            self._archive.close()
+
+
+def confirmed_publisher(queue_name):
+    """publish(messages) for DlqReplay: pipelined publishes on the confirming publisher"""
+    def publish(messages):
+        publisher = get_resources().publisher
+        futures = [publisher.publish(queue_name, message) for message in messages]
+        wait(futures, timeout=publisher.confirm_timeout)
+        return [None if future.done() and not future.exception() else
+                (future.exception() if future.done() else TimeoutError("Re-drive not confirmed in time"))
+                for future in futures]
+    return publish
+
+
+def run_replay(queue_name="user_onboarding_queue", rate=None, prefetch=None, max_replays=None,
+               archive_dir=None, limit=None, idle_timeout=2.0, dry_run=False):
+    """Stream the DLQ of queue_name once, returns the per-class counts"""
+    from app.rmq_adapter import RabbitMQHelper
+
+    prefetch = prefetch or int(os.getenv("DLQ_REPLAY_PREFETCH", "100"))
+    dlq = f"{queue_name}_dlq"
+    resources = get_resources()
+    rmq = RabbitMQHelper()
+    rmq.connect()
+    rmq.setup_queue(queue_name)
+    replay = DlqReplay(resources.db, confirmed_publisher(queue_name), rate=rate, max_replays=max_replays,
+                       archive_dir=archive_dir, dry_run=dry_run, burst=prefetch)
+
+    depth = rmq.channel.queue_declare(queue=dlq, passive=True).method.message_count
+    # A dry run ACKs nothing, so it can only look at one prefetch window
+    limit = min(limit or depth, prefetch) if dry_run else (limit or depth)
+    logger.info("%s holds %s messages, handling %s (prefetch %s)%s", dlq, depth, limit, prefetch, " - dry run" if dry_run else "")
+
+    started = time.monotonic()
+    received = 0
+    window = []
+
+    def settle():
+        for tag, ok in replay.handle(window):
+            if ok:
+                rmq.channel.basic_ack(delivery_tag=tag)
+            elif not dry_run:
+                rmq.channel.basic_nack(delivery_tag=tag, requeue=True)
+        window.clear()
+
+    try:
+        rmq.channel.basic_qos(prefetch_count=prefetch)
+        for method, properties, body in rmq.channel.consume(dlq, inactivity_timeout=idle_timeout):
+            if method is not None:
+                window.append((method.delivery_tag, properties, body))
+                received += 1
+            if window and (method is None or len(window) >= prefetch or received >= limit):
+                settle()
+            if method is None or received >= limit:
+                break
+    finally:
+        # Anything not ACKed (dry run, interrupted run) goes back into the DLQ
+        rmq.channel.cancel()
+        replay.close()
+        rmq.close()
+        resources.shutdown()
+
+    elapsed = time.monotonic() - started
+    logger.info("DLQ replay done in %.1fs: %s%s", elapsed, replay.counts,
+                f", archive {replay.archive_path}" if replay.archive_path else "")
+    return replay.counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Classify and re-drive user_onboarding_queue_dlq")
+    parser.add_argument("--queue", default="user_onboarding_queue", help="main queue (its DLQ is <queue>_dlq)")
+    parser.add_argument("--rate", type=float, help="re-drives per second (default DLQ_REPLAY_RATE or 50)")
+    parser.add_argument("--prefetch", type=int, help="un-acked DLQ messages held at once (default DLQ_REPLAY_PREFETCH or 100)")
+    parser.add_argument("--max-replays", type=int, help="archive messages replayed this often (default DLQ_REPLAY_MAX_REPLAYS or 3)")
+    parser.add_argument("--archive-dir", help="where the NDJSON archive goes (default DLQ_ARCHIVE_DIR or dlq-archive)")
+    parser.add_argument("--limit", type=int, help="handle at most this many messages (default: the DLQ depth at start)")
+    parser.add_argument("--idle-timeout", type=float, default=2.0, help="stop after this many seconds without a message")
+    parser.add_argument("--dry-run", action="store_true", help="classify one prefetch window, change nothing")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    args = parse_args()
+    counts = run_replay(args.queue, rate=args.rate, prefetch=args.prefetch, max_replays=args.max_replays,
+                        archive_dir=args.archive_dir, limit=args.limit, idle_timeout=args.idle_timeout,
+                        dry_run=args.dry_run)
+    print(json.dumps(counts))
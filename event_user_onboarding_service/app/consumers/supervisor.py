@@ -0,0 +1,145 @@
+"""
+Consumer Supervisor - Runs several consumer processes on one box
+
+Concept: Worker processes
+- One consumer process handles one message (or batch) at a time on one core
+- The supervisor starts CONSUMER_WORKERS copies of the consumer, each with
+  its own RabbitMQ connection and its own database pool
+- POOL_SIZE / MAX_OVERFLOW are the budget for the whole box, so each
+  worker gets an equal share (at least 1 connection)
+
+Concept: Restarts
+- A worker that dies is started again, waiting longer after each crash
+  in a row (1s, 2s, 4s ... max 60s)
+
+Concept: Graceful drain
+- On SIGTERM/SIGINT the supervisor passes SIGTERM to every worker
+- Each worker stops taking new messages, finishes and ACKs what it has,
+  closes its connections and exits
+- Workers still running after CONSUMER_DRAIN_TIMEOUT seconds are killed
+  (their un-ACKed messages go back to the queue)
+
+Run it with: python -m app.consumers.supervisor
+"""
+from app.logging_config import configure_logging
+from dotenv import load_dotenv
+import multiprocessing
+import threading
+import logging
+import signal
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+
+def _worker_main(index, pool_size, max_overflow, metrics_port):
+    """Entry point of one worker process"""
+    # Must be set before the Database (and its pool) is created
+    os.environ["POOL_SIZE"] = str(pool_size)
+    os.environ["MAX_OVERFLOW"] = str(max_overflow)
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f"Worker {index} draining...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    from app.consumers.user_consumer import run_consumer
+    run_consumer(stop_event=stop_event, metrics_port=metrics_port)
+    logger.info(f"Worker {index} stopped")
+
+
+class ConsumerSupervisor:
+
+    MAX_BACKOFF = 60
+    STABLE_AFTER = 60  # a worker that ran this long resets its crash count
+
+    def __init__(self, workers=None, drain_timeout=None):
+        self.workers = workers or int(os.getenv("CONSUMER_WORKERS", str(os.cpu_count() or 1)))
+        self.drain_timeout = drain_timeout or float(os.getenv("CONSUMER_DRAIN_TIMEOUT", "30"))
+
+        # Split the box-wide pool budget between the workers
+        self.pool_size = max(1, int(os.getenv("POOL_SIZE", "5")) // self.workers)
+        self.max_overflow = int(os.getenv("MAX_OVERFLOW", "0")) // self.workers
+        # Each worker serves its own /metrics on CONSUMER_METRICS_PORT + index (0 disables)
+        self.metrics_port = int(os.getenv("CONSUMER_METRICS_PORT", "9100"))
+
+        # spawn: every worker starts clean, no sockets inherited from the supervisor
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = {}  # index -> Process
+        self._started_at = {}
+        self._crashes = {}
+        self._restart_at = {}
+        self._stopping = False
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.pool_size, self.max_overflow, self.metrics_port + index if self.metrics_port else 0),
+            name=f"consumer-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            if index in self._restart_at:
+                if now >= self._restart_at[index]:
+                    del self._restart_at[index]
+                    self._spawn(index)
+                continue
+
+            if now - self._started_at[index] >= self.STABLE_AFTER:
+                self._crashes[index] = 0
+            self._crashes[index] = self._crashes.get(index, 0) + 1
+            delay = min(2 ** (self._crashes[index] - 1), self.MAX_BACKOFF)
+            logger.error(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, restarting in {delay}s")
+            self._restart_at[index] = now + delay
+
+    def _request_stop(self, signum, frame):
+        logger.info("Supervisor stopping, draining workers...")
+        self._stopping = True
+
+    def _drain(self):
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM -> worker drains
+
+        deadline = time.monotonic() + self.drain_timeout
+        for index, process in self._processes.items():
+            process.join(timeout=max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not drain in {self.drain_timeout}s, killing it")
+                process.kill()
+                process.join()
+        logger.info("All workers stopped")
+
+    def run(self):
+        configure_logging()
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        logger.info(f"Starting {self.workers} consumer workers (db pool {self.pool_size}+{self.max_overflow} each)")
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while not self._stopping:
+            self._check_workers()
+            time.sleep(1)
+
+        self._drain()
+
+
+if __name__ == "__main__":
+    ConsumerSupervisor().run()
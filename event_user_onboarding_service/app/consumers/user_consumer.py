@@ -6,12 +6,51 @@ Concept: CONSUMER
 - It listens to the queue and processes messages
 - Like a person checking their mailbox every few seconds
 """
-from app.helpers.helper import get_rmq_instance, get_db_instance, db_mapper
+from app.helpers.helper import get_db_instance, get_user_cache, get_pending_signups, remember_email, db_mapper
+from app.resources import get_resources
+from app.cache import LRUCache, MISSING
+from app.metrics import CONSUME_TO_COMMIT_SECONDS, DB_QUERY_SECONDS, SIGNUP_TO_PERSISTED_SECONDS, QueueDepthSampler, start_metrics_server
+from app.logging_config import configure_logging
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError, DataError
 import logging
+import time
+import os
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Concept: Idempotency
+# - RabbitMQ redelivers un-acked messages after a consumer crash or reconnect,
+#   so the same user_id can arrive twice
+# - user_ids this process committed recently are remembered and acked straight away,
+#   anything older is caught by ON CONFLICT (user_id) DO NOTHING on the insert
+#   (or looked up first, while the users_user_id_uidx it needs hasn't been migrated in)
+USER_ID_INDEX = "users_user_id_uidx"
+_recently_processed = LRUCache(max_size=int(os.getenv("CONSUMER_DEDUP_SIZE", "100000")),
+                               ttl=float(os.getenv("CONSUMER_DEDUP_TTL", "3600")))
+
+def _on_user_written(data):
+    """Bookkeeping once a user row is committed"""
+    # Drop any cached "user not found" for this user_id
+    get_user_cache().invalidate(data['user_id'])
+    remember_email(data['email'])
+    # The email is in users now, it no longer needs its pending reservation
+    get_pending_signups().release(data['email'], data['user_id'])
+
+def _observe_persisted(message, committed_at):
+    """End-to-end lag: API publish -> row committed (messages from older APIs have no published_at)"""
+    published_at = message.get('published_at') if isinstance(message, dict) else None
+    if published_at:
+        SIGNUP_TO_PERSISTED_SECONDS.observe(max(0.0, committed_at - published_at))
+
+def _on_user_failed(message):
+    """A message that goes to the DLQ frees its email, so the user can sign up again"""
+    try:
+        get_pending_signups().release(message['email'], message['user_id'])
+    except Exception as e:
+        logger.warning("Could not release pending signup: %s", e)
+
 def process_user_onboarding(message):
     """
     This function processes each message
@@ -22,37 +61,207 @@ def process_user_onboarding(message):
     - Returns True if successful, False if failed
     """
     try:
-        logger.info("Processing user onboarding...")
-        
+        logger.debug("Processing user onboarding...")
+
+        if _recently_processed.get(message['user_id']) is not MISSING:
+            logger.info("User %s already processed, skipping redelivery", message['user_id'])
+            return True
+
+        started = time.perf_counter()
         data = db_mapper(message)
         
         database = get_db_instance()
         user = database.get_table_class("users")
-        with database.get_db() as sess:
-            sess.add(user(**data))
+        with database.get_db(pin_primary=True) as sess, DB_QUERY_SECONDS.labels("insert_user").time():
+            inserted = _insert_ignoring_existing(sess, user.__table__, [data], _can_upsert(database))
             sess.commit()
+        CONSUME_TO_COMMIT_SECONDS.labels("single").observe(time.perf_counter() - started)
+        if inserted:
+            _observe_persisted(message, time.time())
+        else:
+            logger.info("User %s already in the database, skipping redelivery", data['user_id'])
+        _recently_processed.set(data['user_id'], True)
+        # Reads of the new row go to the primary until the replicas have it
+        database.note_write(data['user_id'])
+        _on_user_written(data)
         
-        logger.info(f"User {message.get('user_id')} processed successfully!, verification state: {message.get('verification')}")
+        logger.info("User %s processed successfully!, verification state: %s", message.get('user_id'), message.get('verification'),
+                    extra={"user_id": message.get('user_id')})
         
         return True  # Success - message will be deleted
         
     except Exception as e:
-        logger.error(f"Error processing user: {e}")
+        logger.error("Error processing user: %s", e)
+        _on_user_failed(message)
         return False  # Failure - message goes to DLQ
 
-if __name__ == "__main__":
+def _can_upsert(database):
+    """ON CONFLICT (user_id) needs the unique index on user_id, which only migration 002 creates"""
+    return USER_ID_INDEX not in database.missing_indexes
+
+def _insert_ignoring_existing(sess, table, rows, upsert=True):
+    """
+    INSERT rows, skipping user_ids that are already in the table.
+    Returns the set of user_ids that were actually inserted.
+    """
+    if upsert and sess.get_bind().dialect.name == "postgresql":
+        stmt = (postgresql.insert(table)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=["user_id"])
+                .returning(table.c.user_id))
+        return {row[0] for row in sess.execute(stmt)}
+
+    # Other databases (local stand-ins), or no unique index yet: look the user_ids up first
+    user_ids = [row['user_id'] for row in rows]
+    existing = {row[0] for row in sess.execute(select(table.c.user_id).where(table.c.user_id.in_(user_ids)))}
+    new_rows = [row for row in rows if row['user_id'] not in existing]
+    if new_rows:
+        sess.execute(insert(table).values(new_rows))
+    return {row['user_id'] for row in new_rows}
+
+def _insert_rows(sess, table, rows, lo=0, hi=None, upsert=True):
+    """
+    Insert rows[lo:hi] with one multi-row INSERT inside a savepoint.
+
+    Rows whose user_id already exists are skipped (redeliveries), they don't count as failures.
+
+    Concept: Split on failure
+    - If the INSERT fails (duplicate email, bad value...), the savepoint is
+      rolled back and the range is split in half and retried
+    - Keeps going until the failing rows are isolated one by one
+    - The good rows still end up in the same outer transaction
+
+    Returns the positions (in rows) that could not be inserted.
+    """
+    hi = len(rows) if hi is None else hi
+    if lo >= hi:
+        return []
+    try:
+        with sess.begin_nested():
+            _insert_ignoring_existing(sess, table, rows[lo:hi], upsert)
+        return []
+    except (IntegrityError, DataError) as e:
+        if hi - lo == 1:
+            logger.error("Error inserting user %s: %s", rows[lo].get('user_id'), e.orig)
+            return [lo]
+        mid = (lo + hi) // 2
+        return _insert_rows(sess, table, rows, lo, mid, upsert) + _insert_rows(sess, table, rows, mid, hi, upsert)
+
 
-    rmq = get_rmq_instance()
+def process_user_onboarding_batch(messages):
+    """
+    Batch version of process_user_onboarding
+
+    Concept: Bulk Insert
+    - One multi-row INSERT and one COMMIT for the whole batch
+      instead of one round trip + fsync per user
+    - Returns a list of True/False, one per message (same order)
+    """
+    started = time.perf_counter()
+    results = [False] * len(messages)
+    rows, positions = [], []
+    batch_user_ids = {}  # user_id -> its row in this batch
+    repeats = {}  # message index -> row of the first copy of that user_id in this batch
+    for i, message in enumerate(messages):
+        try:
+            user_id = message['user_id']
+            if _recently_processed.get(user_id) is not MISSING:
+                # Redelivery of a message we already committed - just ACK it
+                results[i] = True
+                continue
+            if user_id in batch_user_ids:
+                # Same user twice in this batch: it shares the outcome of the first copy,
+                # known only after the commit (ACKing it now would lose it if that one fails)
+                repeats[i] = batch_user_ids[user_id]
+                continue
+            rows.append(db_mapper(message))
+            positions.append(i)
+            batch_user_ids[user_id] = len(rows) - 1
+        except Exception as e:
+            logger.error("Error mapping message %s: %s", message.get('user_id') if isinstance(message, dict) else None, e)
+
+    if not rows:
+        return results
+
+    try:
+        database = get_db_instance()
+        user = database.get_table_class("users")
+        with database.get_db(pin_primary=True) as sess, DB_QUERY_SECONDS.labels("insert_users_batch").time():
+            failed = set(_insert_rows(sess, user.__table__, rows, upsert=_can_upsert(database)))
+            sess.commit()
+        CONSUME_TO_COMMIT_SECONDS.labels("batch").observe(time.perf_counter() - started)
+        committed_at = time.time()
+    except Exception:
+        # Whole batch goes to the DLQ
+        for message in messages:
+            _on_user_failed(message)
+        raise
+
+    for row_index, message_index in enumerate(positions):
+        results[message_index] = row_index not in failed
+        if results[message_index]:
+            _observe_persisted(messages[message_index], committed_at)
+    for message_index, row_index in repeats.items():
+        results[message_index] = row_index not in failed
+    for i, message in enumerate(messages):
+        if not results[i]:
+            _on_user_failed(message)
+    written = [row for row_index, row in enumerate(rows) if row_index not in failed]
+    # Reads of the new rows go to the primary until the replicas have them
+    database.note_writes([row['user_id'] for row in written])
+    for row in written:
+        _recently_processed.set(row['user_id'], True)
+        _on_user_written(row)
+
+    logger.info("Batch of %s users processed, %s failed", len(messages), len(messages) - sum(results))
+    return results
 
-    if not rmq.channel or rmq.channel.is_closed:
-        rmq.connect()
 
-    # Start consuming (this runs forever until you stop it)
+def run_consumer(stop_event=None, metrics_port=None):
+    """
+    Consume user_onboarding_queue until interrupted, or until stop_event is
+    set (then the in-flight message/batch is finished and ACKed first)
+
+    Metrics are served on metrics_port (default CONSUMER_METRICS_PORT, 0 disables)
+    """
+    configure_logging()
+
+    # Create the Database and RabbitMQ connection once for the whole process
+    resources = get_resources()
+    resources.startup()
+    rmq = resources.rmq
+
+    metrics_port = int(os.getenv("CONSUMER_METRICS_PORT", "9100")) if metrics_port is None else metrics_port
+    sampler = None
+    if metrics_port:
+        try:
+            start_metrics_server(metrics_port)
+            sampler = QueueDepthSampler(["user_onboarding_queue", "user_onboarding_queue_dlq"],
+                                        interval=float(os.getenv("QUEUE_DEPTH_SAMPLE_SECONDS", "15"))).start()
+        except OSError as e:
+            logger.warning("Could not start metrics server on port %s: %s", metrics_port, e)
+
+    # Batch mode is enabled when CONSUMER_BATCH_SIZE > 1
+    batch_size = int(os.getenv("CONSUMER_BATCH_SIZE", "1"))
+    max_linger = int(os.getenv("CONSUMER_BATCH_LINGER_MS", "50")) / 1000
+    prefetch_count = int(os.getenv("CONSUMER_PREFETCH_COUNT", str(batch_size)))
+
+    # Start consuming (this runs until you stop it)
     try:
         logger.info("Starting consumer...")
-        rmq.consume_messages("user_onboarding_queue", process_user_onboarding)
+        if batch_size > 1:
+            rmq.consume_batches("user_onboarding_queue", process_user_onboarding_batch,
+                                batch_size=batch_size, max_linger=max_linger, prefetch_count=prefetch_count,
+                                stop_event=stop_event)
+        else:
+            rmq.consume_messages("user_onboarding_queue", process_user_onboarding, stop_event=stop_event)
     except KeyboardInterrupt:
         logger.info("Stopping consumer...")
-        rmq.close()
-    except Exception as e:
-        raise
\ No newline at end of file
+    finally:
+        if sampler:
+            sampler.stop()
+        resources.shutdown()
+
+
+if __name__ == "__main__":
+    run_consumer()
@@ -1,40 +1,216 @@
-from sqlalchemy import create_engine, MetaData, orm
-from sqlalchemy.ext.automap import automap_base
+"""
+Database - the primary, optional read replicas, and sessions that route between them
+
+Concept: Read/write routing
+- DB_URL is the primary; DB_REPLICA_URLS (comma separated) are read replicas,
+  each with its own engine and pool (DB_REPLICA_POOL_SIZE / DB_REPLICA_MAX_OVERFLOW,
+  default POOL_SIZE / MAX_OVERFLOW)
+- Sessions pick the engine per statement (RoutingSession.get_bind): plain
+  SELECTs go to a replica (round robin), everything else - INSERT/UPDATE/DELETE,
+  SELECT ... FOR UPDATE, flushes, raw SQL, get_bind() without a statement -
+  goes to the primary
+- Without DB_REPLICA_URLS every statement goes to the primary, as before
+
+Concept: Read-your-writes
+- Replicas lag behind the primary. Once a session has written, the rest of
+  its reads go to the primary too, so it always sees its own writes
+- get_db(pin_primary=True) sends every statement of the session to the
+  primary: for reads that decide a write (read-modify-write, duplicate checks)
+- note_writes(keys) remembers writes for DB_READ_YOUR_WRITES_SECONDS (default 2);
+  wrote_recently(key) tells a later session (e.g. the GET right after a
+  verify) to pin itself to the primary until the replicas have caught up
+- With a shared store (SHARED_STORE_URL) the marks are kept there too
+  (shared_store.write_marker), so the GET pins itself to the primary in
+  whichever process it lands; a store that can't be reached sends the read
+  to the primary
+
+Concept: Replica failures
+- A replica that drops a connection is skipped for DB_REPLICA_RETRY_SECONDS
+  (default 10); with no replica left, reads go to the primary
+"""
+from sqlalchemy import create_engine, event, orm
 from contextlib import contextmanager
+from app.models import Base, MODELS
+from app.migrations import apply_migrations, check_schema, check_indexes
+from app.metrics import DB_ROUTED
+from app.shared_store import write_marker
 from dotenv import load_dotenv
+import itertools
+import threading
+import asyncio
+import time
 import os
-import ast
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv(dotenv_path="app/configs/.env")
 
-class Database:
-    def __init__(self):
-        self.engine = create_engine(os.getenv("DB_URL"), 
-                                    pool_pre_ping=True, 
-                                    pool_size=int(os.getenv("POOL_SIZE")), 
-                                    max_overflow=int(os.getenv("MAX_OVERFLOW")), 
+
+def replica_urls():
+    return [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+
+
+def replica_pool_args():
+    return {"pool_size": int(os.getenv("DB_REPLICA_POOL_SIZE") or os.getenv("POOL_SIZE")),
+            "max_overflow": int(os.getenv("DB_REPLICA_MAX_OVERFLOW") or os.getenv("MAX_OVERFLOW"))}
+
+
+def _is_read(clause):
+    """A plain SELECT (not FOR UPDATE) that a replica can answer"""
+    return (clause is not None and getattr(clause, "is_select", False)
+            and getattr(clause, "_for_update_arg", None) is None)
+
+
+class RoutingSession(orm.Session):
+    """Session that sends reads to a replica and everything else to the primary"""
+
+    def __init__(self, router=None, **kwargs):
+        super().__init__(**kwargs)
+        self.router = router
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        router = self.router
+        if router is None or not router.replicas:
+            return super().get_bind(mapper, clause, **kwargs)
+        if self._flushing or not _is_read(clause):
+            # Writes, and statements that can't be told apart from one (raw SQL,
+            # ORM inserts that only pass a mapper): the rest of the session stays on the primary
+            self.info["wrote"] = True
+            DB_ROUTED.labels("primary").inc()
+            return router.primary_bind
+        if self.info.get("pin_primary") or self.info.get("wrote"):
+            DB_ROUTED.labels("primary").inc()
+            return router.primary_bind
+        replica = router.replica()
+        DB_ROUTED.labels("replica" if replica is not None else "primary").inc()
+        return replica if replica is not None else router.primary_bind
+
+
+class ReadRouting:
+    """Replica bookkeeping shared by Database and AsyncDatabase"""
+
+    def _init_routing(self, primary_bind, replicas, shared=None):
+        """primary_bind / replicas are (sync) Engines, shared the optional cross-process store"""
+        self.primary_bind = primary_bind
+        self.shared = shared
+        self.replicas = list(replicas)
+        self.replica_retry = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "10"))
+        self.read_your_writes = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "2"))
+        self._next_replica = itertools.cycle(range(len(self.replicas))) if self.replicas else None
+        self._replica_down_until = [0.0] * len(self.replicas)
+        self._recent_writes = {}
+        self._writes_lock = threading.Lock()
+        for index, engine in enumerate(self.replicas):
+            event.listen(engine, "handle_error", lambda context, index=index: self._replica_failed(index, context))
+
+    def replica(self):
+        """The next healthy replica engine, None if there is none"""
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            index = next(self._next_replica)
+            if self._replica_down_until[index] <= now:
+                return self.replicas[index]
+        return None
+
+    def _replica_failed(self, index, context):
+        if context.is_disconnect:
+            self._replica_down_until[index] = time.monotonic() + self.replica_retry
+            logger.warning("Read replica %s failed, sending its reads to the primary for %ss: %s",
+                           index, self.replica_retry, context.original_exception)
+
+    def note_writes(self, keys):
+        """
+        Reads of these keys go to the primary for the next DB_READ_YOUR_WRITES_SECONDS,
+        in every process. The shared mark is set even without replicas: the user
+        cache doesn't fill while it exists (see app/cache.py)
+        """
+        if not keys:
+            return
+        if self.replicas:
+            now = time.monotonic()
+            with self._writes_lock:
+                for key in keys:
+                    self._recent_writes[key] = now + self.read_your_writes
+                if len(self._recent_writes) > 10000:
+                    self._recent_writes = {k: until for k, until in self._recent_writes.items() if until > now}
+        if self.shared is not None:
+            try:
+                self.shared.set_many({write_marker(key): "1" for key in keys}, self.read_your_writes)
+            except Exception as e:
+                logger.warning("Shared read-your-writes mark failed for %s keys: %s", len(keys), e)
+
+    def note_write(self, key):
+        self.note_writes([key])
+
+    def wrote_recently(self, key):
+        if not self.replicas:
+            return False
+        if self._recent_writes.get(key, 0) > time.monotonic():
+            return True
+        if self.shared is None:
+            return False
+        try:
+            return self.shared.get(write_marker(key)) is not None
+        except Exception as e:
+            # Can't tell: the primary is always up to date
+            logger.warning("Shared read-your-writes check failed: %s", e)
+            return True
+
+    async def anote_writes(self, keys):
+        if self.shared is not None:
+            return await asyncio.to_thread(self.note_writes, keys)
+        return self.note_writes(keys)
+
+    async def awrote_recently(self, key):
+        if self.shared is not None and self.replicas:
+            return await asyncio.to_thread(self.wrote_recently, key)
+        return self.wrote_recently(key)
+
+    @staticmethod
+    def _start_session(db, pin_primary):
+        # Sessions are thread-local and reused: reset the routing hints on every checkout
+        db.info["pin_primary"] = pin_primary
+        db.info.pop("wrote", None)
+
+
+class Database(ReadRouting):
+    # Names of migrations.EXPECTED_INDEXES the live table lacks (set on connect)
+    missing_indexes = ()
+
+    def __init__(self, shared=None):
+        self.engine = create_engine(os.getenv("DB_URL"),
+                                    pool_pre_ping=True,
+                                    pool_size=int(os.getenv("POOL_SIZE")),
+                                    max_overflow=int(os.getenv("MAX_OVERFLOW")),
                                     echo=False)
-        self.metadata = MetaData()
-        self.metadata.reflect(self.engine,only=ast.literal_eval(os.getenv("TABLES")))
-        self.Base = automap_base(metadata=self.metadata)
-        self.Base.prepare()
+        if os.getenv("DB_AUTO_MIGRATE", "false").lower() == "true":
+            apply_migrations(self.engine)
+
+        # The schema comes from app/models.py, no reflection round trips;
+        # one query checks that the live tables still match it
+        self.metadata = Base.metadata
+        with self.engine.connect() as conn:
+            check_schema(conn, self.metadata.sorted_tables)
+            self.missing_indexes = check_indexes(conn)
 
+        replicas = [create_engine(url, pool_pre_ping=True, echo=False, **replica_pool_args()) for url in replica_urls()]
+        self._init_routing(self.engine, replicas, shared)
         self._session_factory = orm.scoped_session(
             orm.sessionmaker(
+                class_=RoutingSession,
+                router=self,
                 autocommit=False,
                 autoflush=False,
                 bind=self.engine,
             )
         )
-        logger.info(f"Database Connection initialized with tables: {self.metadata.tables.keys()}")
+        logger.info(f"Database Connection initialized with tables: {self.metadata.tables.keys()}, {len(replicas)} read replicas")
 
     @contextmanager
-    def get_db(self):
+    def get_db(self, pin_primary=False):
         db = self._session_factory()
+        self._start_session(db, pin_primary)
         try:
             yield db
         except Exception as e:
@@ -44,9 +220,24 @@ class Database:
         finally:
             db.close()
 
+    @contextmanager
+    def get_stream_db(self):
+        """
+        A session of its own instead of the thread's: for generators (streamed
+        responses) whose steps run on whichever threadpool thread is free
+        """
+        db = self._session_factory.session_factory()
+        self._start_session(db, False)
+        try:
+            yield db
+        finally:
+            db.close()
+
     def get_table_class(self, table_name: str):
-        return getattr(self.Base.classes, table_name)
+        return MODELS[table_name]
 
     def db_connection_close(self):
         self.engine.dispose()
+        for engine in self.replicas:
+            engine.dispose()
         logger.info("Database connection closed")
@@ -0,0 +1,166 @@
+"""
+Dependency supervisor - brings the API's database and broker up in the background
+
+Concept: Non-blocking startup
+- Connecting with helper.retry() sleeps between attempts (time.sleep, up to
+  10s each). Called from the async startup hook that froze the event loop:
+  while Postgres or RabbitMQ were slow nothing was answered, not even a
+  health check
+- Now startup only starts one asyncio task per dependency and returns. The
+  blocking connects run on worker threads (asyncio.to_thread), the asyncio
+  ones are awaited, all dependencies at the same time
+
+Concept: Reconnect with jittered backoff
+- A failed connect is tried again after a random delay in
+  [0, min(DEPENDENCY_RETRY_MAX, DEPENDENCY_RETRY_BASE * 2^attempt)]
+  ("full jitter"), so a fleet of API processes doesn't hit a recovering
+  database in lock step
+- Once up, each dependency is checked every DEPENDENCY_CHECK_INTERVAL seconds
+  (SELECT 1 / the broker connection is open). The clients reconnect on their
+  own (pool_pre_ping, pool replacement, publisher and connect_robust
+  reconnects); the check only tracks whether they currently can
+
+Concept: Fail fast
+- While a dependency is down the registry raises DependencyUnavailable
+  (503 + Retry-After) instead of connecting inline, so a request during an
+  outage costs microseconds instead of a connect timeout
+- GET /health/live answers as long as the event loop does, GET /health/ready
+  is 503 until every dependency is up (load balancer / orchestrator probes)
+
+Settings: DEPENDENCY_RETRY_BASE (default 0.5s), DEPENDENCY_RETRY_MAX (30s),
+DEPENDENCY_CHECK_INTERVAL (5s), DEPENDENCY_CHECK_TIMEOUT (3s)
+"""
+from app.resources import ResourceRegistry
+from app.metrics import DEPENDENCY_UP, DEPENDENCY_RECONNECTS
+from dotenv import load_dotenv
+import asyncio
+import logging
+import random
+import time
+import os
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE = float(os.getenv("DEPENDENCY_RETRY_BASE", "0.5"))
+RETRY_MAX = float(os.getenv("DEPENDENCY_RETRY_MAX", "30"))
+CHECK_INTERVAL = float(os.getenv("DEPENDENCY_CHECK_INTERVAL", "5"))
+CHECK_TIMEOUT = float(os.getenv("DEPENDENCY_CHECK_TIMEOUT", "3"))
+
+
+def backoff(attempt, base=RETRY_BASE, cap=RETRY_MAX):
+    """Full jitter: anywhere between 0 and the capped exponential delay"""
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, 16)))
+
+
+def _ping_db(db):
+    from sqlalchemy import text
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def _ping_async_db(async_db):
+    from sqlalchemy import text
+    async with async_db.engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+def _ping_rmq_pool(pool):
+    # checkout() health-checks an idle connection (or opens one)
+    pool.checkin(pool.checkout(timeout=CHECK_TIMEOUT))
+
+
+async def _check_publisher(publisher):
+    if not publisher.is_ready:
+        raise ConnectionError("RabbitMQ confirming publisher is reconnecting")
+
+
+async def _check_async_rmq(rmq):
+    if rmq.connection is None or rmq.connection.is_closed:
+        raise ConnectionError("RabbitMQ connection is closed")
+
+
+# name -> coroutine function(resource) that raises while the resource can't be used
+CHECKS = {
+    "db": lambda db: asyncio.to_thread(_ping_db, db),
+    "rmq_pool": lambda pool: asyncio.to_thread(_ping_rmq_pool, pool),
+    "publisher": _check_publisher,
+    "async_db": _ping_async_db,
+    "async_rmq": _check_async_rmq,
+}
+
+
+class DependencySupervisor:
+
+    def __init__(self, resources: ResourceRegistry, names):
+        self.resources = resources
+        self.names = tuple(names)
+        self.status = {name: {"up": False, "since": time.time(), "attempts": 0, "error": None} for name in self.names}
+        self._tasks = []
+
+    def start(self):
+        """Mark every dependency as down and start supervising them (returns immediately)"""
+        for name in self.names:
+            self._set(name, False)
+        self._tasks = [asyncio.create_task(self._supervise(name), name=f"supervise-{name}") for name in self.names]
+        return self
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.resources.unsupervise()
+
+    @property
+    def ready(self):
+        return all(status["up"] for status in self.status.values())
+
+    def report(self):
+        """Per-dependency status for GET /health/ready"""
+        return {name: {"status": "up" if status["up"] else "down",
+                       "since": status["since"],
+                       "attempts": status["attempts"],
+                       "error": status["error"]}
+                for name, status in self.status.items()}
+
+    def _set(self, name, up, error=None):
+        status = self.status[name]
+        if status["up"] != up:
+            status["since"] = time.time()
+        status["up"] = up
+        status["error"] = None if up else (str(error) if error else status["error"])
+        status["attempts"] = 0 if up else status["attempts"]
+        DEPENDENCY_UP.labels(name).set(1 if up else 0)
+        self.resources.supervise(name, up)
+
+    async def _connect_and_check(self, name):
+        if name.startswith("async_"):
+            await self.resources.aconnect(name)
+        else:
+            await asyncio.to_thread(self.resources.connect, name)
+        await asyncio.wait_for(CHECKS[name](self.resources.loaded(name)), CHECK_TIMEOUT)
+
+    async def _supervise(self, name):
+        while True:
+            try:
+                await self._connect_and_check(name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status = self.status[name]
+                status["attempts"] += 1
+                delay = backoff(status["attempts"])
+                if status["up"]:
+                    logger.error("%s went down: %s", name, e)
+                logger.warning("%s unavailable (attempt %s): %s, retrying in %.1fs", name, status["attempts"], e, delay)
+                DEPENDENCY_RECONNECTS.labels(name).inc()
+                self._set(name, False, e)
+                await asyncio.sleep(delay)
+                continue
+
+            if not self.status[name]["up"]:
+                logger.info("%s is up", name)
+                self._set(name, True)
+            await asyncio.sleep(CHECK_INTERVAL)
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from app.views.async_publish_view import onboard_user, onboard_users, get_user_details, update_user_details, verify_many_users, list_users, export_users
+from app.views import batch, listing
+from app.endpoints import routes
+from app.responses import respond
+from app.schema import UserRequest, VerifyRequest
+from datetime import datetime
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Same routes as publish_endpoint, but `async def`: requests run on the event
+# loop instead of the threadpool (used when API_MODE=async)
+router = APIRouter()
+
+@router.post(**routes.SIGNUP)
+async def publish(request: UserRequest):
+    data = request.dict()
+    logger.debug("Signup request received for %s", data["email"])
+    try:
+        user_response = await onboard_user(data)
+        return respond(user_response, status.HTTP_201_CREATED)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post(**routes.SIGNUP_BATCH)
+async def publish_batch(request: Request):
+    try:
+        response = await batch.signup_all(request, onboard_users)
+        logger.info("Batch signup of %s users", len(response["results"]))
+        return respond(response)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(**routes.LIST_USERS)
+async def get_users(verification_state: Optional[str] = None, created_from: Optional[datetime] = None,
+                    created_to: Optional[datetime] = None, cursor: Optional[str] = None,
+                    limit: int = routes.PAGE_LIMIT):
+    try:
+        return respond(await list_users(cursor, limit, verification_state=verification_state,
+                                        created_from=created_from, created_to=created_to))
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(**routes.EXPORT_USERS)
+async def export(verification_state: Optional[str] = None, created_from: Optional[datetime] = None,
+                 created_to: Optional[datetime] = None):
+    try:
+        chunks = await export_users(verification_state=verification_state, created_from=created_from, created_to=created_to)
+        return StreamingResponse(chunks, media_type=listing.NDJSON_MEDIA_TYPE)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put(**routes.VERIFY_USERS)
+async def verify_users(request: VerifyRequest):
+    try:
+        return respond(await verify_many_users(request.user_ids))
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(**routes.GET_USER)
+async def get_user(user_id: str):
+    try:
+        user_details = await get_user_details(user_id)
+        return respond(user_details)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put(**routes.UPDATE_USER)
+async def update_user(user_id: str):
+    try:
+        user_details = await update_user_details(user_id)
+        return respond(user_details)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
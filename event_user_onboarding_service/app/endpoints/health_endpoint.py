@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+router = APIRouter()
+
+@router.get("/health/live")
+async def live():
+    """The process is up and its event loop answers (never touches a dependency)"""
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+async def ready(request: Request):
+    """200 once every supervised dependency is up, 503 with the per-dependency status otherwise"""
+    supervisor = getattr(request.app.state, "dependencies", None)
+    if supervisor is None:
+        # Startup hasn't run (no supervisor): resources are created on first use
+        return {"status": "ready", "dependencies": {}}
+    body = {"status": "ready" if supervisor.ready else "not ready", "dependencies": supervisor.report()}
+    return JSONResponse(body, status_code=200 if supervisor.ready else 503)
@@ -1,42 +1,92 @@
-from fastapi import APIRouter, HTTPException, status
-from app.views.publish_view import onboard_user, get_user_details, update_user_details
-from app.schema import UserRequest, UserResponse, UserDetailsResponse
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from app.views.publish_view import onboard_user, onboard_users, get_user_details, update_user_details, verify_many_users, list_users, export_users
+from app.views import batch, listing
+from app.endpoints import routes
+from app.responses import respond
+from app.schema import UserRequest, VerifyRequest
+from datetime import datetime
+from typing import Optional
 import logging
-import json
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-@router.post("/signup", status_code=status.HTTP_201_CREATED, response_model=UserResponse)
+@router.post(**routes.SIGNUP)
 def publish(request: UserRequest):
     data = request.dict()
-    logger.info(f"Request received: {data}")
+    logger.debug("Signup request received for %s", data["email"])
     try:
         user_response = onboard_user(data)
-        return user_response
+        return respond(user_response, status.HTTP_201_CREATED)
     except HTTPException as e:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/users/{user_id}", status_code=status.HTTP_200_OK, response_model=UserDetailsResponse)
+@router.post(**routes.SIGNUP_BATCH)
+async def publish_batch(request: Request):
+    try:
+        # async def so the NDJSON body can be read as it streams in; the blocking
+        # database/RabbitMQ work of each chunk still runs on the threadpool
+        response = await batch.signup_all(request, lambda chunk, seen_emails: run_in_threadpool(onboard_users, chunk, seen_emails))
+        logger.info("Batch signup of %s users", len(response["results"]))
+        return respond(response)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(**routes.LIST_USERS)
+def get_users(verification_state: Optional[str] = None, created_from: Optional[datetime] = None,
+              created_to: Optional[datetime] = None, cursor: Optional[str] = None,
+              limit: int = routes.PAGE_LIMIT):
+    try:
+        return respond(list_users(cursor, limit, verification_state=verification_state,
+                                  created_from=created_from, created_to=created_to))
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(**routes.EXPORT_USERS)
+def export(verification_state: Optional[str] = None, created_from: Optional[datetime] = None,
+           created_to: Optional[datetime] = None):
+    try:
+        chunks = export_users(verification_state=verification_state, created_from=created_from, created_to=created_to)
+        return StreamingResponse(chunks, media_type=listing.NDJSON_MEDIA_TYPE)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.put(**routes.VERIFY_USERS)
+def verify_users(request: VerifyRequest):
+    try:
+        return respond(verify_many_users(request.user_ids))
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get(**routes.GET_USER)
 def get_user(user_id: str):
     try:
         user_details = get_user_details(user_id)
-        return user_details
+        return respond(user_details)
     except HTTPException as e:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.put("/users/{user_id}", status_code=status.HTTP_200_OK)
+@router.put(**routes.UPDATE_USER)
 def update_user(user_id: str):
     try:
         user_details = update_user_details(user_id)
-        return user_details
+        return respond(user_details)
     except HTTPException as e:
         raise
     except Exception as e:
@@ -0,0 +1,62 @@
+"""
+Route declarations shared by publish_endpoint (sync) and async_publish_endpoint
+
+Concept: One API, two modes
+- API_MODE picks which module serves the routes; both declare the same
+  paths, status codes, response models and OpenAPI docs from here, so the
+  two can only differ in how they call their view
+"""
+from fastapi import Query, status
+from fastapi.responses import StreamingResponse
+from app.views import listing
+from app.schema import UserResponse, UserDetailsResponse, UserListResponse, VerifyResponse
+
+SIGNUP = {"path": "/signup", "status_code": status.HTTP_201_CREATED, "response_model": UserResponse}
+
+SIGNUP_BATCH = {
+    "path": "/signup/batch",
+    "status_code": status.HTTP_200_OK,
+    "description": "Sign up many users at once: a JSON array, or NDJSON (one user per line, "
+                   "Content-Type: application/x-ndjson) which is processed while it streams in. "
+                   "Returns one result per item: created / conflict / invalid / error",
+    "openapi_extra": {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/UserRequest"}}},
+                listing.NDJSON_MEDIA_TYPE: {"schema": {"type": "string", "description": "One UserRequest JSON object per line"}},
+            },
+        }
+    },
+}
+
+# Declared before /users/{user_id} so "export" and "verify" aren't taken for a user_id
+LIST_USERS = {
+    "path": "/users",
+    "status_code": status.HTTP_200_OK,
+    "response_model": UserListResponse,
+    "description": "Users ordered by (created_on, id), `limit` per page. Pass the `next_cursor` of a page as "
+                   "`cursor` to get the next one (null on the last page). created_from is inclusive, created_to exclusive",
+}
+
+PAGE_LIMIT = Query(listing.PAGE_SIZE, ge=1, le=listing.PAGE_MAX)
+
+EXPORT_USERS = {
+    "path": "/users/export",
+    "status_code": status.HTTP_200_OK,
+    "response_class": StreamingResponse,
+    "responses": {200: {"content": {listing.NDJSON_MEDIA_TYPE: {}}}},
+    "description": "Every matching user as NDJSON (one JSON object per line), streamed in (created_on, id) order",
+}
+
+VERIFY_USERS = {
+    "path": "/users/verify",
+    "status_code": status.HTTP_200_OK,
+    "response_model": VerifyResponse,
+    "description": 'Verify many users at once: {"user_ids": [...]}. One set-based statement per VERIFY_CHUNK ids; '
+                   "every id gets verified / already_verified / not_found",
+}
+
+GET_USER = {"path": "/users/{user_id}", "status_code": status.HTTP_200_OK, "response_model": UserDetailsResponse}
+
+UPDATE_USER = {"path": "/users/{user_id}", "status_code": status.HTTP_200_OK}
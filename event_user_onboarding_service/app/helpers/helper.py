@@ -1,11 +1,9 @@
 import logging
 import time
-from app.db_conn import Database
-from app.rmq_adapter import RabbitMQHelper
+from app.metrics import RETRIES
+from app.helpers.passwords import hash_password, cost_from_env
 from datetime import datetime
-from base64 import b64encode
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -17,40 +15,126 @@ def retry(func, name="operation", max_retries=3):
             return func()
         except Exception as e:
             if attempt < max_retries:
-                logger.warning(f"{name} failed (attempt {attempt}/{max_retries}), retrying in {delay}s...")
+                RETRIES.labels(name).inc()
+                logger.warning("%s failed (attempt %s/%s), retrying in %ss...", name, attempt, max_retries, delay)
                 time.sleep(delay)
                 delay = min(delay * 2, 10)  # Exponential backoff, max 10s
             else:
-                logger.error(f"{name} failed after {max_retries} attempts: {e}")
+                logger.error("%s failed after %s attempts: %s", name, max_retries, e)
                 raise
 
-# Import global db instance (lazy import to avoid circular dependencies)
+# Process-wide instances (lazy import to avoid circular dependencies)
 def get_db_instance():
-    """Get global db instance from main, or create new one if not available"""
-    try:
-        from app.main import db
-        return db if db else Database()
-    except (ImportError, AttributeError):
-        # If main hasn't initialized db yet, create a new instance
-        return Database()
+    """Get the process-wide db instance, created once on first use"""
+    from app.resources import get_resources
+    return get_resources().db
 
 def get_rmq_instance():
-    try:
-        from app.main import rmq
-        return rmq if rmq else RabbitMQHelper()
-    except (ImportError, AttributeError):
-        # If main hasn't initialized rmq yet, create a new instance
-        return RabbitMQHelper()
+    """Get the process-wide rmq instance, created once on first use"""
+    from app.resources import get_resources
+    return get_resources().rmq
 
-def db_mapper(data: dict):
+def get_rmq_pool():
+    """Get the process-wide RabbitMQ pool, safe to publish from any thread"""
+    from app.resources import get_resources
+    return get_resources().rmq_pool
+
+def get_publisher():
+    """Get the process-wide confirming publisher, safe to publish from any thread"""
+    from app.resources import get_resources
+    return get_resources().publisher
+
+def publisher_confirms_enabled():
+    from app.resources import get_resources
+    return get_resources().publisher_confirms
+
+def get_user_cache():
+    """Get the process-wide cache for GET /users/{user_id}"""
+    from app.resources import get_resources
+    return get_resources().user_cache
+
+def get_email_filter():
+    """Get the process-wide Bloom filter of known emails (None if disabled)"""
+    from app.resources import get_resources
+    return get_resources().email_filter
+
+def get_pending_signups():
+    """Get the process-wide index of published-but-not-committed signups"""
+    from app.resources import get_resources
+    return get_resources().pending_signups
+
+def get_spool():
+    """
+    Get this process' write-ahead spool (None if it has none). A spool that
+    failed (disk error) is left out: signups go straight to RabbitMQ again,
+    what it already holds is still forwarded
+    """
+    from app.resources import get_resources
+    spool = get_resources().loaded("spool")
+    return None if spool is None or spool.failed else spool
+
+def get_password_hasher():
+    """Get the process-wide scrypt process pool (started on first use)"""
+    from app.resources import get_resources
+    return get_resources().password_hasher
+
+def remember_email(email: str):
+    """
+    A newly inserted email: added to this process' Bloom filter if it has one,
+    and marked recent in the shared store so API workers whose filter hasn't
+    refreshed yet still check it against the database (see app.bloom)
+    """
+    from app.resources import get_resources
+    from app.bloom import remember_recent
+    resources = get_resources()
+    email_filter = resources.loaded("email_filter")
+    if email_filter is not None:
+        email_filter.add(email)
+    shared = resources.shared_store
+    if shared is not None:
+        try:
+            remember_recent(shared, email)
+        except Exception as e:
+            logger.warning("Could not mark %s as recently inserted: %s", email, e)
+
+async def get_async_db_instance():
+    """Get the process-wide AsyncDatabase, created once on first use"""
+    from app.resources import get_resources
+    return await get_resources().get_async_db()
+
+async def get_async_rmq_instance():
+    """Get the process-wide AsyncRabbitMQHelper, created once on first use"""
+    from app.resources import get_resources
+    return await get_resources().get_async_rmq()
+
+def normalize_email(email: str):
+    """Emails are stored and compared trimmed and lowercase"""
+    return email.strip().lower()
+
+def _db_mapper_v1(data: dict):
     temp = {}
 
-    temp['email'] = data['email']
+    temp['email'] = normalize_email(data['email'])
     temp['first_name'] = data['first_name']
     temp['last_name'] = data['last_name']
-    temp['password'] = b64encode(data['password'].encode()).decode()
+    if 'password_hash' in data:
+        temp['password'] = data['password_hash']
+    else:
+        # Published before the API hashed passwords: hash it here (slow, only for those old messages)
+        temp['password'] = hash_password(data['password'], **cost_from_env())
     temp['user_id'] = data['user_id']
     temp['verification_state'] = data['verification']
     temp['created_on'] = datetime.now()
 
-    return temp
\ No newline at end of file
+    return temp
+
+# Message schema version ("v", see app/message_codec.py) -> row mapper
+DB_MAPPERS = {1: _db_mapper_v1}
+
+def db_mapper(data: dict):
+    """Map a queue message to a users row, by its schema version (messages without one are version 1)"""
+    version = data.get('v', 1)
+    mapper = DB_MAPPERS.get(version)
+    if mapper is None:
+        raise ValueError(f"Unsupported message schema version {version}")
+    return mapper(data)
\ No newline at end of file
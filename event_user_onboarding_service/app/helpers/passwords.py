@@ -0,0 +1,56 @@
+"""
+Password hashing with scrypt (hashlib)
+
+Concept: Memory-hard KDF
+- scrypt needs 128 * r * n bytes of memory per hash (16 MiB with the
+  defaults), so guessing passwords on GPUs/ASICs is expensive too, not just slow
+- n (CPU/memory cost, a power of 2), r (block size) and p (parallelism) are
+  stored with every hash, so the cost can be raised later without breaking
+  the hashes that already exist
+
+Format: scrypt$<n>$<r>$<p>$<salt, base64>$<key, base64>
+Stored values without the scrypt$ prefix are the old base64 "encoding" of the
+plaintext (before hashing was introduced); verify_password() still accepts them.
+
+Kept free of app imports: it is what the hashing worker processes load
+(see app.password_hasher)
+"""
+from base64 import b64encode, b64decode
+import hashlib
+import hmac
+import os
+
+PREFIX = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 64
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int):
+    # Room for the 128 * r * n working buffer (hashlib refuses anything above maxmem)
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * r * (n + p), dklen=KEY_BYTES)
+
+
+def cost_from_env():
+    """scrypt cost from PASSWORD_SCRYPT_N / _R / _P"""
+    return {"n": int(os.getenv("PASSWORD_SCRYPT_N", "16384")),
+            "r": int(os.getenv("PASSWORD_SCRYPT_R", "8")),
+            "p": int(os.getenv("PASSWORD_SCRYPT_P", "1"))}
+
+
+def hash_password(password: str, n: int = 16384, r: int = 8, p: int = 1) -> str:
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(password, salt, n, r, p)
+    return f"{PREFIX}${n}${r}${p}${b64encode(salt).decode()}${b64encode(key).decode()}"
+
+
+def verify_password(password: str, stored: str) -> bool:
+    if not stored.startswith(PREFIX + "$"):
+        # Legacy row: base64 of the plaintext
+        return hmac.compare_digest(b64encode(password.encode()).decode(), stored)
+    _, n, r, p, salt, key = stored.split("$")
+    return hmac.compare_digest(_scrypt(password, b64decode(salt), int(n), int(r), int(p)), b64decode(key))
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(PREFIX + "$")
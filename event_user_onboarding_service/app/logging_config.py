@@ -0,0 +1,222 @@
+"""
+Logging - one setup for the whole process
+
+Concept: Queue handler
+- Writing a log line is I/O (a syscall per line, sometimes a blocked pipe)
+- Request threads only put the record on an in-memory queue; a background
+  QueueListener thread formats and writes it
+- If the queue is full the record is dropped (and counted) instead of
+  blocking the request
+
+Concept: Lazy formatting
+- logger.info("User %s processed", user_id) only builds the string if the
+  record is actually written; an f-string is built even when the level or
+  the sampler throws the line away
+- Formatting happens on the listener thread, not on the request thread
+
+Concept: Sampling
+- LOG_SAMPLE_RATES="app.consumers.user_consumer=0.01,app.views=0.1" keeps
+  1% / 10% of the INFO and DEBUG lines of those loggers (and their children)
+- WARNING and above are never sampled
+
+Concept: Redaction
+- Fields named in LOG_REDACT_FIELDS (default password, password_hash) are
+  replaced with *** in dict arguments, in extra={...} fields and in the
+  final message text
+
+Settings: LOG_LEVEL (default INFO), LOG_FORMAT (json or text, default json),
+LOG_QUEUE_SIZE (default 10000), LOG_SAMPLE_RATES, LOG_REDACT_FIELDS
+"""
+from logging.handlers import QueueHandler, QueueListener
+from dotenv import load_dotenv
+from datetime import datetime, timezone
+import threading
+import logging
+import random
+import atexit
+import queue
+import json
+import os
+import re
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+REDACTED = "***"
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_configured = False
+_listener = None
+_lock = threading.Lock()
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the low-level lines of the configured loggers"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._cache = {}  # logger name -> rate (longest configured prefix)
+
+    def _rate(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RedactingFilter(logging.Filter):
+    """Replace sensitive fields in args / extras before the record leaves the calling thread"""
+
+    def __init__(self, fields):
+        super().__init__()
+        self.fields = {field.lower() for field in fields}
+
+    def _redact(self, value):
+        if isinstance(value, dict):
+            # Copy: the caller's dict must stay untouched (and may change after this call)
+            return {key: REDACTED if str(key).lower() in self.fields else self._redact(item) for key, item in value.items()}
+        return value
+
+    def filter(self, record):
+        if isinstance(record.args, dict):
+            record.args = self._redact(record.args)
+        elif record.args:
+            record.args = tuple(self._redact(arg) for arg in record.args)
+        for key in self.fields & set(vars(record)):
+            setattr(record, key, REDACTED)
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread; drops them when the queue is full"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # Leave msg % args to the listener thread, only keep what can't wait:
+        # the traceback (frames are gone once the except block ends)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+class _RedactText:
+    """Last line of defence for messages that were built before logging (f-strings, str(dict))"""
+
+    def __init__(self, fields):
+        names = "|".join(re.escape(field) for field in fields)
+        self.pattern = re.compile(rf"""(['"]?\b(?:{names})['"]?\s*[:=]\s*)(?:'[^']*'|"[^"]*"|[^\s,}}]+)""", re.IGNORECASE)
+
+    def __call__(self, text):
+        return self.pattern.sub(rf"\g<1>'{REDACTED}'", text)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message, extra fields and exception"""
+
+    def __init__(self, redact):
+        super().__init__()
+        self.redact = redact
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": self.redact(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self, redact):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.redact = redact
+
+    def format(self, record):
+        return self.redact(super().format(record))
+
+
+def configure_logging(level=None, fmt=None):
+    """
+    Set up the root logger once per process (later calls do nothing).
+    Call it from every entry point (API app, consumer, supervisor worker, CLIs)
+    """
+    global _configured, _listener
+    with _lock:
+        if _configured:
+            return
+        _configured = True
+
+        level = level or os.getenv("LOG_LEVEL", "INFO").upper()
+        fmt = fmt or os.getenv("LOG_FORMAT", "json").lower()
+        fields = [field.strip() for field in os.getenv("LOG_REDACT_FIELDS", "password,password_hash").split(",") if field.strip()]
+        redact = _RedactText(fields) if fields else (lambda text: text)
+
+        stream = logging.StreamHandler()
+        stream.setFormatter(JsonFormatter(redact) if fmt == "json" else TextFormatter(redact))
+
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+        # Filters run on the calling thread, before the record is queued
+        handler.addFilter(SamplingFilter(_parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))))
+        if fields:
+            handler.addFilter(RedactingFilter(fields))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+
+        _listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def stats():
+    """Records dropped because the queue was full, and how many are waiting"""
+    return {"dropped": NonBlockingQueueHandler.dropped, "queued": _listener.queue.qsize() if _listener else 0}
+
+
+def shutdown_logging():
+    """Flush what is still queued (called at exit)"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener:
+        listener.stop()
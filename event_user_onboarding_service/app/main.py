@@ -1,14 +1,32 @@
-from fastapi import FastAPI, APIRouter, HTTPException
-from app.endpoints.publish_endpoint import router as publish_router
-from app.db_conn import Database
-from app.rmq_adapter import RabbitMQHelper
-from app.helpers.helper import retry
+from fastapi import FastAPI, APIRouter, Request, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from app.resources import get_resources
+from app.dependency_supervisor import DependencySupervisor
+from app.endpoints.health_endpoint import router as health_router
+from app.metrics import REQUEST_LATENCY, register_stats
+from app.logging_config import configure_logging, stats as logging_stats
+from dotenv import load_dotenv
+import asyncio
 import logging
+import time
+import os
 
 
-logging.basicConfig(level=logging.INFO) 
+configure_logging()
+register_stats("onboarding_logging", "Log records", logging_stats)
 logger = logging.getLogger(__name__)
 
+load_dotenv(dotenv_path="app/configs/.env")
+
+# API_MODE=async serves the endpoints as `async def` on asyncpg + aio-pika,
+# the default (sync) runs them on the threadpool with psycopg2 + pika
+API_MODE = os.getenv("API_MODE", "sync")
+
+if API_MODE == "async":
+    from app.endpoints.async_publish_endpoint import router as publish_router
+else:
+    from app.endpoints.publish_endpoint import router as publish_router
+
 
 router = APIRouter()
 
@@ -17,53 +35,73 @@ app = FastAPI(title = "User Onboarding Service",
               version = "1.0.0")
 
 
+@app.middleware("http")
+async def observe_request_latency(request: Request, call_next):
+    """Time every request, labelled by route template (/users/{user_id}, not the raw path)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(request.method, route.path if route else "unmatched", str(status)).observe(time.perf_counter() - started)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize Database and RabbitMQ with retry logic"""
-    global db, rmq
-    
-    # Initialize Database
-    try:
-        db = retry(lambda: Database(), "Database initialization")
-        logger.info("Database initialized")
-    except Exception as e:
-        logger.error(f"Database failed: {e}")
-        db = None
-    
-    # Initialize RabbitMQ
-    try:
-        rmq = retry(lambda: RabbitMQHelper(), "RabbitMQ initialization")
-        retry(lambda: rmq.connect(), "RabbitMQ connection")
-        retry(lambda: rmq.setup_queue(), "RabbitMQ queue setup")
-        logger.info("RabbitMQ initialized")
-    except Exception as e:
-        logger.error(f"RabbitMQ failed: {e}")
-        rmq = None
-    
+    """
+    Start connecting to the Database and RabbitMQ in the background and return
+    right away; requests get 503 until a dependency is up (see GET /health/ready)
+    """
+    resources = get_resources()
+    if API_MODE == "async":
+        names = ("async_db", "async_rmq")
+    else:
+        # The API publishes from many threads, so it uses the confirming publisher
+        # (or the pool) instead of a single connection
+        names = ("db", "publisher" if resources.publisher_confirms else "rmq_pool")
+    app.state.dependencies = DependencySupervisor(resources, names).start()
+    # Signups RabbitMQ can't take right now go to the local spool; its forwarder
+    # thread publishes them once the broker is back
+    if API_MODE == "async":
+        from app.views.async_publish_view import send_many_to_rmq
+        loop = asyncio.get_running_loop()
+        resources.start_spool(lambda messages: asyncio.run_coroutine_threadsafe(send_many_to_rmq(messages), loop).result())
+    else:
+        from app.views.publish_view import send_many_to_rmq
+        resources.start_spool(send_many_to_rmq)
+    # Builds in the background, waiting for the database like any request would
+    if API_MODE == "async":
+        resources.astart_email_filter()
+    else:
+        resources.startup("email_filter")
+    # Spawning the hashing processes takes a moment, keep it off the event loop
+    await asyncio.to_thread(resources.startup, "password_hasher")
     logger.info("Application startup complete")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Close Database and RabbitMQ connections with retry logic"""
-    global db, rmq
-    
-    if db:
-        try:
-            retry(lambda: db.db_connection_close(), "Database closure")
-            logger.info("Database closed")
-        except Exception as e:
-            logger.error(f"Database closure failed: {e}")
-    
-    if rmq:
-        try:
-            retry(lambda: rmq.close(), "RabbitMQ closure")
-            logger.info("RabbitMQ closed")
-        except Exception as e:
-            logger.error(f"RabbitMQ closure failed: {e}")
-    
+    """Stop supervising, then close Database and RabbitMQ connections"""
+    supervisor = getattr(app.state, "dependencies", None)
+    if supervisor:
+        await supervisor.stop()
+        app.state.dependencies = None
+    if API_MODE == "async":
+        await get_resources().ashutdown()
+    else:
+        # Closing retries with time.sleep, keep it off the event loop
+        await asyncio.to_thread(get_resources().shutdown)
     logger.info("Application shutdown complete")
 
 router.include_router(publish_router, tags = ["User Data Onboarding"])
+router.include_router(health_router, tags = ["Health"])
 
 app.include_router(router)
\ No newline at end of file
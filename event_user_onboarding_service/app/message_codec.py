@@ -0,0 +1,228 @@
+"""
+Message codec - how user_onboarding_queue messages are turned into bytes and back
+
+Concept: Codecs
+- json:   the message as a JSON object (what was always published),
+          content_type application/json
+- binary: a compact struct encoding, content_type application/x-onboarding-user.
+          No key names on the wire, the user_id uuid as 16 raw bytes, the
+          verification state as one byte; fields outside the schema (replays,
+          a legacy plaintext password...) follow as a small JSON tail
+- Publishers use MESSAGE_CODEC (default json); consumers pick the decoder
+  from each message's content_type, so both formats can be in the queue at
+  once. Roll out consumers first, then switch MESSAGE_CODEC on the API
+- A message without content_type (older publishers) is JSON
+
+Concept: Compression
+- Bodies larger than MESSAGE_COMPRESS_THRESHOLD bytes (default 1024, 0 turns
+  it off) are zlib-compressed and marked content_encoding=zlib. Typical
+  signups are far below it, so they don't pay the CPU for nothing
+
+Concept: Schema version
+- Every message carries "v" (SCHEMA_VERSION); messages published before it
+  existed decode as version 1. helper.db_mapper dispatches on it, so a
+  new schema version can be consumed side by side with the old one
+"""
+from dotenv import load_dotenv
+from typing import NamedTuple, Optional
+import struct
+import json
+import uuid
+import zlib
+import os
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+SCHEMA_VERSION = 1
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/x-onboarding-user"
+ZLIB_ENCODING = "zlib"
+
+
+class Encoded(NamedTuple):
+    body: bytes
+    content_type: str
+    content_encoding: Optional[str] = None
+
+
+class JsonCodec:
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, message: dict) -> bytes:
+        return json.dumps(message, separators=(",", ":")).encode()
+
+    def decode(self, body: bytes) -> dict:
+        message = json.loads(body)
+        if not isinstance(message, dict):
+            raise ValueError("Message is not a JSON object")
+        return message
+
+
+class BinaryCodec:
+    """
+    Layout (version 1, big-endian):
+        B version | B flags | d published_at
+        user_id:       16 bytes (FLAG_UUID) or a string
+        verification:  B code (255: a string follows)
+        email, first_name, last_name, password_hash: strings
+        JSON object of the remaining fields (FLAG_EXTRA), to the end of the body
+    A string is I length + utf-8 bytes, length 0xFFFFFFFF for a missing value
+    (outside the valid lengths, so no string can be mistaken for one).
+    Messages without FLAG_WIDE were published with H lengths (0xFFFF missing)
+    and still decode
+    """
+    content_type = BINARY_CONTENT_TYPE
+
+    HEADER = struct.Struct(">BBd")
+    LENGTH = struct.Struct(">I")
+    MISSING = 0xFFFFFFFF
+    MAX_LENGTH = MISSING - 1
+    SHORT_LENGTH = struct.Struct(">H")
+    SHORT_MISSING = 0xFFFF
+    FLAG_PUBLISHED_AT, FLAG_UUID, FLAG_EXTRA, FLAG_WIDE = 1, 2, 4, 8
+
+    STRINGS = ("email", "first_name", "last_name", "password_hash")
+    VERIFICATION = ("PENDING", "VERIFIED")
+    FIELDS = {"v", "published_at", "user_id", "verification", *STRINGS}
+
+    def _string(self, parts, value, field):
+        if value is None:
+            parts.append(self.LENGTH.pack(self.MISSING))
+            return
+        raw = value.encode()
+        if len(raw) > self.MAX_LENGTH:
+            raise ValueError(f"{field} is {len(raw)} bytes, the binary layout holds at most {self.MAX_LENGTH}")
+        parts.append(self.LENGTH.pack(len(raw)))
+        parts.append(raw)
+
+    def encode(self, message: dict) -> bytes:
+        version = message.get("v", SCHEMA_VERSION)
+        if version != 1:
+            raise ValueError(f"No binary layout for schema version {version}")
+        flags = self.FLAG_WIDE
+        published_at = message.get("published_at")
+        if published_at is not None:
+            flags |= self.FLAG_PUBLISHED_AT
+        user_id = message.get("user_id")
+        user_uuid = None
+        try:
+            user_uuid = uuid.UUID(user_id)
+            if str(user_uuid) == user_id:
+                flags |= self.FLAG_UUID
+        except (TypeError, ValueError):
+            pass
+        extra = {key: value for key, value in message.items() if key not in self.FIELDS}
+        if extra:
+            flags |= self.FLAG_EXTRA
+
+        parts = [self.HEADER.pack(version, flags, published_at or 0.0)]
+        if flags & self.FLAG_UUID:
+            parts.append(user_uuid.bytes)
+        else:
+            self._string(parts, user_id, "user_id")
+        verification = message.get("verification")
+        if verification in self.VERIFICATION:
+            parts.append(bytes((self.VERIFICATION.index(verification),)))
+        else:
+            parts.append(b"\xff")
+            self._string(parts, verification, "verification")
+        for field in self.STRINGS:
+            self._string(parts, message.get(field), field)
+        if extra:
+            parts.append(json.dumps(extra, separators=(",", ":")).encode())
+        return b"".join(parts)
+
+    def _read_string(self, body, offset, wide=True):
+        length_format, missing = (self.LENGTH, self.MISSING) if wide else (self.SHORT_LENGTH, self.SHORT_MISSING)
+        (length,) = length_format.unpack_from(body, offset)
+        offset += length_format.size
+        if length == missing:
+            return None, offset
+        if offset + length > len(body):
+            raise ValueError(f"String of {length} bytes runs past the end of the message")
+        return body[offset:offset + length].decode(), offset + length
+
+    def decode(self, body: bytes) -> dict:
+        version, flags, published_at = self.HEADER.unpack_from(body, 0)
+        if version != 1:
+            raise ValueError(f"No binary layout for schema version {version}")
+        offset = self.HEADER.size
+        wide = bool(flags & self.FLAG_WIDE)
+        message = {"v": version}
+        if flags & self.FLAG_UUID:
+            message["user_id"] = str(uuid.UUID(bytes=bytes(body[offset:offset + 16])))
+            offset += 16
+        else:
+            message["user_id"], offset = self._read_string(body, offset, wide)
+        code = body[offset]
+        offset += 1
+        if code == 255:
+            message["verification"], offset = self._read_string(body, offset, wide)
+        else:
+            message["verification"] = self.VERIFICATION[code]
+        for field in self.STRINGS:
+            value, offset = self._read_string(body, offset, wide)
+            if value is not None:
+                message[field] = value
+        if flags & self.FLAG_PUBLISHED_AT:
+            message["published_at"] = published_at
+        if flags & self.FLAG_EXTRA:
+            message.update(json.loads(body[offset:]))
+        return message
+
+
+# content_type -> codec; register another codec here to make it decodable
+CODECS = {codec.content_type: codec for codec in (JsonCodec(), BinaryCodec())}
+NAMES = {"json": JSON_CONTENT_TYPE, "binary": BINARY_CONTENT_TYPE}
+
+
+class MessageCodec:
+
+    def __init__(self, codec=None, compress_threshold=None, compress_level=None):
+        name = (codec or os.getenv("MESSAGE_CODEC", "json")).lower()
+        if name not in NAMES:
+            raise ValueError(f"Unknown MESSAGE_CODEC {name!r}, expected one of {', '.join(NAMES)}")
+        self.codec = CODECS[NAMES[name]]
+        self.compress_threshold = compress_threshold if compress_threshold is not None else int(os.getenv("MESSAGE_COMPRESS_THRESHOLD", "1024"))
+        self.compress_level = compress_level if compress_level is not None else int(os.getenv("MESSAGE_COMPRESS_LEVEL", "6"))
+
+    def encode(self, message: dict) -> Encoded:
+        if "v" not in message:
+            message = {"v": SCHEMA_VERSION, **message}
+        body = self.codec.encode(message)
+        if self.compress_threshold and len(body) > self.compress_threshold:
+            return Encoded(zlib.compress(body, self.compress_level), self.codec.content_type, ZLIB_ENCODING)
+        return Encoded(body, self.codec.content_type)
+
+    @staticmethod
+    def decode(body: bytes, content_type=None, content_encoding=None) -> dict:
+        if content_encoding == ZLIB_ENCODING:
+            body = zlib.decompress(body)
+        elif content_encoding:
+            raise ValueError(f"Unsupported content_encoding {content_encoding!r}")
+        codec = CODECS.get(content_type or JSON_CONTENT_TYPE)
+        if codec is None:
+            raise ValueError(f"Unsupported content_type {content_type!r}")
+        message = codec.decode(body)
+        message.setdefault("v", 1)
+        return message
+
+
+_default = None
+
+
+def get_codec() -> MessageCodec:
+    """The process-wide codec configured by MESSAGE_CODEC / MESSAGE_COMPRESS_*"""
+    global _default
+    if _default is None:
+        _default = MessageCodec()
+    return _default
+
+
+def encode(message: dict) -> Encoded:
+    return get_codec().encode(message)
+
+
+def decode(body: bytes, content_type=None, content_encoding=None) -> dict:
+    return MessageCodec.decode(body, content_type, content_encoding)
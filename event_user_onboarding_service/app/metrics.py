@@ -0,0 +1,165 @@
+"""
+Prometheus metrics for the API, the publisher and the consumer
+
+Concept: Metric types
+- Histogram: how long something took (request, query, publish...), so we
+  can read p50/p95/p99 and averages
+- Counter: how many times something happened (DLQ nacks, reconnects, retries)
+- Gauge: a value right now (pool connections in use, queue depth)
+
+Where to read them
+- API: GET /metrics on the FastAPI app
+- Consumer: http://<host>:CONSUMER_METRICS_PORT/metrics (one port per
+  supervisor worker: CONSUMER_METRICS_PORT + worker index)
+"""
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets from 1ms to 10s
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Signup -> row in the database can take a while when the queue is backed up
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+REQUEST_LATENCY = Histogram(
+    "onboarding_http_request_duration_seconds", "HTTP request latency",
+    ["method", "route", "status"], buckets=FAST_BUCKETS)
+
+DB_QUERY_SECONDS = Histogram(
+    "onboarding_db_query_duration_seconds", "Database query time",
+    ["operation"], buckets=FAST_BUCKETS)
+
+PUBLISH_SECONDS = Histogram(
+    "onboarding_publish_duration_seconds", "Time to publish one message (including the confirm when enabled)",
+    ["mode"], buckets=FAST_BUCKETS)
+
+CONSUME_TO_COMMIT_SECONDS = Histogram(
+    "onboarding_consume_to_commit_seconds", "Time from handing a message/batch to the consumer callback until it is committed",
+    ["mode"], buckets=FAST_BUCKETS)
+
+SIGNUP_TO_PERSISTED_SECONDS = Histogram(
+    "onboarding_signup_to_persisted_seconds", "End-to-end lag from publish (published_at in the message) to commit",
+    buckets=LAG_BUCKETS)
+
+DLQ_NACKS = Counter(
+    "onboarding_dlq_nacks_total", "Messages NACKed to the dead letter queue", ["queue"])
+
+RMQ_RECONNECTS = Counter(
+    "onboarding_rmq_reconnects_total", "RabbitMQ connection/channel re-creations", ["component"])
+
+RETRIES = Counter(
+    "onboarding_retries_total", "Retries done by helper.retry", ["operation"])
+
+DB_ROUTED = Counter(
+    "onboarding_db_routed_total", "Statements sent to the primary or a read replica by RoutingSession", ["target"])
+
+POOL_CHECKED_OUT = Gauge(
+    "onboarding_pool_checked_out", "Connections currently checked out of a pool", ["pool"])
+
+QUEUE_DEPTH = Gauge(
+    "onboarding_queue_depth", "Messages ready in a RabbitMQ queue (sampled by the consumer)", ["queue"])
+
+PASSWORD_HASH_SECONDS = Histogram(
+    "onboarding_password_hash_seconds", "Time from submitting a password to the hashing pool until its hash is ready",
+    buckets=FAST_BUCKETS)
+
+PASSWORD_HASH_REJECTED = Counter(
+    "onboarding_password_hash_rejected_total", "Signups turned away (429) because every hashing slot was taken")
+
+DEPENDENCY_UP = Gauge(
+    "onboarding_dependency_up", "1 while a supervised dependency is reachable, 0 while it is down", ["dependency"])
+
+SPOOL_APPENDS = Counter(
+    "onboarding_spool_appends_total", "Signups written to the local spool instead of RabbitMQ", ["reason"])
+
+SPOOL_FORWARDED = Counter(
+    "onboarding_spool_forwarded_total", "Spooled signups published to RabbitMQ (rate() = drain rate)")
+
+SPOOL_DEPTH = Gauge(
+    "onboarding_spool_depth", "Signups in the local spool waiting to be published")
+
+DEPENDENCY_RECONNECTS = Counter(
+    "onboarding_dependency_reconnect_attempts_total", "Failed connect/health check attempts of a supervised dependency", ["dependency"])
+
+
+def track_pool(name, checked_out):
+    """Report checked_out() (a function) as the pool gauge on every scrape"""
+    def read():
+        # A failing gauge must not break the whole /metrics response
+        try:
+            return checked_out()
+        except Exception:
+            return 0
+    POOL_CHECKED_OUT.labels(name).set_function(read)
+
+
+class _StatsCollector:
+    """Turns a stats() dict into gauges at scrape time"""
+
+    def __init__(self, prefix, description, stats):
+        self.prefix = prefix
+        self.description = description
+        self.stats = stats
+
+    def collect(self):
+        try:
+            stats = self.stats()
+        except Exception as e:
+            logger.warning(f"Could not collect {self.prefix} metrics: {e}")
+            return
+        for key, value in stats.items():
+            if isinstance(value, (bool, int, float)):
+                yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.description}: {key}", value=float(value))
+
+
+_registered = set()
+
+
+def register_stats(prefix, description, stats):
+    """Export every number in stats() (a function returning a dict) as a gauge named <prefix>_<key>"""
+    if prefix in _registered:
+        return
+    _registered.add(prefix)
+    REGISTRY.register(_StatsCollector(prefix, description, stats))
+
+
+class QueueDepthSampler:
+    """
+    Samples queue depth with a passive queue_declare every `interval` seconds,
+    on its own connection (pika connections can't be shared across threads)
+    """
+
+    def __init__(self, queues, interval=15):
+        self.queues = queues
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def _run(self):
+        from app.rmq_adapter import RabbitMQHelper
+        rmq = RabbitMQHelper()
+        while not self._stop.is_set():
+            try:
+                rmq._ensure_connection()
+                for queue_name in self.queues:
+                    result = rmq.channel.queue_declare(queue=queue_name, passive=True)
+                    QUEUE_DEPTH.labels(queue_name).set(result.method.message_count)
+            except Exception as e:
+                logger.warning(f"Could not sample queue depth: {e}")
+            self._stop.wait(self.interval)
+        rmq.close()
+
+    def start(self):
+        threading.Thread(target=self._run, name="queue-depth-sampler", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def start_metrics_server(port):
+    """Serve /metrics on port (consumer processes; the API serves it from FastAPI)"""
+    start_http_server(port)
+    logger.info(f"Metrics available on port {port}")
@@ -0,0 +1,11 @@
+-- Users table as written by the consumer (no-op on existing deployments)
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    first_name VARCHAR(255),
+    last_name VARCHAR(255),
+    password VARCHAR(255),
+    user_id VARCHAR(36) NOT NULL,
+    verification_state VARCHAR(20) NOT NULL DEFAULT 'PENDING',
+    created_on TIMESTAMP NOT NULL DEFAULT now()
+);
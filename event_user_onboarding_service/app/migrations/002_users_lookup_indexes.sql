@@ -0,0 +1,10 @@
+-- Indexes for the duplicate-email check (lower(email)) and the GET/PUT lookups (user_id).
+-- Emails and user_ids are normalized to lowercase first; if two existing rows only differ
+-- by case the unique index can't be built - resolve those duplicates and re-run (the runner
+-- drops the INVALID index a failed concurrent build leaves behind, so the re-run rebuilds it).
+-- The runner applies each UPDATE in id ranges (DB_MIGRATION_BATCH_ROWS), one commit per range;
+-- the WHERE keeps it to the rows that change, so rows already normalized aren't rewritten.
+UPDATE users SET email = lower(trim(email)) WHERE email <> lower(trim(email));
+UPDATE users SET user_id = lower(user_id) WHERE user_id <> lower(user_id);
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_email_lower_uidx ON users (lower(email));
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS users_user_id_uidx ON users (user_id);
@@ -0,0 +1,4 @@
+-- Indexes for GET /users and GET /users/export (keyset pagination on (created_on, id)),
+-- the second one for listings filtered by verification_state (e.g. pending-verification sweeps)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_created_on_id_idx ON users (created_on, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_state_created_on_id_idx ON users (verification_state, created_on, id);
@@ -0,0 +1,201 @@
+"""
+Schema migrations for the users table
+
+Concept: Migrations
+- Each NNN_name.sql file in this folder is applied once, in order
+- Applied versions are recorded in the schema_migrations table
+- Statements run in autocommit mode so CREATE INDEX CONCURRENTLY works
+  (it can't run inside a transaction and doesn't lock writes)
+- A concurrent build that fails (e.g. duplicates under a unique index) leaves
+  an INVALID index behind, which IF NOT EXISTS would then skip forever. A
+  failed migration isn't recorded, so it runs again; before each CREATE INDEX
+  CONCURRENTLY the runner drops an INVALID index of that name so the re-run
+  really rebuilds it
+- A filtered `UPDATE table SET ... WHERE ...` runs in primary-key ranges of
+  DB_MIGRATION_BATCH_ROWS (default 10000), each committed on its own: no
+  single transaction locks every row it touches or holds back vacuum for
+  the whole table, and a re-run skips the ranges its WHERE already fixed
+
+Run them with: python -m app.migrations
+or set DB_AUTO_MIGRATE=true to apply them when the service starts.
+
+Concept: Drift check
+- The service uses the models in app/models.py instead of reflecting the
+  schema, so on startup check_schema() compares them with the live tables
+  (one information_schema query)
+- DB_SCHEMA_CHECK: warn (default) logs the drift, strict refuses to start,
+  off skips the query
+"""
+from sqlalchemy import text, inspect
+from pathlib import Path
+import logging
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent
+
+# Indexes the lookups in app/views/queries.py rely on: name -> expected index expression
+EXPECTED_INDEXES = {
+    "users_email_lower_uidx": "lower((email)::text)",
+    "users_user_id_uidx": "(user_id)",
+    "users_created_on_id_idx": "(created_on, id)",
+    "users_state_created_on_id_idx": "(verification_state, created_on, id)",
+}
+
+
+CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+FILTERED_UPDATE = re.compile(r"UPDATE\s+(\w+)\s+SET\s+.+?\s+WHERE\s+(.+)", re.IGNORECASE | re.DOTALL)
+
+
+def _migration_files():
+    return sorted(MIGRATIONS_DIR.glob("[0-9][0-9][0-9]_*.sql"))
+
+
+def _statements(path: Path):
+    sql = "\n".join(line for line in path.read_text().splitlines() if not line.strip().startswith("--"))
+    return [statement.strip() for statement in sql.split(";") if statement.strip()]
+
+
+def apply_migrations(engine):
+    """Apply all migrations that are not recorded in schema_migrations yet"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(255) PRIMARY KEY, applied_on TIMESTAMP NOT NULL DEFAULT now())"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+        for path in _migration_files():
+            if path.stem in applied:
+                continue
+            logger.info(f"Applying migration {path.stem}")
+            for statement in _statements(path):
+                match = CONCURRENT_INDEX.match(statement)
+                if match:
+                    drop_invalid_index(conn, match.group(1))
+                if FILTERED_UPDATE.fullmatch(statement):
+                    update_in_batches(conn, statement)
+                else:
+                    conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": path.stem})
+            logger.info(f"Migration {path.stem} applied")
+
+
+def update_in_batches(conn, statement, batch_rows=None):
+    """
+    Run a filtered UPDATE one primary-key range at a time (conn is in autocommit mode,
+    so every range is its own transaction). Tables without a single integer key get
+    the statement as it is
+    """
+    batch_rows = batch_rows or int(os.getenv("DB_MIGRATION_BATCH_ROWS", "10000"))
+    match = FILTERED_UPDATE.fullmatch(statement)
+    table = match.group(1)
+    keys = inspect(conn).get_pk_constraint(table)["constrained_columns"]
+    low = high = None
+    if len(keys) == 1:
+        low, high = conn.execute(text(f'SELECT min("{keys[0]}"), max("{keys[0]}") FROM "{table}"')).first()
+    if not (isinstance(low, int) and isinstance(high, int)):
+        conn.execute(text(statement))
+        return
+
+    batch = text(f'{statement[:match.start(2)]}({match.group(2)}) AND "{keys[0]}" >= :low AND "{keys[0]}" < :high')
+    updated = 0
+    for start in range(low, high + 1, batch_rows):
+        updated += conn.execute(batch, {"low": start, "high": start + batch_rows}).rowcount
+    logger.info(f"Updated {updated} rows of {table} in batches of {batch_rows} ids")
+
+
+def drop_invalid_index(conn, name):
+    """Drop index `name` if it is left INVALID by a failed concurrent build"""
+    if conn.dialect.name != "postgresql":
+        return
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index ix JOIN pg_class i ON i.oid = ix.indexrelid "
+        "WHERE i.relname = :name AND NOT ix.indisvalid"
+    ), {"name": name}).first()
+    if invalid:
+        logger.warning(f"Index {name} is INVALID (an earlier build failed), dropping it to rebuild")
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+
+
+def missing_indexes(conn, table_name="users"):
+    """Names of EXPECTED_INDEXES that don't exist (or are INVALID after a failed concurrent build)"""
+    if conn.dialect.name != "postgresql":
+        return []
+    rows = conn.execute(text(
+        "SELECT i.relname, pg_get_indexdef(ix.indexrelid), ix.indisvalid "
+        "FROM pg_index ix "
+        "JOIN pg_class i ON i.oid = ix.indexrelid "
+        "JOIN pg_class t ON t.oid = ix.indrelid "
+        "WHERE t.relname = :table_name"
+    ), {"table_name": table_name}).fetchall()
+
+    missing = []
+    for name, expression in EXPECTED_INDEXES.items():
+        # Accept an equivalent index created under another name
+        if not any(valid and (index_name == name or expression in definition) for index_name, definition, valid in rows):
+            missing.append(name)
+    return missing
+
+
+def schema_drift(conn, tables):
+    """{table name: problem} for the model tables whose live columns don't match"""
+    names = [table.name for table in tables]
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = ANY(:names)"
+        ), {"names": names}).fetchall()
+    else:
+        inspector = inspect(conn)
+        rows = [(name, column["name"]) for name in names if inspector.has_table(name)
+                for column in inspector.get_columns(name)]
+
+    live = {}
+    for table_name, column_name in rows:
+        live.setdefault(table_name, set()).add(column_name)
+
+    drift = {}
+    for table in tables:
+        if table.name not in live:
+            drift[table.name] = "table does not exist"
+            continue
+        missing = sorted(set(table.columns.keys()) - live[table.name])
+        if missing:
+            drift[table.name] = f"missing columns {missing}"
+    return drift
+
+
+def check_schema(conn, tables):
+    """Startup check: do the live tables have every column the models use?"""
+    mode = os.getenv("DB_SCHEMA_CHECK", "warn").lower()
+    if mode == "off":
+        return
+    try:
+        drift = schema_drift(conn, tables)
+    except Exception as e:
+        logger.warning(f"Could not check the schema: {e}")
+        return
+    if drift:
+        message = f"Database schema does not match app/models.py: {drift} - run `python -m app.migrations`"
+        if mode == "strict":
+            raise RuntimeError(message)
+        logger.warning(message)
+
+
+def check_indexes(conn):
+    """
+    Startup check: warn when the indexes the lookups need are missing.
+    Returns the missing names (all of them when the check itself failed),
+    so callers can avoid statements that need one
+    """
+    try:
+        missing = missing_indexes(conn)
+    except Exception as e:
+        logger.warning(f"Could not check indexes on users: {e}")
+        return list(EXPECTED_INDEXES)
+    if missing:
+        logger.warning(f"Missing indexes on users: {missing}. Lookups will scan the whole table - run `python -m app.migrations`")
+    return missing
@@ -0,0 +1,17 @@
+from sqlalchemy import create_engine
+from dotenv import load_dotenv
+from app.migrations import apply_migrations, missing_indexes
+from app.logging_config import configure_logging
+import os
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+if __name__ == "__main__":
+    configure_logging()
+    engine = create_engine(os.getenv("DB_URL"))
+    apply_migrations(engine)
+    with engine.connect() as conn:
+        missing = missing_indexes(conn)
+    if missing:
+        raise SystemExit(f"Indexes still missing after migrating: {missing}")
+    engine.dispose()
@@ -0,0 +1,42 @@
+"""
+Database models - the users table declared in code
+
+Concept: Declarative model vs reflection
+- Reflection (MetaData.reflect + automap) asks the database for every
+  table, column, constraint and index on every boot: several catalog round
+  trips before the first request can be served
+- The model below is the same table written down once, so startup needs no
+  round trip to know the schema
+- It must match migrations/*.sql; check_schema() compares it with the live
+  table in one cheap query on startup, so drift is still caught
+"""
+from sqlalchemy import Column, Index, Integer, String, DateTime, func, text
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    email = Column(String(255), nullable=False)
+    first_name = Column(String(255))
+    last_name = Column(String(255))
+    password = Column(String(255))
+    user_id = Column(String(36), nullable=False)
+    verification_state = Column(String(20), nullable=False, server_default=text("'PENDING'"))
+    created_on = Column(DateTime, nullable=False, server_default=func.now())
+
+    # Created by migrations/002_users_lookup_indexes.sql and 003_users_listing_indexes.sql
+    # (declared here so metadata.create_all() builds the same table for local stand-ins)
+    __table_args__ = (
+        Index("users_email_lower_uidx", func.lower(email), unique=True),
+        Index("users_user_id_uidx", user_id, unique=True),
+        Index("users_created_on_id_idx", created_on, id),
+        Index("users_state_created_on_id_idx", verification_state, created_on, id),
+    )
+
+
+# table name -> model, what Database.get_table_class() hands out
+MODELS = {model.__tablename__: model for model in (User,)}
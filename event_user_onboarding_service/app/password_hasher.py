@@ -0,0 +1,170 @@
+"""
+Password hasher - scrypt on a process pool, in front of the queue
+
+Concept: Hashing at the edge
+- The API hashes the password before publishing, the message carries
+  password_hash only: the plaintext never reaches RabbitMQ, the spool or
+  the consumer's logs
+- scrypt costs tens of milliseconds of CPU per password. Run on the request
+  thread it would hold the GIL (hashlib releases it, but the threadpool is
+  sized for I/O, not CPU) and on the event loop it would stall every request
+
+Concept: Process pool
+- PASSWORD_HASH_WORKERS processes (default: CPU count) do nothing but hash,
+  so hashing scales with cores and never competes with request handling
+- Workers are started with "spawn": a forked copy of an API process would
+  inherit its threads' locks (logging, pika IO loop) in whatever state they
+  were in
+
+Concept: Backpressure
+- At most PASSWORD_HASH_QUEUE hashes (default QUEUE_PER_WORKER = 32 per
+  worker) are submitted or running at once. Every worker works through its
+  share, so a signup waits for at most ~32 hashes ahead of it (1-3 seconds at
+  the default cost) whatever the core count: ordinary bursts queue briefly
+- Only when all slots are taken, i.e. the pool is saturated, /signup answers
+  429 with Retry-After straight away, instead of queueing work nobody will
+  wait for
+- POST /signup/batch waits up to PASSWORD_HASH_WAIT_SECONDS for a slot per
+  user; users that don't get one are reported as errors
+
+Cost: PASSWORD_SCRYPT_N (default 16384), PASSWORD_SCRYPT_R (8), PASSWORD_SCRYPT_P (1)
+"""
+from app.helpers.passwords import hash_password, cost_from_env
+from app.metrics import PASSWORD_HASH_SECONDS, PASSWORD_HASH_REJECTED
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException
+from dotenv import load_dotenv
+import multiprocessing
+import threading
+import asyncio
+import logging
+import time
+import os
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PER_WORKER = 32
+
+
+class HasherBusy(HTTPException):
+    """Every hashing slot is taken; answered as 429 with Retry-After"""
+
+    def __init__(self, retry_after=1):
+        super().__init__(status_code=429,
+                         detail={"status": "FAILURE", "message": "Too many signups right now, retry later"},
+                         headers={"Retry-After": str(retry_after)})
+
+
+def _warm_up():
+    """Runs once in each worker so the first real hash doesn't pay for the process start"""
+    return os.getpid()
+
+
+class PasswordHasher:
+
+    def __init__(self, workers=None, queue_size=None, n=None, r=None, p=None):
+        self.workers = workers or int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or os.cpu_count() or 1
+        self.queue_size = queue_size or int(os.getenv("PASSWORD_HASH_QUEUE", "0")) or self.workers * QUEUE_PER_WORKER
+        self.wait_seconds = float(os.getenv("PASSWORD_HASH_WAIT_SECONDS", "30"))
+        cost = cost_from_env()
+        self.n = n or cost["n"]
+        self.r = r or cost["r"]
+        self.p = p or cost["p"]
+
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def start(self):
+        """Start every worker process now rather than on the first signups"""
+        for future in [self._executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        logger.info(f"Password hasher started ({self.workers} workers, {self.queue_size} slots, scrypt n={self.n} r={self.r} p={self.p})")
+        return self
+
+    @property
+    def in_flight(self):
+        """Hashes submitted or running"""
+        return self._in_flight
+
+    def submit(self, password: str, wait=None):
+        """
+        Hand one password to the pool, returns a Future of the encoded hash.
+        Raises HasherBusy if no slot frees up within `wait` seconds (default: don't wait)
+        """
+        acquired = self._slots.acquire(timeout=wait) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            PASSWORD_HASH_REJECTED.inc()
+            raise HasherBusy()
+        with self._lock:
+            self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            future = self._executor.submit(hash_password, password, self.n, self.r, self.p)
+        except Exception:
+            self._release(started)
+            raise
+        future.add_done_callback(lambda _: self._release(started))
+        return future
+
+    def _release(self, started):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+        PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started)
+
+    def hash(self, password: str) -> str:
+        """Hash on the pool and wait for it (request threads)"""
+        return self.submit(password).result()
+
+    async def ahash(self, password: str) -> str:
+        """Hash on the pool without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(password))
+
+    def hash_many(self, passwords):
+        """
+        For batches: waits for free slots (up to PASSWORD_HASH_WAIT_SECONDS each),
+        returns one hash or exception per password
+        """
+        futures = []
+        for password in passwords:
+            try:
+                futures.append(self.submit(password, wait=self.wait_seconds))
+            except Exception as e:
+                futures.append(e)
+        return [self._outcome(future) for future in futures]
+
+    async def ahash_many(self, passwords):
+        futures = []
+        for password in passwords:
+            try:
+                # Waiting for a slot blocks, so it happens on a worker thread
+                futures.append(asyncio.wrap_future(await asyncio.to_thread(self.submit, password, self.wait_seconds)))
+            except Exception as e:
+                futures.append(e)
+        return await asyncio.gather(*(self._aoutcome(future) for future in futures))
+
+    @staticmethod
+    def _outcome(future):
+        if isinstance(future, Exception):
+            return future
+        try:
+            return future.result()
+        except Exception as e:
+            return e
+
+    @staticmethod
+    async def _aoutcome(future):
+        if isinstance(future, Exception):
+            return future
+        try:
+            return await future
+        except Exception as e:
+            return e
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        logger.info("Password hasher stopped")
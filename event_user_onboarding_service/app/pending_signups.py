@@ -0,0 +1,121 @@
+"""
+Pending signups - emails that were accepted but are not in users yet
+
+Concept: The race
+- /signup checks users, then publishes; the row only appears once the
+  consumer has processed the message
+- Two signups for the same email inside that window would both pass the
+  check, get two user_ids, and the second one would fail in the consumer
+
+Concept: Reservation
+- reserve(email, user_id) atomically claims the email before publishing;
+  if someone else already holds it we get their user_id back -> 409
+- The consumer releases the email once the row is committed (or the
+  message failed), the API releases it if publishing failed
+- Reservations expire after PENDING_SIGNUP_TTL seconds (default: the
+  queue's 1 hour message TTL), so a lost release can't block an email forever
+
+Concept: Where reservations live
+- With SHARED_STORE_URL set, only in the shared store: it is the one place
+  the consumer's release (another process) can reach, so a committed or
+  dead-lettered signup frees the email for every API worker at once
+- Without it, in this process only: nothing from the consumer ever clears
+  them, so they are kept for PENDING_SIGNUP_LOCAL_TTL seconds (default 30,
+  long enough for a signup to get through the queue normally) in a bounded
+  LRU of at most PENDING_SIGNUP_LOCAL_SIZE emails (default 100000). A repeat
+  after that is answered by the users check, or at worst by the unique index
+"""
+from app.helpers.helper import normalize_email
+from app.cache import LRUCache, MISSING
+from dotenv import load_dotenv
+import threading
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+
+class PendingSignups:
+
+    def __init__(self, ttl=None, shared=None, local_ttl=None, local_size=None):
+        self.ttl = ttl or float(os.getenv("PENDING_SIGNUP_TTL", "3600"))
+        self.shared = shared
+        self.local_ttl = local_ttl or float(os.getenv("PENDING_SIGNUP_LOCAL_TTL", "30"))
+        local_size = local_size or int(os.getenv("PENDING_SIGNUP_LOCAL_SIZE", "100000"))
+        self._lock = threading.Lock()  # makes the local check-and-claim atomic
+        self._local = LRUCache(max_size=local_size, ttl=self.local_ttl)  # email -> user_id
+
+    @staticmethod
+    def _key(email):
+        return f"pending:{email}"
+
+    def _reserve_shared(self, email, user_id):
+        key = self._key(email)
+        for _ in range(2):
+            if self.shared.set_if_absent(key, user_id, self.ttl):
+                return None
+            holder = self.shared.get(key)
+            if holder is not None:
+                return holder if holder != user_id else None
+            # Released or expired between the two calls: try to claim it again
+        return None
+
+    def _reserve_local(self, email, user_id):
+        with self._lock:
+            holder = self._local.get(email)
+            if holder is not MISSING and holder != user_id:
+                return holder
+            self._local.set(email, user_id)
+        return None
+
+    def reserve(self, email: str, user_id: str):
+        """
+        Claim email for user_id. Returns None if the claim succeeded,
+        otherwise the user_id of the signup already holding the email
+        """
+        email = normalize_email(email)
+        if self.shared is not None:
+            try:
+                return self._reserve_shared(email, user_id)
+            except Exception as e:
+                # Fall back to a (short-lived) local reservation; the unique index is the last line of defence
+                logger.warning("Shared pending-signup reserve failed: %s", e)
+        return self._reserve_local(email, user_id)
+
+    def release(self, email: str, user_id: str):
+        """Drop the reservation, only if it is still held by user_id"""
+        email = normalize_email(email)
+        with self._lock:
+            if self._local.get(email) == user_id:
+                self._local.delete(email)
+        if self.shared is not None:
+            try:
+                self.shared.delete_if_equals(self._key(email), user_id)
+            except Exception as e:
+                logger.warning("Shared pending-signup release failed: %s", e)
+
+    def release_many(self, claims):
+        """release() for each (email, user_id)"""
+        for email, user_id in claims:
+            self.release(email, user_id)
+
+    async def areserve(self, email: str, user_id: str):
+        if self.shared is not None:
+            return await asyncio.to_thread(self.reserve, email, user_id)
+        return self.reserve(email, user_id)
+
+    async def arelease(self, email: str, user_id: str):
+        if self.shared is not None:
+            return await asyncio.to_thread(self.release, email, user_id)
+        return self.release(email, user_id)
+
+    async def arelease_many(self, claims):
+        if self.shared is not None:
+            return await asyncio.to_thread(self.release_many, claims)
+        return self.release_many(claims)
+
+    def __len__(self):
+        return len(self._local)
@@ -0,0 +1,430 @@
+"""
+Process-wide resources (Database + RabbitMQ)
+
+Concept: Singleton Registry
+- Building a Database opens a connection pool (and replica pools) and
+  checks the live tables against the declared models in app/models.py,
+  building a RabbitMQHelper opens a socket to the broker
+- Both are expensive, so every process (the FastAPI app and the consumer)
+  creates them exactly once and shares them
+- startup() / shutdown() are the explicit lifecycle hooks, the db / rmq /
+  rmq_pool properties create a resource on first use if startup() did not
+- rmq is a single connection for the consumer's blocking loop, rmq_pool is
+  for publishing from many threads (the API), publisher is the confirming
+  publisher used instead of the pool when RMQ_PUBLISHER_CONFIRMS=true
+- shared_store / user_cache are the optional cross-process store and the
+  GET /users/{user_id} cache built on top of it
+- pending_signups holds emails that were published but not committed yet
+- password_hasher is the scrypt process pool the API hashes passwords on
+- email_filter is the Bloom filter in front of the duplicate-email check
+  (None when disabled: by default it is on only with a shared store); in
+  API_MODE=async astart_email_filter() loads it through async_db instead
+- spool is the API's local write-ahead spool for signups RabbitMQ can't take
+  right now (app.spool), started by start_spool() (None when SPOOL_ENABLED=false)
+- async_db / async_rmq are the asyncio versions used by the async API
+  (API_MODE=async), see astartup() / ashutdown()
+- In the API the connections are owned by the DependencySupervisor
+  (app.dependency_supervisor): while one of them is down, accessing it raises
+  DependencyUnavailable (503) right away instead of connecting inline
+"""
+from app.shared_store import create_shared_store
+from app.cache import UserCache, MISSING
+from app.pending_signups import PendingSignups
+from app.helpers.helper import retry
+from app.metrics import track_pool, register_stats
+from fastapi import HTTPException
+from typing import TYPE_CHECKING
+import threading
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Imported where they are first created, so a process only loads the drivers it
+# uses (pika in the sync API/consumer, aio-pika/asyncpg in the async API)
+if TYPE_CHECKING:
+    from app.db_conn import Database
+    from app.rmq_adapter import RabbitMQHelper
+    from app.rmq_pool import RabbitMQChannelPool
+    from app.rmq_confirms import ConfirmingPublisher
+    from app.password_hasher import PasswordHasher
+
+
+class DependencyUnavailable(HTTPException):
+    """A supervised dependency is down; answered as 503 with Retry-After"""
+
+    def __init__(self, name, retry_after=5):
+        super().__init__(status_code=503,
+                         detail={"status": "FAILURE", "message": f"{name} is unavailable, retry later"},
+                         headers={"Retry-After": str(retry_after)})
+        self.name = name
+
+
+class ResourceRegistry:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._db = None
+        self._rmq = None
+        self._rmq_pool = None
+        self._publisher = None
+        self._shared_store = MISSING
+        self._user_cache = None
+        self._email_filter = MISSING
+        self._pending_signups = None
+        self._spool = None
+        self._password_hasher = None
+        self._async_db = None
+        self._async_rmq = None
+        self._async_lock = None
+        # name -> up? for the resources a DependencySupervisor owns
+        self._supervised = {}
+
+        # Wait for the broker to confirm every publish (durable, pipelined)
+        self.publisher_confirms = os.getenv("RMQ_PUBLISHER_CONFIRMS", "true").lower() == "true"
+
+        # Gauges read the current resource at scrape time (0 / nothing until it exists)
+        track_pool("db", lambda: self._db.engine.pool.checkedout() if self._db else 0)
+        track_pool("db_replicas", lambda: sum(engine.pool.checkedout() for engine in self._db.replicas) if self._db else 0)
+        track_pool("rmq", lambda: self._rmq_pool.checked_out if self._rmq_pool else 0)
+        track_pool("publisher_in_flight", lambda: self._publisher.in_flight if self._publisher else 0)
+        track_pool("password_hasher", lambda: self._password_hasher.in_flight if self._password_hasher else 0)
+        register_stats("onboarding_email_filter", "Email Bloom filter", self._email_filter_stats)
+
+    @property
+    def db(self) -> "Database":
+        self._check_available("db")
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._create_db()
+        return self._db
+
+    @property
+    def rmq(self) -> "RabbitMQHelper":
+        self._check_available("rmq")
+        if self._rmq is None:
+            with self._lock:
+                if self._rmq is None:
+                    self._rmq = self._create_rmq()
+        return self._rmq
+
+    @property
+    def rmq_pool(self) -> "RabbitMQChannelPool":
+        self._check_available("rmq_pool")
+        if self._rmq_pool is None:
+            with self._lock:
+                if self._rmq_pool is None:
+                    self._rmq_pool = self._create_rmq_pool()
+        return self._rmq_pool
+
+    @property
+    def publisher(self) -> "ConfirmingPublisher":
+        self._check_available("publisher")
+        if self._publisher is None:
+            with self._lock:
+                if self._publisher is None:
+                    self._publisher = self._create_publisher()
+        return self._publisher
+
+    @property
+    def shared_store(self):
+        """The store configured by SHARED_STORE_URL, or None"""
+        if self._shared_store is MISSING:
+            with self._lock:
+                if self._shared_store is MISSING:
+                    self._shared_store = create_shared_store()
+        return self._shared_store
+
+    @property
+    def user_cache(self) -> UserCache:
+        if self._user_cache is None:
+            with self._lock:
+                if self._user_cache is None:
+                    self._user_cache = UserCache(shared=self.shared_store)
+        return self._user_cache
+
+    @property
+    def pending_signups(self) -> PendingSignups:
+        if self._pending_signups is None:
+            with self._lock:
+                if self._pending_signups is None:
+                    self._pending_signups = PendingSignups(shared=self.shared_store)
+        return self._pending_signups
+
+    @property
+    def password_hasher(self) -> "PasswordHasher":
+        if self._password_hasher is None:
+            with self._lock:
+                if self._password_hasher is None:
+                    from app.password_hasher import PasswordHasher
+                    self._password_hasher = PasswordHasher().start()
+        return self._password_hasher
+
+    def _email_filter_enabled(self, shared):
+        # Without a shared store other processes' inserts can't reach the filter (see app.bloom)
+        return os.getenv("EMAIL_FILTER_ENABLED", "true" if shared is not None else "false").lower() == "true"
+
+    @property
+    def email_filter(self):
+        """
+        Bloom filter of known emails, built in the background (from the sync
+        Database) on first access. API_MODE=async starts it with
+        astart_email_filter() instead
+        """
+        if self._email_filter is MISSING:
+            shared = self.shared_store
+            with self._lock:
+                if self._email_filter is MISSING:
+                    if self._email_filter_enabled(shared):
+                        from app.bloom import EmailFilter
+                        self._email_filter = EmailFilter(shared=shared).start(lambda: self.db)
+                    else:
+                        self._email_filter = None
+        return self._email_filter
+
+    def astart_email_filter(self):
+        """The email filter for API_MODE=async: built on the event loop through the async database"""
+        if self._email_filter is MISSING:
+            shared = self.shared_store
+            if self._email_filter_enabled(shared):
+                from app.bloom import EmailFilter
+                self._email_filter = EmailFilter(shared=shared).astart(self.get_async_db)
+            else:
+                self._email_filter = None
+        return self._email_filter
+
+    def start_spool(self, forward):
+        """
+        Open this process' spool and start forwarding it with forward(messages)
+        (see Spool.start). Without a usable spool directory the API runs without one
+        """
+        from app.spool import Spool, SPOOL_ENABLED
+        with self._lock:
+            if self._spool is None and SPOOL_ENABLED:
+                try:
+                    self._spool = Spool.open_slot().start(forward)
+                    logger.info(f"Spool opened in {self._spool.directory}")
+                except Exception as e:
+                    logger.error(f"Spool failed, publishing without one: {e}")
+        return self._spool
+
+    def _email_filter_stats(self):
+        email_filter = self.loaded("email_filter")
+        return email_filter.stats() if email_filter else {}
+
+    def loaded(self, name):
+        """The resource if it was already created in this process, else None (never creates it)"""
+        resource = getattr(self, f"_{name}")
+        return None if resource is MISSING else resource
+
+    def _check_available(self, name):
+        if self._supervised.get(name) is False:
+            raise DependencyUnavailable(name)
+
+    def supervise(self, name, up):
+        """Called by the DependencySupervisor whenever `name` goes up or down"""
+        self._supervised[name] = up
+
+    def unsupervise(self):
+        """Back to creating resources on first use (supervisor stopped)"""
+        self._supervised = {}
+
+    def connect(self, name):
+        """
+        One attempt at creating a sync resource, no retry (the supervisor does the backoff).
+        Blocking - the supervisor runs it on a worker thread
+        """
+        if getattr(self, f"_{name}") is None:
+            # Built outside the lock: nobody else creates a supervised resource meanwhile,
+            # and the other lazy properties must not wait for a slow connect
+            resource = getattr(self, f"_create_{name}")(attempts=1)
+            with self._lock:
+                setattr(self, f"_{name}", resource)
+
+    async def aconnect(self, name):
+        """asyncio version of connect() for async_db / async_rmq"""
+        if getattr(self, f"_{name}") is None:
+            resource = await getattr(self, f"_create_{name}")()
+            async with self._get_async_lock():
+                setattr(self, f"_{name}", resource)
+
+    def _create_db(self, attempts=3):
+        from app.db_conn import Database
+        # The shared store carries the read-your-writes marks to the other processes
+        shared = self.shared_store
+        db = retry(lambda: Database(shared), "Database initialization", attempts)
+        logger.info("Database initialized")
+        return db
+
+    def _create_rmq(self, attempts=3):
+        from app.rmq_adapter import RabbitMQHelper
+        rmq = RabbitMQHelper()
+        retry(lambda: rmq.connect(), "RabbitMQ connection", attempts)
+        retry(lambda: rmq.setup_queue(), "RabbitMQ queue setup", attempts)
+        logger.info("RabbitMQ initialized")
+        return rmq
+
+    def _create_rmq_pool(self, attempts=3):
+        from app.rmq_pool import RabbitMQChannelPool
+        pool = RabbitMQChannelPool()
+        retry(lambda: pool.setup_queue(), "RabbitMQ queue setup", attempts)
+        logger.info(f"RabbitMQ pool initialized (size {pool.size})")
+        return pool
+
+    def _create_publisher(self, attempts=3):
+        from app.rmq_adapter import RabbitMQHelper
+        from app.rmq_confirms import ConfirmingPublisher
+        # Declare the queues once with a short-lived blocking connection
+        rmq = RabbitMQHelper()
+        retry(lambda: rmq.connect(), "RabbitMQ connection", attempts)
+        retry(lambda: rmq.setup_queue(), "RabbitMQ queue setup", attempts)
+        rmq.close()
+        publisher = retry(lambda: ConfirmingPublisher().start(), "RabbitMQ confirming publisher", attempts)
+        logger.info("RabbitMQ confirming publisher initialized")
+        return publisher
+
+    def startup(self, *names):
+        """
+        Create resources up front (default: db and rmq).
+        Failures are logged, the resource is retried on first use
+        """
+        for name in names or ("db", "rmq"):
+            try:
+                getattr(self, name)
+            except Exception as e:
+                logger.error(f"{name} failed: {e}")
+
+    def shutdown(self):
+        """Close all resources, the next access creates them again"""
+        # First, while the publisher is still there for the forwarder's last batch
+        spool, self._spool = self._spool, None
+        if spool:
+            spool.close()
+
+        with self._lock:
+            db, self._db = self._db, None
+            rmq, self._rmq = self._rmq, None
+            rmq_pool, self._rmq_pool = self._rmq_pool, None
+            publisher, self._publisher = self._publisher, None
+            email_filter, self._email_filter = self._email_filter, MISSING
+            password_hasher, self._password_hasher = self._password_hasher, None
+
+        if db:
+            try:
+                retry(lambda: db.db_connection_close(), "Database closure")
+                logger.info("Database closed")
+            except Exception as e:
+                logger.error(f"Database closure failed: {e}")
+
+        if rmq:
+            try:
+                retry(lambda: rmq.close(), "RabbitMQ closure")
+                logger.info("RabbitMQ closed")
+            except Exception as e:
+                logger.error(f"RabbitMQ closure failed: {e}")
+
+        if rmq_pool:
+            rmq_pool.close()
+
+        if publisher:
+            publisher.close()
+
+        if email_filter not in (None, MISSING):
+            email_filter.stop()
+
+        if password_hasher:
+            password_hasher.close()
+
+
+    # ---- asyncio resources ----
+
+    def _get_async_lock(self):
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        return self._async_lock
+
+    async def get_async_db(self):
+        self._check_available("async_db")
+        if self._async_db is None:
+            async with self._get_async_lock():
+                if self._async_db is None:
+                    self._async_db = await self._create_async_db()
+        return self._async_db
+
+    async def get_async_rmq(self):
+        self._check_available("async_rmq")
+        if self._async_rmq is None:
+            async with self._get_async_lock():
+                if self._async_rmq is None:
+                    self._async_rmq = await self._create_async_rmq()
+        return self._async_rmq
+
+    async def _create_async_db(self):
+        from app.async_db_conn import AsyncDatabase
+        async_db = await AsyncDatabase.create(self.shared_store)
+        logger.info("Async Database initialized")
+        return async_db
+
+    async def _create_async_rmq(self):
+        from app.async_rmq_adapter import AsyncRabbitMQHelper
+        rmq = AsyncRabbitMQHelper()
+        try:
+            await rmq.connect()
+            await rmq.setup_queue()
+        except Exception:
+            # connect_robust would otherwise keep reconnecting a helper nobody holds
+            await rmq.close()
+            raise
+        logger.info("Async RabbitMQ initialized")
+        return rmq
+
+    async def astartup(self, *names):
+        """
+        Create asyncio resources up front (default: async_db and async_rmq).
+        Both are brought up concurrently. Failures are logged, the resource is retried on first use
+        """
+        names = names or ("async_db", "async_rmq")
+        results = await asyncio.gather(*(getattr(self, f"get_{name}")() for name in names), return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error(f"{name} failed: {result}")
+
+    async def ashutdown(self):
+        """Close the asyncio resources"""
+        spool, self._spool = self._spool, None
+        if spool:
+            # The forwarder thread may be waiting on a publish that runs on this loop
+            await asyncio.to_thread(spool.close)
+
+        email_filter, self._email_filter = self._email_filter, MISSING
+        if email_filter not in (None, MISSING):
+            email_filter.stop()
+
+        password_hasher, self._password_hasher = self._password_hasher, None
+        if password_hasher:
+            await asyncio.to_thread(password_hasher.close)
+
+        async_db, self._async_db = self._async_db, None
+        async_rmq, self._async_rmq = self._async_rmq, None
+
+        if async_db:
+            try:
+                await async_db.db_connection_close()
+            except Exception as e:
+                logger.error(f"Async Database closure failed: {e}")
+
+        if async_rmq:
+            try:
+                await async_rmq.close()
+            except Exception as e:
+                logger.error(f"Async RabbitMQ closure failed: {e}")
+
+
+_resources = ResourceRegistry()
+
+
+def get_resources() -> ResourceRegistry:
+    """The one accessor for this process' resources"""
+    return _resources
@@ -0,0 +1,66 @@
+"""
+Fast JSON responses - send the view's dict as-is, encoded by orjson
+
+Concept: The default path
+- An endpoint with response_model=... that returns a dict makes FastAPI
+  validate the dict into the pydantic model, turn the model back into
+  plain data (jsonable_encoder), and only then json.dumps it
+- The views already build exactly the response's fields, so that round
+  trip re-checks our own output on every request: on GET /users/{user_id}
+  (a cache hit) it is most of the CPU the request costs
+
+Concept: The fast path
+- With FAST_JSON_RESPONSES=true (default) the endpoints wrap the view's dict
+  in a FastJSONResponse. FastAPI hands a Response object straight to the
+  client: no validation, no jsonable_encoder
+- orjson encodes dicts, lists, str/int/float and datetimes natively, several
+  times faster than the json module. Without orjson installed the stdlib
+  encoder is used (still without the validation round trip)
+- response_model stays on the routes, so the OpenAPI docs don't change
+
+Compare both paths with: python -m benchmarks.responses
+"""
+from fastapi.responses import JSONResponse
+from datetime import datetime, date
+from dotenv import load_dotenv
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "true").lower() == "true"
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that encodes with orjson when it is installed"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def respond(content, status_code=200):
+    """
+    What an endpoint returns: the view's dict in a FastJSONResponse (FastAPI
+    skips response_model validation for Response objects), or the dict itself
+    for FastAPI to validate when FAST_JSON_RESPONSES is off
+    """
+    if FAST_JSON_RESPONSES:
+        return FastJSONResponse(content, status_code=status_code)
+    return content
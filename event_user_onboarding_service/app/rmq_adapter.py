@@ -1,11 +1,12 @@
 import pika
-import json
 import logging
 import os
+import time
 from dotenv import load_dotenv
 from pathlib import Path
+from app.metrics import DLQ_NACKS, RMQ_RECONNECTS
+from app import message_codec
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -34,6 +35,22 @@ class RabbitMQHelper:
         self.connection = None
         self.channel = None
     
+    def connection_parameters(self):
+        """Where and how to connect (shared with the confirming publisher)"""
+        # Create credentials (username/password)
+        credentials = pika.PlainCredentials(self.username, self.password)
+
+        # Connection parameters (where to connect)
+        return pika.ConnectionParameters(
+            host=self.host,
+            port=self.port,
+            credentials=credentials,
+            heartbeat=600,  # Keep connection alive (10 minutes)
+            blocked_connection_timeout=300,  # Timeout for blocked connections
+            connection_attempts=3,  # Retry connection attempts
+            retry_delay=2  # Delay between retries
+        )
+
     def connect(self):
         """
         Step 1: Connect to RabbitMQ
@@ -44,22 +61,8 @@ class RabbitMQHelper:
         - Can have multiple channels on one connection
         """
         try:
-            # Create credentials (username/password)
-            credentials = pika.PlainCredentials(self.username, self.password)
-            
-            # Connection parameters (where to connect)
-            parameters = pika.ConnectionParameters(
-                host=self.host,
-                port=self.port,
-                credentials=credentials,
-                heartbeat=600,  # Keep connection alive (10 minutes)
-                blocked_connection_timeout=300,  # Timeout for blocked connections
-                connection_attempts=3,  # Retry connection attempts
-                retry_delay=2  # Delay between retries
-            )
-            
             # Actually connect (dial the phone)
-            self.connection = pika.BlockingConnection(parameters)
+            self.connection = pika.BlockingConnection(self.connection_parameters())
             
             # Create a channel (start a conversation)
             self.channel = self.connection.channel()
@@ -67,7 +70,7 @@ class RabbitMQHelper:
             logger.info("Connected to RabbitMQ!")
             return True
         except Exception as e:
-            logger.error(f"Connection failed: {e}")
+            logger.error("Connection failed: %s", e)
             raise
     
     def setup_queue(self, queue_name="user_onboarding_queue"):
@@ -113,22 +116,27 @@ class RabbitMQHelper:
             }
         )
         
-        logger.info(f"Queue '{queue_name}' created with DLQ: '{queue_name}_dlq'")
+        logger.info("Queue '%s' created with DLQ: '%s_dlq'", queue_name, queue_name)
     
     def _ensure_connection(self):
         """Ensure connection and channel are open, reconnect if needed"""
         try:
             # Check if connection is closed or doesn't exist
             if not self.connection or self.connection.is_closed:
+                if self.connection:
+                    RMQ_RECONNECTS.labels("connection").inc()
                 logger.warning("Connection closed, reconnecting...")
                 self.connect()
             # Check if channel is closed or doesn't exist
             elif not self.channel or self.channel.is_closed:
+                if self.channel:
+                    RMQ_RECONNECTS.labels("channel").inc()
                 logger.warning("Channel closed, recreating...")
                 self.channel = self.connection.channel()
         except Exception as e:
-            logger.error(f"Error ensuring connection: {e}")
+            logger.error("Error ensuring connection: %s", e)
             # Force reconnect
+            RMQ_RECONNECTS.labels("connection").inc()
             self.connection = None
             self.channel = None
             self.connect()
@@ -153,8 +161,13 @@ class RabbitMQHelper:
         # Ensure connection is open before publishing
         self._ensure_connection()
         
-        # Convert message to JSON string
-        message_json = json.dumps(message_data)
+        # Convert the message to bytes (JSON or the binary format, see app/message_codec.py)
+        encoded = message_codec.encode(message_data)
+        properties = pika.BasicProperties(
+            delivery_mode=2,  # Make message persistent (survives server restart)
+            content_type=encoded.content_type,  # Message format, tells the consumer how to decode it
+            content_encoding=encoded.content_encoding,  # "zlib" when the body is compressed
+        )
         
         try:
             # Publish the message
@@ -164,29 +177,23 @@ class RabbitMQHelper:
             self.channel.basic_publish(
                 exchange='',  # Default exchange (simplest - routes directly to queue)
                 routing_key=queue_name,  # Which queue to send to
-                body=message_json,  # The actual message
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent (survives server restart)
-                    content_type='application/json',  # Message format
-                )
+                body=encoded.body,  # The actual message
+                properties=properties,
             )
-            logger.info(f"Message published to '{queue_name}': {message_data.get('user_id', 'N/A')}")
+            logger.debug("Message published to '%s': %s", queue_name, message_data.get('user_id', 'N/A'))
         except (pika.exceptions.ConnectionClosed, pika.exceptions.ChannelClosed, BrokenPipeError) as e:
-            logger.warning(f"Connection/channel error during publish: {e}, reconnecting...")
+            logger.warning("Connection/channel error during publish: %s, reconnecting...", e)
             # Reconnect and retry once
             self._ensure_connection()
             self.channel.basic_publish(
                 exchange='',
                 routing_key=queue_name,
-                body=message_json,
-                properties=pika.BasicProperties(
-                    delivery_mode=2,
-                    content_type='application/json',
-                )
+                body=encoded.body,
+                properties=properties,
             )
-            logger.info(f"Message published to '{queue_name}' after reconnect: {message_data.get('user_id', 'N/A')}")
+            logger.debug("Message published to '%s' after reconnect: %s", queue_name, message_data.get('user_id', 'N/A'))
     
-    def consume_messages(self, queue_name, callback_function):
+    def consume_messages(self, queue_name, callback_function, stop_event=None):
         """
         Step 4: Consume Messages
         
@@ -201,6 +208,10 @@ class RabbitMQHelper:
         Concept: Acknowledgment (ACK)
         - Telling RabbitMQ: "I got the message, you can delete it"
         - If you don't ACK, message stays in queue (for retry)
+
+        Concept: Graceful stop
+        - When stop_event (a threading.Event) is set, stop taking new
+          messages; the message being processed is finished and ACKed first
         """
         if not self.channel:
             self.connect()
@@ -208,9 +219,9 @@ class RabbitMQHelper:
         # Define what to do when a message arrives
         def on_message_received(ch, method, properties, body):
             try:
-                # Parse the message
-                message = json.loads(body)
-                logger.info(f"Received message: {message.get('user_id', 'N/A')}")
+                # Parse the message (the codec is picked by its content_type)
+                message = message_codec.decode(body, properties.content_type, properties.content_encoding)
+                logger.debug("Received message: %s", message.get('user_id', 'N/A'))
                 
                 # Process the message using your callback function
                 success = callback_function(message)
@@ -218,31 +229,157 @@ class RabbitMQHelper:
                 if success:
                     # Acknowledge: "Message processed successfully, you can delete it"
                     ch.basic_ack(delivery_tag=method.delivery_tag)
-                    logger.info("Message processed and acknowledged")
+                    logger.debug("Message processed and acknowledged")
                 else:
                     # Negative Acknowledge: "Message failed, don't delete it yet"
                     # requeue=False means: "Don't put it back, send to DLQ"
                     ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                    DLQ_NACKS.labels(queue_name).inc()
                     logger.warning("Message processing failed, sent to DLQ")
                     
             except Exception as e:
-                logger.error(f"Error processing message: {e}")
+                logger.error("Error processing message: %s", e)
                 # Send to DLQ on error
                 ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                DLQ_NACKS.labels(queue_name).inc()
         
         # Start consuming (start checking the mailbox)
-        self.channel.basic_consume(
+        consumer_tag = self.channel.basic_consume(
             queue=queue_name,
             on_message_callback=on_message_received,
             auto_ack=False  # Manual acknowledgment (we control when to ACK)
         )
         
-        logger.info(f"Listening for messages on '{queue_name}'...")
+        logger.info("Listening for messages on '%s'...", queue_name)
         logger.info("Press CTRL+C to stop")
         
-        # Start consuming (this blocks and waits for messages)
-        self.channel.start_consuming()
+        if stop_event is None:
+            # Start consuming (this blocks and waits for messages)
+            self.channel.start_consuming()
+            return
+
+        # Same as start_consuming, but wakes up every second to check stop_event
+        while not stop_event.is_set():
+            self.connection.process_data_events(time_limit=1)
+        self._stop_consuming(consumer_tag)
+
+    def _stop_consuming(self, consumer_tag):
+        """Cancel the consumer: RabbitMQ stops sending and requeues anything we never ACKed"""
+        try:
+            self.channel.basic_cancel(consumer_tag)
+            logger.info("Consumer cancelled, no new messages will be delivered")
+        except Exception as e:
+            logger.warning("Error cancelling consumer: %s", e)
     
+    def consume_batches(self, queue_name, batch_callback, batch_size=100, max_linger=0.05, prefetch_count=None, stop_event=None):
+        """
+        Step 4b: Consume Messages in Batches
+
+        Concept: Prefetch (QoS)
+        - Tells RabbitMQ how many un-acked messages it may push to us at once
+        - Without it the broker sends one message, waits for the ACK, sends the next
+        - Should be at least batch_size so a full batch can arrive in one go
+
+        Concept: Batching
+        - Collect deliveries until we have batch_size of them, or until the
+          oldest one has waited max_linger seconds
+        - Hand the whole batch to batch_callback(messages), which returns one
+          True/False per message (same order)
+        - Failed messages are NACKed one by one (-> DLQ), then everything else
+          is ACKed with a single multiple=True ACK
+
+        Concept: Graceful stop (drain)
+        - When stop_event (a threading.Event) is set: cancel the consumer so
+          no new messages arrive, process and ACK everything already received,
+          then return
+        """
+        self._ensure_connection()
+        self.channel.basic_qos(prefetch_count=prefetch_count or batch_size)
+
+        pending = []
+
+        def on_message_received(ch, method, properties, body):
+            pending.append((method, properties, body))
+
+        consumer_tag = self.channel.basic_consume(
+            queue=queue_name,
+            on_message_callback=on_message_received,
+            auto_ack=False
+        )
+
+        logger.info("Listening for messages on '%s' (batch_size=%s, max_linger=%ss, prefetch=%s)...", queue_name, batch_size, max_linger, prefetch_count or batch_size)
+        logger.info("Press CTRL+C to stop")
+
+        first_received_at = None
+        while not (stop_event and stop_event.is_set()):
+            if pending:
+                remaining = max(0, max_linger - (time.monotonic() - first_received_at))
+                self.connection.process_data_events(time_limit=remaining)
+            else:
+                # Nothing buffered - block until the broker sends something
+                # (wake up every second to check stop_event if there is one)
+                self.connection.process_data_events(time_limit=1 if stop_event else None)
+
+            if not pending:
+                continue
+            if first_received_at is None:
+                first_received_at = time.monotonic()
+
+            if len(pending) >= batch_size or time.monotonic() - first_received_at >= max_linger:
+                batch = pending[:batch_size]
+                del pending[:batch_size]
+                self._process_batch(queue_name, batch, batch_callback)
+                first_received_at = time.monotonic() if pending else None
+
+        # Drain: stop deliveries, then finish what we already have
+        self._stop_consuming(consumer_tag)
+        self.connection.process_data_events(time_limit=0)
+        while pending:
+            batch = pending[:batch_size]
+            del pending[:batch_size]
+            self._process_batch(queue_name, batch, batch_callback)
+        logger.info("Consumer drained")
+
+    def _process_batch(self, queue_name, batch, batch_callback):
+        """Decode, process and settle (ACK/NACK) one batch of deliveries"""
+        deliveries = []
+        for method, properties, body in batch:
+            try:
+                deliveries.append((method.delivery_tag, message_codec.decode(body, properties.content_type, properties.content_encoding)))
+            except Exception as e:
+                logger.error("Could not decode message %s: %s", method.delivery_tag, e)
+                self.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+                DLQ_NACKS.labels(queue_name).inc()
+
+        if not deliveries:
+            return
+
+        tags = [tag for tag, _ in deliveries]
+        try:
+            results = batch_callback([message for _, message in deliveries])
+        except Exception as e:
+            logger.error("Error processing batch of %s messages: %s", len(deliveries), e)
+            # Send the whole batch to DLQ
+            self.channel.basic_nack(delivery_tag=max(tags), multiple=True, requeue=False)
+            DLQ_NACKS.labels(queue_name).inc(len(tags))
+            return
+
+        succeeded = []
+        for tag, success in zip(tags, results):
+            if success:
+                succeeded.append(tag)
+            else:
+                # NACK failures individually first, so the multiple=True ACK
+                # below only settles the messages that actually succeeded
+                self.channel.basic_nack(delivery_tag=tag, requeue=False)
+                DLQ_NACKS.labels(queue_name).inc()
+
+        if succeeded:
+            self.channel.basic_ack(delivery_tag=max(succeeded), multiple=True)
+
+        failed = len(tags) - len(succeeded)
+        logger.info("Batch of %s messages processed: %s acknowledged, %s sent to DLQ", len(tags), len(succeeded), failed)
+
     def close(self):
         """Close the connection (hang up the phone)"""
         if self.connection and not self.connection.is_closed:
@@ -0,0 +1,256 @@
+"""
+Confirming Publisher - Know that RabbitMQ really has the message
+
+Concept: Publisher Confirms
+- Without confirms basic_publish is "fire and forget": if the broker drops
+  the message we never find out
+- In confirm mode the broker answers every publish with an ACK (stored) or
+  a NACK (lost), identified by a delivery tag (1, 2, 3, ... per channel)
+
+Concept: Pipelining (window)
+- Waiting for each confirm before sending the next message would add one
+  full round trip per publish
+- Instead up to `window` publishes are in flight at once; each caller gets
+  a Future that is resolved when its own ACK/NACK arrives
+- One ACK with multiple=True confirms every tag up to that one
+
+Concept: IO thread
+- One pika SelectConnection runs its event loop on a background thread
+- Request threads never touch it directly: they hand publishes over with
+  add_callback_threadsafe(), so it is safe to use from any thread
+"""
+from app.rmq_adapter import RabbitMQHelper
+from app.metrics import RMQ_RECONNECTS
+from app import message_codec
+from concurrent.futures import Future, wait, FIRST_EXCEPTION
+from pika.adapters.select_connection import IOLoop
+from dotenv import load_dotenv
+import functools
+import threading
+import logging
+import pika
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+
+class PublishNacked(Exception):
+    """The broker refused (NACK) or could not route (Basic.Return) the message"""
+
+
+class ConfirmingPublisher:
+
+    def __init__(self, window=None, confirm_timeout=None, reconnect_delay=2):
+        self.window = window or int(os.getenv("RMQ_CONFIRM_WINDOW", "1000"))
+        self.confirm_timeout = confirm_timeout or float(os.getenv("RMQ_CONFIRM_TIMEOUT", "5"))
+        self.reconnect_delay = reconnect_delay
+        self.parameters = RabbitMQHelper().connection_parameters()
+
+        self._slots = threading.BoundedSemaphore(self.window)
+        self._ready = threading.Event()
+        self._ioloop = IOLoop()
+        self._thread = None
+        self._connection = None
+        self._channel = None
+        self._stopping = False
+
+        # Only touched on the IO thread
+        self._delivery_tag = 0
+        self._outstanding = {}  # delivery_tag -> Future
+        self._returned = set()  # delivery tags that came back as Basic.Return
+
+    # ---- lifecycle ----
+
+    def start(self, timeout=10):
+        """Start the IO thread and wait until the confirm-mode channel is open"""
+        self._thread = threading.Thread(target=self._run, name="rmq-confirming-publisher", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            self.close()
+            raise ConnectionError(f"RabbitMQ confirming publisher not ready after {timeout}s")
+        return self
+
+    def _run(self):
+        self._connect()
+        self._ioloop.start()
+
+    def _connect(self):
+        self._connection = pika.SelectConnection(
+            self.parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._ioloop,
+        )
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        logger.error("Confirming publisher connection failed: %s", error)
+        self._schedule_reconnect()
+
+    def _on_connection_closed(self, connection, reason):
+        self._ready.clear()
+        self._channel = None
+        self._fail_outstanding(ConnectionError(f"RabbitMQ connection closed: {reason}"))
+        if self._stopping:
+            self._ioloop.stop()
+        else:
+            logger.warning("Confirming publisher connection closed: %s, reconnecting...", reason)
+            RMQ_RECONNECTS.labels("confirming_publisher").inc()
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if not self._stopping:
+            self._ioloop.call_later(self.reconnect_delay, self._connect)
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        self._delivery_tag = 0  # tags restart at 1 on every new channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.add_on_return_callback(self._on_returned)
+        channel.confirm_delivery(ack_nack_callback=self._on_confirm, callback=self._on_confirm_select_ok)
+
+    def _on_confirm_select_ok(self, frame):
+        logger.info("Confirming publisher ready (window %s)", self.window)
+        self._ready.set()
+
+    def _on_channel_closed(self, channel, reason):
+        self._ready.clear()
+        self._channel = None
+        self._fail_outstanding(ConnectionError(f"RabbitMQ channel closed: {reason}"))
+        if self._connection and self._connection.is_open and not self._stopping:
+            logger.warning("Confirming publisher channel closed: %s, reopening...", reason)
+            RMQ_RECONNECTS.labels("confirming_publisher_channel").inc()
+            self._connection.channel(on_open_callback=self._on_channel_open)
+
+    def close(self):
+        """Close the connection (outstanding publishes fail) and stop the IO thread"""
+        self._stopping = True
+        if self._thread and self._thread.is_alive():
+            self._ioloop.add_callback_threadsafe(self._close_connection)
+            self._thread.join(timeout=10)
+        logger.info("Confirming publisher closed")
+
+    def _close_connection(self):
+        if self._connection and not (self._connection.is_closing or self._connection.is_closed):
+            self._connection.close()
+        else:
+            self._ioloop.stop()
+
+    @property
+    def is_ready(self):
+        """Connected with confirms enabled (False while reconnecting)"""
+        return self._ready.is_set()
+
+    @property
+    def in_flight(self):
+        """Publishes sent but not yet confirmed"""
+        return len(self._outstanding)
+
+    # ---- publishing ----
+
+    def publish(self, queue_name, message_data) -> Future:
+        """
+        Queue a publish and return immediately with a Future.
+        future.result() is True on ACK, raises PublishNacked on NACK/return.
+        Blocks only when `window` publishes are already waiting for confirms.
+        """
+        if not self._ready.is_set():
+            raise ConnectionError("RabbitMQ confirming publisher is not connected")
+        if not self._slots.acquire(timeout=self.confirm_timeout):
+            raise TimeoutError(f"Confirm window full ({self.window} publishes in flight)")
+
+        future = Future()
+        future.add_done_callback(lambda _: self._slots.release())
+        # Encoded on the calling thread, the IO thread only sends
+        encoded = message_codec.encode(message_data)
+        self._ioloop.add_callback_threadsafe(functools.partial(self._publish, queue_name, encoded, future))
+        return future
+
+    def _publish(self, queue_name, encoded, future):
+        """Runs on the IO thread"""
+        if self._channel is None or not self._channel.is_open:
+            future.set_exception(ConnectionError("RabbitMQ channel is not open"))
+            return
+        # The broker only numbers publishes it received: a basic_publish that raised must not use up a tag,
+        # or every later confirm would resolve the Future of the message before it
+        tag = self._delivery_tag + 1
+        try:
+            self._channel.basic_publish(
+                exchange='',
+                routing_key=queue_name,
+                body=encoded.body,
+                properties=pika.BasicProperties(
+                    delivery_mode=2,
+                    content_type=encoded.content_type,
+                    content_encoding=encoded.content_encoding,
+                    message_id=str(tag),
+                ),
+                mandatory=True,  # unroutable messages come back instead of being dropped
+            )
+        except Exception as e:
+            future.set_exception(e)
+            return
+        self._delivery_tag = tag
+        self._outstanding[tag] = future
+
+    def _on_returned(self, channel, method, properties, body):
+        """Runs on the IO thread. Basic.Return arrives before the ACK for the same message"""
+        logger.error("Message returned by broker: %s", method.reply_text)
+        if properties.message_id:
+            self._returned.add(int(properties.message_id))
+
+    def _on_confirm(self, frame):
+        """Runs on the IO thread. Resolve the Future(s) this ACK/NACK is about"""
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self._outstanding if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        for tag in tags:
+            future = self._outstanding.pop(tag, None)
+            if future is None:
+                continue
+            if tag in self._returned:
+                self._returned.discard(tag)
+                future.set_exception(PublishNacked(f"Message {tag} could not be routed"))
+            elif acked:
+                future.set_result(True)
+            else:
+                future.set_exception(PublishNacked(f"Message {tag} was NACKed by the broker"))
+
+    def _fail_outstanding(self, error):
+        """Runs on the IO thread when the channel or connection closes: no confirm will come for these any more"""
+        outstanding, self._outstanding = self._outstanding, {}
+        self._delivery_tag = 0  # a closed channel's tags are gone, the next one starts at 1 again
+        self._returned.clear()
+        for future in outstanding.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def publish_and_wait(self, queue_name, message_data, timeout=None):
+        """Publish one message and block until the broker confirms it"""
+        return self.publish(queue_name, message_data).result(timeout=timeout or self.confirm_timeout)
+
+    def publish_many(self, queue_name, messages):
+        """Pipeline many publishes, returns one Future per message (same order)"""
+        return [self.publish(queue_name, message) for message in messages]
+
+    def wait_for_confirms(self, futures, timeout=None):
+        """
+        Batch-await confirms: block until all futures are resolved (or one fails),
+        then raise the first error. Use this after publish_many().
+        """
+        done, not_done = wait(futures, timeout=timeout or self.confirm_timeout, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future in done and future.exception():
+                raise future.exception()
+        if not_done:
+            raise TimeoutError(f"{len(not_done)} publishes not confirmed in time")
+        return True
@@ -0,0 +1,171 @@
+"""
+RabbitMQ Connection Pool - Safe publishing from many threads
+
+Concept: Thread Safety
+- pika's BlockingConnection (and its channels) must only be used by one
+  thread at a time
+- FastAPI runs sync endpoints on a threadpool, so concurrent /signup
+  requests must not share one connection
+
+Concept: Pool
+- Keeps up to `size` RabbitMQHelper instances, each with its own connection
+- checkout() hands one to a single thread, checkin() gives it back
+- Broken connections are thrown away and replaced on the next checkout
+"""
+from app.rmq_adapter import RabbitMQHelper
+from app.metrics import RMQ_RECONNECTS
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import threading
+import logging
+import queue
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+
+class PoolTimeout(Exception):
+    """No connection became available within the checkout timeout"""
+
+
+class RabbitMQChannelPool:
+
+    def __init__(self, size=None, checkout_timeout=None):
+        self.size = size or int(os.getenv("RMQ_POOL_SIZE", "10"))
+        self.checkout_timeout = checkout_timeout or float(os.getenv("RMQ_POOL_TIMEOUT", "5"))
+
+        self._idle = queue.LifoQueue()  # LIFO: reuse the most recently used (warmest) connection
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    @property
+    def checked_out(self):
+        """Number of connections currently in use"""
+        return self._created - self._idle.qsize()
+
+    def _is_healthy(self, rmq: RabbitMQHelper):
+        """Connection and channel are open, and heartbeats/pending frames are serviced"""
+        try:
+            if not rmq.connection or rmq.connection.is_closed:
+                return False
+            if not rmq.channel or rmq.channel.is_closed:
+                return False
+            # Idle BlockingConnections don't answer heartbeats on their own
+            rmq.connection.process_data_events(time_limit=0)
+            return True
+        except Exception as e:
+            logger.warning("Pooled RabbitMQ connection failed health check: %s", e)
+            return False
+
+    def _replace(self, rmq: RabbitMQHelper):
+        """Drop a broken connection; a new one is made on a later checkout"""
+        RMQ_RECONNECTS.labels("pool").inc()
+        self._discard(rmq)
+
+    def _discard(self, rmq: RabbitMQHelper):
+        with self._lock:
+            self._created -= 1
+        try:
+            rmq.close()
+        except Exception:
+            pass
+
+    def _create(self):
+        rmq = RabbitMQHelper()
+        try:
+            rmq.connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        return rmq
+
+    def checkout(self, timeout=None) -> RabbitMQHelper:
+        """Take a connection out of the pool (blocks while all `size` connections are in use)"""
+        if self._closed:
+            raise RuntimeError("RabbitMQ pool is closed")
+
+        while True:
+            try:
+                rmq = self._idle.get_nowait()
+            except queue.Empty:
+                rmq = None
+
+            if rmq is None:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    return self._create()
+
+                try:
+                    rmq = self._idle.get(timeout=timeout or self.checkout_timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f"No RabbitMQ connection available after {timeout or self.checkout_timeout}s (pool size {self.size})")
+
+            if self._is_healthy(rmq):
+                return rmq
+            self._replace(rmq)
+
+    def checkin(self, rmq: RabbitMQHelper, discard=False):
+        """Give a connection back to the pool, or drop it if it is broken"""
+        if discard or self._closed:
+            self._discard(rmq)
+        else:
+            self._idle.put(rmq)
+
+    @contextmanager
+    def connection(self):
+        rmq = self.checkout()
+        try:
+            yield rmq
+        except Exception:
+            RMQ_RECONNECTS.labels("pool").inc()
+            self.checkin(rmq, discard=True)
+            raise
+        else:
+            self.checkin(rmq)
+
+    def publish(self, queue_name, message_data):
+        """Publish on a pooled connection, safe to call from any thread"""
+        with self.connection() as rmq:
+            rmq.publish_message(queue_name, message_data)
+
+    def publish_many(self, queue_name, messages):
+        """
+        Publish all messages on one pooled connection (no round trip per message).
+        Returns one error (or None) per message; once the connection breaks the
+        remaining messages are not sent and get the same error
+        """
+        errors = [None] * len(messages)
+        rmq = self.checkout()
+        broken = None
+        for i, message_data in enumerate(messages):
+            if broken is None:
+                try:
+                    rmq.publish_message(queue_name, message_data)
+                except Exception as e:
+                    broken = e
+            errors[i] = broken
+        if broken is not None:
+            RMQ_RECONNECTS.labels("pool").inc()
+        self.checkin(rmq, discard=broken is not None)
+        return errors
+
+    def setup_queue(self, queue_name="user_onboarding_queue"):
+        with self.connection() as rmq:
+            rmq.setup_queue(queue_name)
+
+    def close(self):
+        """Close all idle connections, checked out ones are closed on checkin"""
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        logger.info("RabbitMQ pool closed")
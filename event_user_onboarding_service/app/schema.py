@@ -1,11 +1,16 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
+
+# The users columns are String(255) (app/models.py); a password is only ever hashed
+NAME_MAX_LENGTH = 255
+PASSWORD_MAX_LENGTH = 128
 
 class UserRequest(BaseModel):
-    email: str
-    first_name: str
-    last_name: str
-    password: str
+    email: str = Field(max_length=NAME_MAX_LENGTH)
+    first_name: str = Field(max_length=NAME_MAX_LENGTH)
+    last_name: str = Field(max_length=NAME_MAX_LENGTH)
+    password: str = Field(max_length=PASSWORD_MAX_LENGTH)
 
 class UserResponse(BaseModel):
     status: str
@@ -21,4 +26,32 @@ class UserDetailsResponse(BaseModel):
     last_name: str = None
     verification_state: str = None
     user_id: str = None
-    created_on: datetime = None
\ No newline at end of file
+    created_on: datetime = None
+
+
+class UserSummary(BaseModel):
+    user_id: str
+    email: str
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    verification_state: str
+    created_on: datetime
+
+class UserListResponse(BaseModel):
+    status: str
+    users: List[UserSummary]
+    next_cursor: Optional[str] = None
+
+class VerifyRequest(BaseModel):
+    user_ids: List[str]
+
+class VerifyResult(BaseModel):
+    user_id: str
+    outcome: str
+
+class VerifyResponse(BaseModel):
+    status: str
+    verified: int
+    already_verified: int
+    not_found: int
+    results: List[VerifyResult]
@@ -0,0 +1,183 @@
+"""
+Shared key/value store used across processes (API workers, consumers)
+
+Concept: Pluggable backend
+- SHARED_STORE_URL picks the backend:
+    ""          -> no shared store (each process only has its own memory)
+    memory://   -> InMemoryStore, a local stand-in (tests, single process)
+    redis://... -> RedisStore (needs the `redis` package)
+- Values are strings, every key can expire (ttl in seconds)
+
+Concept: Write markers
+- write_marker(user_id) is set for DB_READ_YOUR_WRITES_SECONDS after a
+  user's row changed (Database.note_writes): every process then reads that
+  user from the primary, and the user cache refuses to fill (set_unless)
+  while it exists, so a row read from a lagging replica can't be cached
+"""
+from dotenv import load_dotenv
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+
+def write_marker(key: str):
+    """The key that marks `key` (a normalized user_id) as written recently"""
+    return f"wrote:{key}"
+
+
+class SharedStore:
+    """Interface every backend implements"""
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Values of several keys in one round trip (None for missing ones)"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: float = None):
+        raise NotImplementedError
+
+    def set_many(self, values: dict, ttl: float = None):
+        """set() for every key -> value, in one round trip"""
+        raise NotImplementedError
+
+    def set_unless(self, key: str, value: str, ttl: float = None, guard: str = None):
+        """Atomically set key unless the guard key exists. True if it was set"""
+        raise NotImplementedError
+
+    def delete(self, *keys: str):
+        raise NotImplementedError
+
+    def set_if_absent(self, key: str, value: str, ttl: float = None):
+        """Atomically set key unless it exists. True if it was set"""
+        raise NotImplementedError
+
+    def delete_if_equals(self, key: str, value: str):
+        """Atomically delete key only if it still holds value"""
+        raise NotImplementedError
+
+
+class InMemoryStore(SharedStore):
+    """Local stand-in for a shared store: a dict with expiry"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}  # key -> (value, expires_at or None)
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def get_many(self, keys):
+        with self._lock:
+            return [self._get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def set_many(self, values, ttl=None):
+        with self._lock:
+            for key, value in values.items():
+                self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def set_unless(self, key, value, ttl=None, guard=None):
+        with self._lock:
+            if guard is not None and self._get(guard) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def set_if_absent(self, key, value, ttl=None):
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+            return True
+
+    def delete_if_equals(self, key, value):
+        with self._lock:
+            if self._get(key) == value:
+                del self._data[key]
+
+
+class RedisStore(SharedStore):
+    """Redis backend, shared by every process pointing at the same server"""
+
+    # GET + DEL as one atomic server-side step
+    DELETE_IF_EQUALS = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+    # EXISTS guard + SET as one atomic server-side step (ARGV[2]: ttl in ms, 0 for none)
+    SET_UNLESS = ("if redis.call('exists', KEYS[2]) == 1 then return 0 end "
+                  "if tonumber(ARGV[2]) > 0 then redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2]) "
+                  "else redis.call('set', KEYS[1], ARGV[1]) end return 1")
+
+    def __init__(self, url):
+        import redis  # only needed when a redis:// store is configured
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._delete_if_equals = self.client.register_script(self.DELETE_IF_EQUALS)
+        self._set_unless = self.client.register_script(self.SET_UNLESS)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def get_many(self, keys):
+        return self.client.mget(keys) if keys else []
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def set_many(self, values, ttl=None):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(key, value, px=int(ttl * 1000) if ttl else None)
+        pipe.execute()
+
+    def set_unless(self, key, value, ttl=None, guard=None):
+        if guard is None:
+            self.set(key, value, ttl)
+            return True
+        return bool(self._set_unless(keys=[key, guard], args=[value, int(ttl * 1000) if ttl else 0]))
+
+    def delete(self, *keys):
+        # One DEL for all of them
+        if keys:
+            self.client.delete(*keys)
+
+    def set_if_absent(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def delete_if_equals(self, key, value):
+        self._delete_if_equals(keys=[key], args=[value])
+
+
+def create_shared_store(url=None):
+    """Build the backend configured by SHARED_STORE_URL (None if not configured)"""
+    url = url if url is not None else os.getenv("SHARED_STORE_URL", "")
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return InMemoryStore()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisStore(url)
+    raise ValueError(f"Unsupported SHARED_STORE_URL: {url}")
@@ -0,0 +1,439 @@
+"""
+Spool - a local write-ahead log for signups RabbitMQ can't take right now
+
+Concept: Write-ahead spool
+- When the broker is down, reconnecting, or slower than the latency budget
+  (SPOOL_LATENCY_BUDGET_MS), /signup appends the message to a file on local
+  disk instead of failing, and answers 201 once it is on disk
+- A forwarder thread publishes the spooled messages to user_onboarding_queue
+  in the order they were written, as soon as the broker takes them again
+- While anything is still spooled new signups are spooled too, so nothing
+  overtakes the backlog and a recovering broker isn't hit twice as hard
+
+Concept: Group commit
+- fsync() is what makes a write survive a crash, and it costs about as much
+  for one line as for a hundred
+- Appending threads only write into the file buffer and wait; a flusher
+  thread fsyncs every SPOOL_FSYNC_INTERVAL_MS and wakes everyone whose line
+  that fsync covered. Under load one fsync commits many signups
+
+Concept: Segments
+- The spool is a directory of numbered append-only files; a new one starts
+  every SPOOL_SEGMENT_BYTES (and on every start), a segment is deleted once
+  the forwarder has published all of it
+- The forwarder's position (segment, offset) is kept in a cursor file; after
+  a crash the records since the last saved position are published again.
+  That is safe: the consumer skips user_ids it already has
+
+- The forwarder only reads up to the last fsynced position: a line that is
+  in the file but not durable yet may still be lost in a crash (and answered
+  503), so it must not be published before its fsync
+
+Concept: Slots
+- Every API worker process needs a spool of its own: SPOOL_DIR/slot-N, taken
+  with an exclusive file lock. A restarted worker takes over a free slot,
+  including whatever the previous owner left in it
+- Slots at or above SPOOL_SLOTS (default WEB_CONCURRENCY, else 1: the number
+  of API workers) are left behind when the worker count goes down. On start a
+  worker locks the free ones and forwards what they hold next to its own
+  spool, then lets them go
+
+Concept: Failures
+- A write, rotation or fsync error (disk full, I/O error) marks the spool as
+  failed: after a failed fsync nothing says what reached the disk. Waiting
+  appenders are woken and get SpoolClosed, answered as 503 instead of a 201
+  for a signup that may not be durable. The views stop using a failed spool
+  (helper.get_spool) and publish straight to RabbitMQ; what it already holds
+  is still forwarded
+- An appender waits at most SPOOL_SYNC_TIMEOUT_MS for its fsync, so a stuck
+  disk turns into 503s rather than request threads blocked forever
+
+Settings: SPOOL_ENABLED (default true), SPOOL_DIR (default spool),
+SPOOL_SEGMENT_BYTES (default 16 MiB), SPOOL_FSYNC_INTERVAL_MS (default 2),
+SPOOL_LATENCY_BUDGET_MS (default 500), SPOOL_FORWARD_BATCH (default 500),
+SPOOL_SYNC_TIMEOUT_MS (default 5000), SPOOL_SLOTS (default WEB_CONCURRENCY or 1)
+"""
+from app.metrics import SPOOL_APPENDS, SPOOL_FORWARDED, SPOOL_DEPTH
+from fastapi import HTTPException
+from dotenv import load_dotenv
+import functools
+import threading
+import logging
+import random
+import fcntl
+import json
+import time
+import os
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+logger = logging.getLogger(__name__)
+
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "true").lower() == "true"
+LATENCY_BUDGET = float(os.getenv("SPOOL_LATENCY_BUDGET_MS", "500")) / 1000
+
+SEGMENT_SUFFIX = ".log"
+
+
+class SpoolClosed(HTTPException):
+    """The spool can't take the signup (closed, failed or not synced in time); answered as 503"""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(status_code=503,
+                         detail={"status": "FAILURE", "message": f"{message}, retry later"},
+                         headers={"Retry-After": str(retry_after)})
+
+
+class Spool:
+
+    def __init__(self, directory, segment_bytes=None, fsync_interval=None, forward_batch=None, adopted=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or int(os.getenv("SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+        self.fsync_interval = fsync_interval if fsync_interval is not None else float(os.getenv("SPOOL_FSYNC_INTERVAL_MS", "2")) / 1000
+        self.forward_batch = forward_batch or int(os.getenv("SPOOL_FORWARD_BATCH", "500"))
+        self.sync_timeout = float(os.getenv("SPOOL_SYNC_TIMEOUT_MS", "5000")) / 1000
+
+        self._lock = threading.Lock()
+        self._synced_cond = threading.Condition(self._lock)
+        self._wake_flusher = threading.Condition(self._lock)
+        self._wake_forwarder = threading.Event()
+        self._stop = threading.Event()
+        self._closed = False
+        self._error = None  # the write/fsync error that failed the spool
+
+        self._written = 0   # lines appended since open
+        self._synced = 0    # lines covered by an fsync
+        self._depth = 0     # lines not forwarded yet (including ones left from a previous run)
+
+        self._threads = []
+        self._orphans = []  # adopted spools of slots no worker owns any more
+        self._cursor = self._load_cursor()
+        self._depth = self._count_backlog()
+        self._segment = max(self._segments(), default=0) + 1
+        # (segment, offset) up to which the segments are fsynced; the ones left from a previous run are complete
+        self._durable = (self._segment, 0)
+        if adopted:
+            # Only forwarded, never written to
+            self._file = None
+            return
+        self._file = open(self._segment_path(self._segment), "ab")
+        SPOOL_DEPTH.set_function(lambda: self.depth)
+        if self._depth:
+            logger.warning("Spool %s has %s signups left from a previous run", directory, self._depth)
+
+    @classmethod
+    def open_slot(cls, root=None, slots=None, **kwargs):
+        """
+        Lock the first free SPOOL_DIR/slot-N directory and open a spool in it.
+        Free slots at or above `slots` (the number of API workers) are adopted
+        """
+        root = root or os.getenv("SPOOL_DIR", "spool")
+        slots = slots or int(os.getenv("SPOOL_SLOTS", os.getenv("WEB_CONCURRENCY", "1")))
+        os.makedirs(root, exist_ok=True)
+        slot = 0
+        while True:
+            directory = os.path.join(root, f"slot-{slot}")
+            lock_file = cls._lock_slot(directory)
+            if lock_file is None:
+                slot += 1
+                continue
+            spool = cls(directory, **kwargs)
+            spool._lock_file = lock_file
+            spool._adopt_orphans(root, max(slots, slot + 1))
+            return spool
+
+    @staticmethod
+    def _lock_slot(directory):
+        """The slot's lock file with the exclusive lock held, None if another process holds it"""
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, "lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _adopt_orphans(self, root, first):
+        """Lock the free slot-N directories with N >= first that still hold signups"""
+        for name in sorted(os.listdir(root)):
+            number = name[len("slot-"):]
+            directory = os.path.join(root, name)
+            if not (name.startswith("slot-") and number.isdigit() and int(number) >= first and os.path.isdir(directory)):
+                continue
+            lock_file = self._lock_slot(directory)
+            if lock_file is None:
+                continue  # a live worker's slot
+            try:
+                orphan = type(self)(directory, forward_batch=self.forward_batch, adopted=True)
+            except OSError as e:
+                logger.error("Adopting spool %s failed: %s", directory, e)
+                lock_file.close()
+                continue
+            if not orphan.depth:
+                lock_file.close()
+                continue
+            orphan._lock_file = lock_file
+            self._orphans.append(orphan)
+            logger.warning("Adopted spool %s: %s signups left by a worker that is gone", directory, orphan.depth)
+
+    # ---- files ----
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:012d}{SEGMENT_SUFFIX}")
+
+    def _segments(self):
+        return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, "cursor")) as f:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as f:
+            f.write("%d %d" % self._cursor)
+        os.replace(path + ".tmp", path)
+
+    def _count_backlog(self):
+        count = 0
+        for segment in self._segments():
+            if segment < self._cursor[0]:
+                continue
+            with open(self._segment_path(segment), "rb") as f:
+                if segment == self._cursor[0]:
+                    f.seek(self._cursor[1])
+                count += sum(1 for line in f if line.endswith(b"\n"))
+        return count
+
+    # ---- writing ----
+
+    @property
+    def depth(self):
+        """Signups on disk that haven't been forwarded yet (adopted slots included)"""
+        return self._depth + sum(orphan._depth for orphan in self._orphans)
+
+    @property
+    def failed(self):
+        return self._error is not None
+
+    def append_many(self, messages, reason="unavailable"):
+        """
+        Write messages to the spool and return once they are fsynced.
+        Raises SpoolClosed if the spool is closed or failed, or the fsync doesn't come in time
+        """
+        lines = [json.dumps(message).encode() + b"\n" for message in messages]
+        deadline = time.monotonic() + self.sync_timeout
+        with self._lock:
+            self._check_open()
+            try:
+                for line in lines:
+                    self._file.write(line)
+                self._written += len(lines)
+                self._depth += len(lines)
+                ticket = self._written
+                if self._file.tell() >= self.segment_bytes:
+                    self._rotate()
+            except OSError as e:
+                self._fail(e)
+                raise SpoolClosed("Spool write failed") from e
+            self._wake_flusher.notify()
+            while self._synced < ticket:
+                self._check_open()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SpoolClosed("Spool write was not synced in time")
+                self._synced_cond.wait(remaining)
+        SPOOL_APPENDS.labels(reason).inc(len(lines))
+        self._wake_forwarder.set()
+
+    def append(self, message, reason="unavailable"):
+        self.append_many([message], reason)
+
+    def _check_open(self):
+        """Called with the lock held"""
+        if self._error is not None:
+            raise SpoolClosed("Spool failed") from self._error
+        if self._closed:
+            raise SpoolClosed("Spool is closed")
+
+    def _fail(self, error):
+        """Called with the lock held: record the error and wake everyone waiting for an fsync"""
+        if self._error is None:
+            self._error = error
+            logger.error("Spool %s failed, signups can't be spooled any more: %s", self.directory, error)
+        self._synced_cond.notify_all()
+
+    def _sync(self):
+        """Called with the lock held: make everything written so far durable"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced = self._written
+        self._durable = (self._segment, self._file.tell())
+        self._synced_cond.notify_all()
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), "ab")
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while self._synced == self._written and not self._closed and self._error is None:
+                    self._wake_flusher.wait()
+                if self._closed or self._error is not None:
+                    return
+            # Let more appenders join this fsync
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if self._synced < self._written and not self._closed and self._error is None:
+                    try:
+                        self._sync()
+                    except Exception as e:
+                        self._fail(e)
+                        return
+
+    # ---- forwarding ----
+
+    def start(self, forward):
+        """
+        forward(messages) publishes a list of messages and returns one error (or None)
+        per message; the forwarder stops at the first failure and tries again later
+        """
+        self._start_thread(self._flush_loop, "spool-flush")
+        self._start_thread(functools.partial(self._forward_loop, forward), "spool-forward")
+        for orphan in self._orphans:
+            orphan._start_thread(functools.partial(orphan._forward_loop, forward, until_drained=True),
+                                 f"spool-forward-{os.path.basename(orphan.directory)}")
+        return self
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _read_batch(self):
+        """Up to forward_batch complete, fsynced lines from the cursor on: [(message, (segment, end offset))]"""
+        segment, offset = self._cursor
+        with self._lock:
+            durable_segment, durable_offset = self._durable
+        batch = []
+        for current in self._segments():
+            if current < segment:
+                continue
+            if current > durable_segment:
+                break  # rotated into, nothing fsynced there yet
+            if current > segment:
+                offset = 0
+            with open(self._segment_path(current), "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # still being written (or cut off by a crash)
+                    if current == durable_segment and offset + len(line) > durable_offset:
+                        break  # written, but not fsynced yet
+                    offset += len(line)
+                    try:
+                        batch.append((json.loads(line), (current, offset)))
+                    except ValueError:
+                        logger.error("Skipping unreadable spool record in %s", self._segment_path(current))
+                        batch.append((None, (current, offset)))
+                    if len(batch) >= self.forward_batch:
+                        return batch
+        return batch
+
+    def _drop_forwarded_segments(self):
+        with self._lock:
+            active = self._segment
+        for segment in self._segments():
+            if segment < self._cursor[0] or (segment == self._cursor[0] and segment != active
+                                             and self._cursor[1] >= os.path.getsize(self._segment_path(segment))):
+                os.remove(self._segment_path(segment))
+                if segment == self._cursor[0]:
+                    self._cursor = (segment + 1, 0)
+                    self._save_cursor()
+
+    def _forward_loop(self, forward, until_drained=False):
+        failures = 0
+        while not self._stop.is_set():
+            try:
+                batch = self._read_batch()
+                if not batch:
+                    self._drop_forwarded_segments()
+            except OSError as e:
+                logger.error("Reading spool %s failed: %s", self.directory, e)
+                self._stop.wait(5)
+                continue
+            if not batch:
+                if until_drained and not self._depth:
+                    logger.info("Adopted spool %s drained", self.directory)
+                    return
+                self._wake_forwarder.wait(1)
+                self._wake_forwarder.clear()
+                continue
+
+            messages = [message for message, _ in batch if message is not None]
+            try:
+                errors = forward(messages) if messages else []
+            except Exception as e:
+                errors = [e] * len(messages)
+
+            # Advance over the leading run of published messages only: order is kept,
+            # anything after a failure is sent again (the consumer skips duplicates)
+            done, error, sent = 0, None, iter(errors)
+            for message, _ in batch:
+                if message is not None:
+                    error = next(sent)
+                    if error is not None:
+                        break
+                done += 1
+            if done:
+                self._cursor = batch[done - 1][1]
+                self._save_cursor()
+                with self._lock:
+                    self._depth -= done
+                SPOOL_FORWARDED.inc(done)
+
+            if error is not None:
+                failures += 1
+                delay = random.uniform(0, min(30, 0.5 * 2 ** min(failures, 16)))
+                logger.warning("Spool forward failed (%s left): %s, retrying in %.1fs", self._depth, error, delay)
+                self._stop.wait(delay)
+            else:
+                failures = 0
+
+    def close(self):
+        """Stop forwarding, sync what was written and release the slot (the rest is sent by the next owner)"""
+        self._stop.set()
+        self._wake_forwarder.set()
+        with self._lock:
+            if self._closed:
+                return
+            if self._error is None and self._file is not None:
+                try:
+                    self._sync()
+                except OSError as e:
+                    self._fail(e)
+            self._closed = True
+            try:
+                if self._file is not None:
+                    self._file.close()
+            except OSError as e:
+                logger.warning("Closing spool segment failed: %s", e)
+            self._wake_flusher.notify_all()
+            self._synced_cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        for orphan in self._orphans:
+            orphan.close()
+        lock_file = getattr(self, "_lock_file", None)
+        if lock_file:
+            lock_file.close()
+        logger.info("Spool %s closed, %s signups left to forward", self.directory, self._depth)
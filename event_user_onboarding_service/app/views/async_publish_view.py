@@ -0,0 +1,308 @@
+"""
+asyncio version of publish_view - same behaviour and responses, but the
+database (asyncpg) and RabbitMQ (aio-pika) calls never block the event loop.
+Everything but those calls lives in the shared helpers (views.signup, batch,
+listing, verification)
+"""
+from app.helpers.helper import get_user_cache, get_email_filter, get_pending_signups, get_async_rmq_instance, get_async_db_instance, get_spool, get_password_hasher
+from app.views.queries import select_user_by_email, select_users_by_emails, select_user_by_user_id, select_users_page, verify_users, select_verification_states, verify_pending_users
+from app.views import batch, listing, signup, verification
+from app.resources import DependencyUnavailable
+from app.metrics import DB_QUERY_SECONDS, PUBLISH_SECONDS
+from app.spool import LATENCY_BUDGET
+from fastapi import HTTPException
+import asyncio
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+async def send_to_rmq(data: dict, timeout=None):
+    rmq = await get_async_rmq_instance()
+    with PUBLISH_SECONDS.labels("async").time():
+        await asyncio.wait_for(rmq.publish_message('user_onboarding_queue', data), timeout)
+
+async def publish_to_rmq(data: dict):
+    try:
+        signup.stamp([data])
+        spool = get_spool()
+        if signup.backlogged(spool):
+            # Older signups are still waiting in the spool: queue up behind them
+            # (appending waits for an fsync, so it runs on a worker thread)
+            await asyncio.to_thread(spool.append, data, "backlog")
+            logger.info("User %s spooled behind %s others", data["user_id"], spool.depth - 1, extra={"user_id": data["user_id"]})
+            return
+        try:
+            await send_to_rmq(data, timeout=LATENCY_BUDGET if spool is not None else None)
+        except Exception as e:
+            if spool is None:
+                raise
+            # Broker down, reconnecting or over the latency budget: keep it on disk for the forwarder.
+            # A publish that timed out may still reach the queue, the consumer skips the duplicate
+            await asyncio.to_thread(spool.append, data, signup.spool_reason(e))
+            logger.warning("User %s spooled, RabbitMQ publish failed: %s", data["user_id"], e, extra={"user_id": data["user_id"]})
+            return
+        logger.info("User %s published to RMQ", data["user_id"], extra={"user_id": data["user_id"]})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error publishing to RMQ: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def user_exists(user_id: str):
+    try:
+        database = await get_async_db_instance()
+        user = database.get_table_class("users")
+        async with database.get_db(pin_primary=True) as sess:
+            with DB_QUERY_SECONDS.labels("user_exists").time():
+                q = (await sess.execute(select_user_by_email(user, user_id))).scalars().first()
+            return signup.registered(q)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error checking if user exists: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def onboard_user(data: dict):
+    try:
+        # Claim the email first: an O(1) answer for a signup that is still in the queue
+        user_id = str(uuid.uuid4())
+        pending = get_pending_signups()
+        pending_user_id = await pending.areserve(data["email"], user_id)
+        if pending_user_id:
+            raise signup.already_exists(pending_user_id, "PENDING")
+
+        try:
+            email_filter = get_email_filter()
+            if email_filter is None or await email_filter.amight_contain(data["email"]):
+                user_data = await user_exists(data["email"])
+            else:
+                # Definitely a new email - no need to ask the database
+                user_data = signup.registered(None)
+            if user_data["status"]:
+                raise signup.already_exists(user_data["user_id"], user_data["verification"])
+
+            signup.pending_user(data, user_id)
+            # Hashed on the process pool (429 when it is saturated), only the hash is published
+            data["password_hash"] = await get_password_hasher().ahash(data.pop("password"))
+            #PUBLISH TO RMQ
+            await publish_to_rmq(data)
+        except Exception:
+            # Not published (duplicate or error) - free the email again
+            await pending.arelease(data["email"], user_id)
+            raise
+
+        if email_filter is not None:
+            email_filter.add(data["email"])
+        return signup.created(user_id)
+
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def existing_users(emails):
+    """email -> (user_id, verification) for the emails that are already registered, in one query"""
+    if not emails:
+        return {}
+    database = await get_async_db_instance()
+    user = database.get_table_class("users")
+    async with database.get_db(pin_primary=True) as sess:
+        with DB_QUERY_SECONDS.labels("users_exist_batch").time():
+            rows = (await sess.execute(select_users_by_emails(user, emails))).all()
+    return signup.registered_many(rows)
+
+async def send_many_to_rmq(messages):
+    """Pipelined publish of a whole chunk, returns one error (or None) per message"""
+    rmq = await get_async_rmq_instance()
+    with PUBLISH_SECONDS.labels("async_batch").time():
+        return await rmq.publish_many('user_onboarding_queue', messages, return_exceptions=True)
+
+async def publish_many_to_rmq(messages):
+    """send_many_to_rmq, with the messages RabbitMQ didn't take written to the spool (if there is one)"""
+    signup.stamp(messages)
+    spool = get_spool()
+    if signup.backlogged(spool):
+        await asyncio.to_thread(spool.append_many, messages, "backlog")
+        return [None] * len(messages)
+    try:
+        errors = await send_many_to_rmq(messages)
+    except Exception as e:
+        if spool is None:
+            raise
+        errors = [e] * len(messages)
+    failed = signup.unsent(messages, errors)
+    if spool is None or not failed:
+        return errors
+    try:
+        await asyncio.to_thread(spool.append_many, failed, "unavailable")
+    except Exception as e:
+        logger.error("Spooling %s users failed: %s", len(failed), e)
+        return errors
+    logger.warning("%s users spooled, RabbitMQ publish failed: %s", len(failed), next(e for e in errors if e is not None))
+    return [None] * len(messages)
+
+async def onboard_users(items, seen_emails):
+    """
+    Batch version of onboard_user for one chunk of POST /signup/batch.
+    items: [(index, raw)], returns one result per item (see views.batch)
+    """
+    accepted, results = batch.validate_chunk(items, seen_emails)
+    pending = get_pending_signups()
+    email_filter = get_email_filter()
+
+    # Claim every email first, exactly like /signup
+    claimed = batch.claims(accepted)
+    claimed = batch.reserved(claimed, [await pending.areserve(data["email"], user_id) for _, data, user_id in claimed], results)
+
+    # One query for every email the Bloom filter can't rule out
+    try:
+        emails = [data["email"] for _, data, _ in claimed]
+        existing = await existing_users(emails if email_filter is None else await email_filter.amaybe_known(emails))
+    except Exception as e:
+        await pending.arelease_many(batch.releases(claimed))
+        batch.lookup_failed(claimed, e, results)
+        return results
+    to_publish, duplicates = batch.new_users(claimed, existing, results)
+    await pending.arelease_many(batch.releases(duplicates))
+
+    # Hash the whole chunk on the process pool; only the hashes are published
+    hashes = await get_password_hasher().ahash_many(batch.passwords(to_publish))
+    to_publish, failed = batch.hashed(to_publish, hashes, results)
+    await pending.arelease_many(batch.releases(failed))
+
+    try:
+        errors = await publish_many_to_rmq([data for _, data, _ in to_publish]) if to_publish else []
+    except DependencyUnavailable:
+        await pending.arelease_many(batch.releases(to_publish))
+        raise
+    except Exception as e:
+        errors = [e] * len(to_publish)
+    emails, failed = batch.published(to_publish, errors, results)
+    await pending.arelease_many(batch.releases(failed))
+    if email_filter is not None:
+        for email in emails:
+            email_filter.add(email)
+    return results
+
+async def list_users(cursor=None, limit=None, **query):
+    """One page of GET /users (keyset pagination, see app/views/listing.py)"""
+    try:
+        limit = limit or listing.PAGE_SIZE
+        database = await get_async_db_instance()
+        user = database.get_table_class("users")
+        stmt = select_users_page(user, listing.decode_cursor(cursor), **listing.filters(**query)).limit(limit + 1)
+        async with database.get_db() as sess:
+            with DB_QUERY_SECONDS.labels("list_users").time():
+                rows = (await sess.execute(stmt)).all()
+        return listing.page(rows, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error listing users: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def export_users(**query):
+    """
+    GET /users/export: checks the filters and the database right away (so errors
+    are still proper responses), returns an async generator of NDJSON chunks
+    """
+    try:
+        database = await get_async_db_instance()
+        user = database.get_table_class("users")
+        stmt = select_users_page(user, **listing.filters(**query))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error exporting users: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def chunks():
+        exported = 0
+        async with database.get_db() as sess:
+            # Server-side cursor: EXPORT_CHUNK_ROWS rows in memory at a time
+            result = await sess.stream(stmt, execution_options={"max_row_buffer": listing.EXPORT_CHUNK_ROWS})
+            async for rows in result.partitions(listing.EXPORT_CHUNK_ROWS):
+                exported += len(rows)
+                yield listing.ndjson_lines(rows)
+        logger.info("Exported %s users", exported)
+    return chunks()
+
+async def load_user_details(userid: str):
+    """Fetch the user's details from the database, None if there is no such user"""
+    database = await get_async_db_instance()
+    user = database.get_table_class("users")
+    async with database.get_db(pin_primary=await database.awrote_recently(verification.normalize_user_id(userid))) as sess:
+        with DB_QUERY_SECONDS.labels("get_user").time():
+            q = (await sess.execute(select_user_by_user_id(user, userid))).scalars().first()
+        return listing.details(q) if q else None
+
+async def get_user_details(userid: str):
+    try:
+        # Read-through cache in front of the database
+        user_details = await get_user_cache().aget_or_load(userid, lambda: load_user_details(userid))
+        if user_details:
+            return dict(user_details)
+        else:
+            raise listing.user_not_found()
+
+    except HTTPException as e:
+        raise
+
+    except Exception as e:
+        logger.error("Error getting user details: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def verify_ids(user_ids, metric="verify_users"):
+    """
+    Verify normalized user_ids with one conditional UPDATE per chunk,
+    returns {user_id: outcome}. Verified users are dropped from the cache
+    and read from the primary for a while
+    """
+    database = await get_async_db_instance()
+    user = database.get_table_class("users")
+    results = {}
+    async with database.get_db(pin_primary=True) as sess:
+        with DB_QUERY_SECONDS.labels(metric).time():
+            for chunk in verification.chunks(user_ids):
+                if verification.is_postgres(database):
+                    rows = (await sess.execute(verify_users(user, chunk))).all()
+                else:
+                    rows = verification.pending((await sess.execute(select_verification_states(user, chunk))).all())
+                    to_verify = [user_id for user_id, verified_now in rows if verified_now]
+                    if to_verify:
+                        await sess.execute(verify_pending_users(user, to_verify))
+                await sess.commit()
+                results.update(verification.outcomes(chunk, rows))
+    verified = verification.verified(results)
+    await database.anote_writes(verified)
+    await get_user_cache().ainvalidate(*verified)
+    return results
+
+async def update_user_details(userid: str):
+    try:
+        user_id = verification.normalize_user_id(userid)
+        outcome = (await verify_ids([user_id], "verify_user"))[user_id]
+        if outcome == verification.VERIFIED:
+            logger.info("User %s verified successfully", userid)
+        return verification.single(userid, outcome)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        logger.error("Error updating user details: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def verify_many_users(user_ids):
+    """PUT /users/verify: every id verified in set-based statements, one outcome per id"""
+    try:
+        results = await verify_ids(verification.validate_ids(user_ids))
+        response = verification.summary(user_ids, results)
+        logger.info("Bulk verification of %s users: %s verified, %s already verified, %s not found", len(results),
+                    response["verified"], response["already_verified"], response["not_found"])
+        return response
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        logger.error("Error verifying users: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,276 @@
+"""
+Batch signup - helpers shared by the sync and async POST /signup/batch
+
+Concept: Chunks
+- A batch is handled CHUNK items at a time (SIGNUP_BATCH_CHUNK, default 1000):
+  one duplicate-check query and one pipelined publish per chunk
+- NDJSON input (one user per line) is read and processed chunk by chunk, so
+  a large import never has to be in memory all at once
+
+Concept: Per-item results
+- Every item gets {"index": n, "status": ...} in input order:
+  created (with its user_id), conflict (already registered, or twice in
+  this batch), invalid (not a valid UserRequest) or error (publish failed)
+- Chunks are published while an NDJSON body is still coming in, so a failure
+  after the first chunk can't fail the request any more: the users already
+  created would lose their user_ids and be sent again. The chunk that failed
+  gets an error per item, and a body that can't be read any further (more
+  than MAX_ITEMS) ends the batch with status PARTIAL and the reason in
+  "message": every item with a result was handled, the ones after it were not
+
+Concept: Phases
+- A chunk goes through the same phases as one /signup: claim the emails,
+  one duplicate-check query, hash the passwords, one pipelined publish
+- Each phase below takes what the view's I/O returned, records the results of
+  the items that drop out and hands back the claims to release
+"""
+from app.schema import UserRequest
+from app.helpers.helper import normalize_email
+from app.resources import DependencyUnavailable
+from app.views import signup
+from app.password_hasher import HasherBusy
+from fastapi import HTTPException
+from pydantic import ValidationError
+from dotenv import load_dotenv
+import logging
+import json
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+CHUNK_SIZE = int(os.getenv("SIGNUP_BATCH_CHUNK", "1000"))
+MAX_ITEMS = int(os.getenv("SIGNUP_BATCH_MAX_ITEMS", "100000"))
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonlines")
+
+
+def is_ndjson(content_type):
+    return (content_type or "").split(";")[0].strip().lower() in NDJSON_TYPES
+
+
+def created(index, user_id):
+    return {"index": index, "status": "created", "user_id": user_id, "verification": "PENDING"}
+
+
+def conflict(index, user_id, verification, message="User already exists"):
+    return {"index": index, "status": "conflict", "message": message, "user_id": user_id, "verification": verification}
+
+
+def invalid(index, message):
+    return {"index": index, "status": "invalid", "message": message}
+
+
+def error(index, message):
+    return {"index": index, "status": "error", "message": message}
+
+
+def validate_chunk(items, seen_emails):
+    """
+    items: [(index, raw)] where raw is a dict (or anything that failed to parse).
+    Returns (accepted [(index, data)], results for the rejected ones).
+    seen_emails (email -> index) spans the whole batch, so a repeat in a later chunk is a conflict too
+    """
+    accepted, results = [], []
+    for index, raw in items:
+        if not isinstance(raw, dict):
+            results.append(invalid(index, raw if isinstance(raw, str) else "Expected a JSON object"))
+            continue
+        try:
+            data = UserRequest(**raw).dict()
+        except ValidationError as e:
+            results.append(invalid(index, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())))
+            continue
+        email = normalize_email(data["email"])
+        if email in seen_emails:
+            results.append(conflict(index, None, None, f"Duplicate of item {seen_emails[email]} in this batch"))
+            continue
+        seen_emails[email] = index
+        accepted.append((index, data))
+    return accepted, results
+
+
+def claims(accepted):
+    """[(index, data)] -> [(index, data, user_id)], a new user_id to claim each email with"""
+    return [(index, data, str(uuid.uuid4())) for index, data in accepted]
+
+
+def reserved(claimed, pending_user_ids, results):
+    """The claims that got their email; an email still in the queue is a conflict"""
+    kept = []
+    for (index, data, user_id), pending_user_id in zip(claimed, pending_user_ids):
+        if pending_user_id:
+            results.append(conflict(index, pending_user_id, "PENDING"))
+        else:
+            kept.append((index, data, user_id))
+    return kept
+
+
+def releases(claimed):
+    """[(index, data, user_id)] -> [(email, user_id)] for PendingSignups.release_many"""
+    return [(data["email"], user_id) for index, data, user_id in claimed]
+
+
+def lookup_failed(claimed, e, results):
+    """
+    The duplicate check failed (the claims are released already): the database
+    being down fails the request fast (503) like /signup, anything else is an error per item
+    """
+    if isinstance(e, DependencyUnavailable):
+        raise e
+    logger.error("Error checking if users exist: %s", e)
+    results.extend(error(index, str(e)) for index, _, _ in claimed)
+
+
+def new_users(claimed, existing, results):
+    """
+    Split the claims on the duplicate check (email -> (user_id, verification)).
+    Returns (to_publish [(index, data, user_id)], the registered ones to release)
+    """
+    to_publish, to_release = [], []
+    for index, data, user_id in claimed:
+        found = existing.get(normalize_email(data["email"]))
+        if found:
+            to_release.append((index, data, user_id))
+            results.append(conflict(index, found[0], found[1]))
+        else:
+            to_publish.append((index, signup.pending_user(data, user_id), user_id))
+    return to_publish, to_release
+
+
+def passwords(to_publish):
+    """The passwords to hash; only the hashes are published"""
+    return [data.pop("password") for _, data, _ in to_publish]
+
+
+def hashed(to_publish, hashes, results):
+    """Returns (to_publish with their password_hash, the ones whose hash failed, to release)"""
+    kept, to_release = [], []
+    for (index, data, user_id), password_hash in zip(to_publish, hashes):
+        if isinstance(password_hash, Exception):
+            to_release.append((index, data, user_id))
+            results.append(error(index, password_hash.detail["message"] if isinstance(password_hash, HasherBusy) else f"Hashing failed: {password_hash}"))
+        else:
+            data["password_hash"] = password_hash
+            kept.append((index, data, user_id))
+    return kept, to_release
+
+
+def published(to_publish, errors, results):
+    """Returns (the published emails, the ones RabbitMQ didn't take, to release)"""
+    emails, to_release = [], []
+    for (index, data, user_id), publish_error in zip(to_publish, errors):
+        if publish_error is None:
+            emails.append(data["email"])
+            results.append(created(index, user_id))
+        else:
+            to_release.append((index, data, user_id))
+            results.append(error(index, f"Publish failed: {publish_error}"))
+    logger.info("Batch signup chunk: %s published, %s failed", len(emails), len(to_release))
+    return emails, to_release
+
+
+async def signup_all(request, onboard_chunk):
+    """
+    POST /signup/batch: every chunk of the body through onboard_chunk (the
+    sync or async view's onboard_users, awaitable), then the summary
+    """
+    seen_emails, results, stopped = {}, [], None
+    try:
+        async for chunk in request_chunks(request):
+            try:
+                results += await onboard_chunk(chunk, seen_emails)
+            except Exception as e:
+                if not results:
+                    # Nothing handled yet: the request fails as a whole (503, 429...)
+                    raise
+                logger.error("Batch signup chunk failed: %s", e)
+                results += [error(index, message(e)) for index, _ in chunk]
+    except HTTPException as e:
+        if not results:
+            raise
+        stopped = e
+    return summary(results, stopped)
+
+
+def message(e):
+    """The message of an exception, as a per-item result shows it"""
+    if isinstance(e, HTTPException):
+        return e.detail.get("message", str(e.detail)) if isinstance(e.detail, dict) else str(e.detail)
+    return str(e)
+
+
+async def request_chunks(request):
+    """The body of POST /signup/batch -> chunks of [(index, raw)], a JSON array or NDJSON read as it streams in"""
+    if is_ndjson(request.headers.get("content-type")):
+        async for chunk in parse_ndjson(request.stream()):
+            yield chunk
+    else:
+        for chunk in parse_json_list(await request.body()):
+            yield chunk
+
+
+def parse_json_list(body: bytes):
+    """A JSON array body -> chunks of [(index, raw)]"""
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of users")
+    if len(items) > MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_ITEMS} users per batch")
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield list(enumerate(items[start:start + CHUNK_SIZE], start))
+
+
+async def parse_ndjson(stream):
+    """
+    An NDJSON request stream -> chunks of [(index, raw)], read as it arrives.
+    Past MAX_ITEMS the items read so far are still yielded before the 413
+    """
+    chunk, index, buffer = [], 0, b""
+    too_many = HTTPException(status_code=413, detail=f"At most {MAX_ITEMS} users per batch")
+
+    def parse(line):
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            return f"Invalid JSON: {e}"
+
+    async for data in stream:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            if index >= MAX_ITEMS:
+                if chunk:
+                    yield chunk
+                raise too_many
+            chunk.append((index, parse(line)))
+            index += 1
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+    if buffer.strip():
+        if index >= MAX_ITEMS:
+            if chunk:
+                yield chunk
+            raise too_many
+        chunk.append((index, parse(buffer)))
+    if chunk:
+        yield chunk
+
+
+def summary(results, stopped=None):
+    """The response body; stopped: the HTTPException that ended the body early, if one did"""
+    results.sort(key=lambda result: result["index"])
+    counts = {"created": 0, "conflict": 0, "invalid": 0, "error": 0}
+    for result in results:
+        counts[result["status"]] += 1
+    if stopped is not None:
+        return {"status": "PARTIAL", "message": message(stopped), **counts, "results": results}
+    return {"status": "SUCCESS", **counts, "results": results}
@@ -0,0 +1,96 @@
+"""
+User listing - helpers shared by the sync and async GET /users, GET /users/export
+and GET /users/{user_id}
+
+Concept: Keyset pagination
+- Pages are ordered by (created_on, id) and the next page starts right after
+  the last row of this one: WHERE (created_on, id) > (:created_on, :id)
+- Unlike OFFSET, the database never reads and throws away the rows of the
+  earlier pages: page 10000 costs the same as page 1 (an index range scan on
+  users_created_on_id_idx), and rows inserted meanwhile don't shift the pages
+- The position is handed out as an opaque `next_cursor`; there is no next
+  page when it is null
+
+Concept: Streaming export
+- GET /users/export writes one JSON object per line (NDJSON) while the rows
+  come in: a server-side cursor (stream_results) fetches EXPORT_CHUNK_ROWS
+  rows at a time, each chunk is encoded and sent before the next is fetched
+- Memory stays the same whether the export has a thousand rows or millions
+
+Settings: USERS_PAGE_SIZE (default 100), USERS_PAGE_MAX (default 1000),
+EXPORT_CHUNK_ROWS (default 1000)
+"""
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from datetime import datetime
+import base64
+import json
+import os
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "100"))
+PAGE_MAX = int(os.getenv("USERS_PAGE_MAX", "1000"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+VERIFICATION_STATES = ("PENDING", "VERIFIED")
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def encode_cursor(created_on: datetime, id: int):
+    raw = json.dumps([created_on.isoformat(), id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """next_cursor of a previous page -> (created_on, id), 400 if it isn't one"""
+    if not cursor:
+        return None
+    try:
+        created_on, id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_on), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail={"status": "FAILURE", "message": "Invalid cursor"})
+
+
+def filters(verification_state=None, created_from=None, created_to=None):
+    """Validated query filters, as keyword arguments for queries.select_users_page"""
+    if verification_state is not None:
+        verification_state = verification_state.upper()
+        if verification_state not in VERIFICATION_STATES:
+            raise HTTPException(status_code=400, detail={"status": "FAILURE",
+                                                         "message": f"verification_state must be one of {', '.join(VERIFICATION_STATES)}"})
+    if created_from and created_to and created_from >= created_to:
+        raise HTTPException(status_code=400, detail={"status": "FAILURE", "message": "created_from must be before created_to"})
+    return {"verification_state": verification_state, "created_from": created_from, "created_to": created_to}
+
+
+def user_row(row):
+    return {"user_id": row.user_id, "email": row.email, "first_name": row.first_name, "last_name": row.last_name,
+            "verification_state": row.verification_state, "created_on": row.created_on}
+
+
+def details(row):
+    """The GET /users/{user_id} response for a select_user_by_user_id row"""
+    return {"status": "SUCCESS", "message": "User details fetched successfully", **user_row(row)}
+
+
+def user_not_found():
+    return HTTPException(status_code=404, detail={"status": "FAILURE", "message": "User not found", "user_id": None, "email": None,
+                                                  "first_name": None, "last_name": None, "verification_state": None, "created_on": None})
+
+
+def page(rows, limit):
+    """rows: up to limit + 1 rows of select_users_page -> the response body"""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"status": "SUCCESS",
+            "users": [user_row(row) for row in rows],
+            "next_cursor": encode_cursor(rows[-1].created_on, rows[-1].id) if more else None}
+
+
+def ndjson_lines(rows):
+    """One chunk of the export: the rows as NDJSON bytes"""
+    return "".join(json.dumps(user_row(row), separators=(",", ":"), default=datetime.isoformat) + "\n"
+                   for row in rows).encode()
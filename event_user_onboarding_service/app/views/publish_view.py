@@ -1,27 +1,54 @@
-from app.helpers.helper import get_rmq_instance, get_db_instance
+from app.helpers.helper import get_user_cache, get_email_filter, get_pending_signups, get_rmq_pool, get_publisher, publisher_confirms_enabled, get_db_instance, get_spool, get_password_hasher
+from app.views.queries import select_user_by_email, select_users_by_emails, select_user_by_user_id, select_users_page, verify_users, select_verification_states, verify_pending_users
+from app.views import batch, listing, signup, verification
+from app.resources import DependencyUnavailable
+from app.metrics import DB_QUERY_SECONDS, PUBLISH_SECONDS
+from app.spool import LATENCY_BUDGET
+from concurrent.futures import wait
 from fastapi import HTTPException
-from sqlalchemy.sql import func
-from sqlalchemy import update
 import logging
 import uuid
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def send_to_rmq(data: dict, timeout=None):
+    if publisher_confirms_enabled():
+        # Returns once the broker has ACKed the message, raises on NACK
+        # (other requests' publishes are pipelined on the same channel meanwhile)
+        with PUBLISH_SECONDS.labels("confirm").time():
+            get_publisher().publish_and_wait('user_onboarding_queue', data, timeout=timeout)
+    else:
+        # Each request thread checks out its own connection from the pool
+        # (will auto-reconnect if connection is lost)
+        with PUBLISH_SECONDS.labels("pool").time():
+            get_rmq_pool().publish('user_onboarding_queue', data)
+
 def publish_to_rmq(data: dict):
     try:
         #PUBLISH TO RMQ
-        rmq = get_rmq_instance()
-        
-        if not rmq.channel or rmq.channel.is_closed:
-            rmq.connect()
-        
-        # Publish message (will auto-reconnect if connection is lost)
-        rmq.publish_message('user_onboarding_queue', data)
-        logger.info(f"Message published to RMQ: {data}")
+        signup.stamp([data])
+        spool = get_spool()
+        if signup.backlogged(spool):
+            # Older signups are still waiting in the spool: queue up behind them
+            spool.append(data, "backlog")
+            logger.info("User %s spooled behind %s others", data["user_id"], spool.depth - 1, extra={"user_id": data["user_id"]})
+            return
+        try:
+            send_to_rmq(data, timeout=LATENCY_BUDGET if spool is not None else None)
+        except Exception as e:
+            if spool is None:
+                raise
+            # Broker down, reconnecting or over the latency budget: keep it on disk for the forwarder.
+            # A publish that timed out may still be confirmed, the consumer skips the duplicate
+            spool.append(data, signup.spool_reason(e))
+            logger.warning("User %s spooled, RabbitMQ publish failed: %s", data["user_id"], e, extra={"user_id": data["user_id"]})
+            return
+        logger.info("User %s published to RMQ", data["user_id"], extra={"user_id": data["user_id"]})
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error publishing to RMQ: {e}")
+        logger.error("Error publishing to RMQ: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 def user_exists(user_id: str):
@@ -29,70 +56,265 @@ def user_exists(user_id: str):
         # Use global db instance from main, or create new one if not available
         database = get_db_instance()
         user = database.get_table_class("users")
-        with database.get_db() as sess:
-            q = sess.query(user).filter(func.lower(user.email) == user_id.lower()).first()
-            if q:
-                return {"status": True, "user_id": q.user_id, "verification": q.verification_state}
-            else:
-                return {"status": False, "user_id": None, "verification": None}
+        with database.get_db(pin_primary=True) as sess, DB_QUERY_SECONDS.labels("user_exists").time():
+            return signup.registered(sess.execute(select_user_by_email(user, user_id)).scalars().first())
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error checking if user exists: {e}")
+        logger.error("Error checking if user exists: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 def onboard_user(data: dict):
     try:
-        user_data = user_exists(data["email"])
-        if user_data["status"]:
-            raise HTTPException(status_code=409, detail={"status": "SUCCESS", "message": "User already exists", "user_id": user_data["user_id"] , "verification": user_data["verification"]})
-        
+        # Claim the email first: an O(1) answer for a signup that is still in the queue
         user_id = str(uuid.uuid4())
-        data["user_id"] = user_id
-        data["verification"] = "PENDING"
-        #PUBLISH TO RMQ
-        publish_to_rmq(data)
-        return {"status": "SUCCESS", "message": "User onboarded successfully", "user_id": user_id , "verification": "PENDING"}
+        pending = get_pending_signups()
+        pending_user_id = pending.reserve(data["email"], user_id)
+        if pending_user_id:
+            raise signup.already_exists(pending_user_id, "PENDING")
+
+        try:
+            email_filter = get_email_filter()
+            if email_filter is None or email_filter.might_contain(data["email"]):
+                user_data = user_exists(data["email"])
+            else:
+                # Definitely a new email - no need to ask the database
+                user_data = signup.registered(None)
+            if user_data["status"]:
+                raise signup.already_exists(user_data["user_id"], user_data["verification"])
+
+            signup.pending_user(data, user_id)
+            # Hashed on the process pool (429 when it is saturated), only the hash is published
+            data["password_hash"] = get_password_hasher().hash(data.pop("password"))
+            #PUBLISH TO RMQ
+            publish_to_rmq(data)
+        except Exception:
+            # Not published (duplicate or error) - free the email again
+            pending.release(data["email"], user_id)
+            raise
+
+        if email_filter is not None:
+            email_filter.add(data["email"])
+        return signup.created(user_id)
 
     except HTTPException as e:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_user_details(userid: str):
+def existing_users(emails):
+    """email -> (user_id, verification) for the emails that are already registered, in one query"""
+    if not emails:
+        return {}
+    database = get_db_instance()
+    user = database.get_table_class("users")
+    with database.get_db(pin_primary=True) as sess, DB_QUERY_SECONDS.labels("users_exist_batch").time():
+        rows = sess.execute(select_users_by_emails(user, emails)).all()
+    return signup.registered_many(rows)
+
+def send_many_to_rmq(messages):
+    """Pipelined publish of a whole chunk, returns one error (or None) per message"""
+    if publisher_confirms_enabled():
+        publisher = get_publisher()
+        with PUBLISH_SECONDS.labels("confirm_batch").time():
+            futures, errors = [], [None] * len(messages)
+            for i, data in enumerate(messages):
+                try:
+                    futures.append((i, publisher.publish('user_onboarding_queue', data)))
+                except Exception as e:
+                    errors[i] = e
+            # One wait for all confirms instead of one round trip per message
+            wait([future for _, future in futures], timeout=publisher.confirm_timeout)
+            for i, future in futures:
+                if not future.done():
+                    errors[i] = TimeoutError("Publish not confirmed in time")
+                elif future.exception():
+                    errors[i] = future.exception()
+        return errors
+    with PUBLISH_SECONDS.labels("pool_batch").time():
+        return get_rmq_pool().publish_many('user_onboarding_queue', messages)
+
+def publish_many_to_rmq(messages):
+    """send_many_to_rmq, with the messages RabbitMQ didn't take written to the spool (if there is one)"""
+    signup.stamp(messages)
+    spool = get_spool()
+    if signup.backlogged(spool):
+        spool.append_many(messages, "backlog")
+        return [None] * len(messages)
+    try:
+        errors = send_many_to_rmq(messages)
+    except Exception as e:
+        if spool is None:
+            raise
+        errors = [e] * len(messages)
+    failed = signup.unsent(messages, errors)
+    if spool is None or not failed:
+        return errors
+    try:
+        spool.append_many(failed, "unavailable")
+    except Exception as e:
+        logger.error("Spooling %s users failed: %s", len(failed), e)
+        return errors
+    logger.warning("%s users spooled, RabbitMQ publish failed: %s", len(failed), next(e for e in errors if e is not None))
+    return [None] * len(messages)
+
+def onboard_users(items, seen_emails):
+    """
+    Batch version of onboard_user for one chunk of POST /signup/batch.
+    items: [(index, raw)], returns one result per item (see views.batch)
+    """
+    accepted, results = batch.validate_chunk(items, seen_emails)
+    pending = get_pending_signups()
+    email_filter = get_email_filter()
+
+    # Claim every email first, exactly like /signup
+    claimed = batch.claims(accepted)
+    claimed = batch.reserved(claimed, [pending.reserve(data["email"], user_id) for _, data, user_id in claimed], results)
+
+    # One query for every email the Bloom filter can't rule out
+    try:
+        emails = [data["email"] for _, data, _ in claimed]
+        existing = existing_users(emails if email_filter is None else email_filter.maybe_known(emails))
+    except Exception as e:
+        pending.release_many(batch.releases(claimed))
+        batch.lookup_failed(claimed, e, results)
+        return results
+    to_publish, duplicates = batch.new_users(claimed, existing, results)
+    pending.release_many(batch.releases(duplicates))
+
+    # Hash the whole chunk on the process pool; only the hashes are published
+    hashes = get_password_hasher().hash_many(batch.passwords(to_publish))
+    to_publish, failed = batch.hashed(to_publish, hashes, results)
+    pending.release_many(batch.releases(failed))
+
+    try:
+        errors = publish_many_to_rmq([data for _, data, _ in to_publish]) if to_publish else []
+    except DependencyUnavailable:
+        pending.release_many(batch.releases(to_publish))
+        raise
+    except Exception as e:
+        errors = [e] * len(to_publish)
+    emails, failed = batch.published(to_publish, errors, results)
+    pending.release_many(batch.releases(failed))
+    if email_filter is not None:
+        for email in emails:
+            email_filter.add(email)
+    return results
+
+def list_users(cursor=None, limit=None, **query):
+    """One page of GET /users (keyset pagination, see app/views/listing.py)"""
     try:
+        limit = limit or listing.PAGE_SIZE
         database = get_db_instance()
         user = database.get_table_class("users")
-        with database.get_db() as sess:
-            q = sess.query(user).filter(func.lower(user.user_id) == userid.lower()).first()
-            if q:
-                return {"status": "SUCCESS", "message": "User details fetched successfully", "user_id": q.user_id, "email": q.email, "first_name": q.first_name, "last_name": q.last_name, "verification_state": q.verification_state, "created_on": q.created_on}
-            else:
-                raise HTTPException(status_code=404, detail={"status": "FAILURE", "message": "User not found", "user_id": None, "email": None, "first_name": None, "last_name": None, "verification_state": None, "created_on": None})
+        stmt = select_users_page(user, listing.decode_cursor(cursor), **listing.filters(**query)).limit(limit + 1)
+        with database.get_db() as sess, DB_QUERY_SECONDS.labels("list_users").time():
+            rows = sess.execute(stmt).all()
+        return listing.page(rows, limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error listing users: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def export_users(**query):
+    """
+    GET /users/export: checks the filters and the database right away (so errors
+    are still proper responses), returns a generator of NDJSON chunks
+    """
+    try:
+        database = get_db_instance()
+        user = database.get_table_class("users")
+        stmt = select_users_page(user, **listing.filters(**query))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error exporting users: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    def chunks():
+        exported = 0
+        with database.get_stream_db() as sess:
+            # Server-side cursor: EXPORT_CHUNK_ROWS rows in memory at a time
+            result = sess.execute(stmt, execution_options={"stream_results": True, "max_row_buffer": listing.EXPORT_CHUNK_ROWS})
+            for rows in result.partitions(listing.EXPORT_CHUNK_ROWS):
+                exported += len(rows)
+                yield listing.ndjson_lines(rows)
+        logger.info("Exported %s users", exported)
+    return chunks()
+
+def load_user_details(userid: str):
+    """Fetch the user's details from the database, None if there is no such user"""
+    database = get_db_instance()
+    user = database.get_table_class("users")
+    with database.get_db(pin_primary=database.wrote_recently(verification.normalize_user_id(userid))) as sess, DB_QUERY_SECONDS.labels("get_user").time():
+        q = sess.execute(select_user_by_user_id(user, userid)).scalars().first()
+        return listing.details(q) if q else None
+
+def get_user_details(userid: str):
+    try:
+        # Read-through cache in front of the database
+        user_details = get_user_cache().get_or_load(userid, lambda: load_user_details(userid))
+        if user_details:
+            return dict(user_details)
+        else:
+            raise listing.user_not_found()
 
     except HTTPException as e:
         raise
             
     except Exception as e:
-        logger.error(f"Error getting user details: {e}")
+        logger.error("Error getting user details: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+def verify_ids(user_ids, metric="verify_users"):
+    """
+    Verify normalized user_ids with one conditional UPDATE per chunk,
+    returns {user_id: outcome}. Verified users are dropped from the cache
+    and read from the primary for a while
+    """
+    database = get_db_instance()
+    user = database.get_table_class("users")
+    results = {}
+    with database.get_db(pin_primary=True) as sess, DB_QUERY_SECONDS.labels(metric).time():
+        for chunk in verification.chunks(user_ids):
+            if verification.is_postgres(database):
+                rows = sess.execute(verify_users(user, chunk)).all()
+            else:
+                rows = verification.pending(sess.execute(select_verification_states(user, chunk)).all())
+                to_verify = [user_id for user_id, verified_now in rows if verified_now]
+                if to_verify:
+                    sess.execute(verify_pending_users(user, to_verify))
+            sess.commit()
+            results.update(verification.outcomes(chunk, rows))
+    verified = verification.verified(results)
+    database.note_writes(verified)
+    get_user_cache().invalidate(*verified)
+    return results
+
 def update_user_details(userid: str):
     try:
-        database = get_db_instance()
-        user = database.get_table_class("users")
-        with database.get_db() as sess:
-            q = sess.query(user).filter(func.lower(user.user_id) == userid.lower()).first()
-            if q:
-                if q.verification_state == "VERIFIED":
-                    return {"status": "SUCCESS", "message": "User already verified", "user_id": userid}
-                upd = update(user).values({"verification_state": "VERIFIED"}).where(user.id == q.id)
-                sess.execute(upd)
-                sess.commit()
-                logger.info(f"User {userid} verified successfully")
-                return {"status": "SUCCESS", "message": "User verified successfully", "user_id": userid}
-            else:
-                raise HTTPException(status_code=404, detail={"status": "FAILURE", "message": "User not found", "user_id": userid})
+        user_id = verification.normalize_user_id(userid)
+        outcome = verify_ids([user_id], "verify_user")[user_id]
+        if outcome == verification.VERIFIED:
+            logger.info("User %s verified successfully", userid)
+        return verification.single(userid, outcome)
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        logger.error("Error updating user details: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def verify_many_users(user_ids):
+    """PUT /users/verify: every id verified in set-based statements, one outcome per id"""
+    try:
+        results = verify_ids(verification.validate_ids(user_ids))
+        response = verification.summary(user_ids, results)
+        logger.info("Bulk verification of %s users: %s verified, %s already verified, %s not found", len(results),
+                    response["verified"], response["already_verified"], response["not_found"])
+        return response
     except HTTPException as e:
         raise
     except Exception as e:
-        logger.error(f"Error updating user details: {e}")
+        logger.error("Error verifying users: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
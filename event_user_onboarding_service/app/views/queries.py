@@ -0,0 +1,59 @@
+"""
+SQL statements shared by the sync (publish_view) and async (async_publish_view) service layers
+"""
+from sqlalchemy.sql import func
+from sqlalchemy import select, update, tuple_
+from app.helpers.helper import normalize_email
+
+
+def select_user_by_email(user, email: str):
+    # lower(email) matches the users_email_lower_uidx expression index
+    return select(user).where(func.lower(user.email) == normalize_email(email)).limit(1)
+
+
+def select_users_by_emails(user, emails):
+    # One round trip for a whole batch, each lower(email) = ... is an index probe
+    return select(user.email, user.user_id, user.verification_state).where(
+        func.lower(user.email).in_([normalize_email(email) for email in emails]))
+
+
+def select_user_by_user_id(user, user_id: str):
+    # user_ids are stored lowercase (uuid4), an exact match can use users_user_id_uidx
+    return select(user).where(user.user_id == user_id.strip().lower()).limit(1)
+
+
+def select_users_page(user, after=None, verification_state=None, created_from=None, created_to=None):
+    # Keyset pagination: ordered by (created_on, id), a range scan on users_created_on_id_idx
+    # (users_state_created_on_id_idx with a verification_state filter)
+    stmt = select(user.id, user.user_id, user.email, user.first_name, user.last_name,
+                  user.verification_state, user.created_on)
+    if verification_state:
+        stmt = stmt.where(user.verification_state == verification_state)
+    if created_from:
+        stmt = stmt.where(user.created_on >= created_from)
+    if created_to:
+        stmt = stmt.where(user.created_on < created_to)
+    if after:
+        stmt = stmt.where(tuple_(user.created_on, user.id) > tuple_(*after))
+    return stmt.order_by(user.created_on, user.id)
+
+
+def verify_users(user, user_ids):
+    # Postgres, one statement: the CTE verifies the ids that aren't VERIFIED yet (the
+    # condition is re-checked on the locked row, so of two concurrent verifications
+    # only one gets the row back); the outer SELECT sees the rows as they were before
+    # the statement. Row missing: not found, verified_now false: already verified
+    verified = (update(user).where(user.user_id.in_(user_ids), user.verification_state != "VERIFIED")
+                .values({"verification_state": "VERIFIED"}).returning(user.user_id).cte("verified"))
+    return select(user.user_id, user.user_id.in_(select(verified.c.user_id)).label("verified_now")).where(
+        user.user_id.in_(user_ids))
+
+
+def select_verification_states(user, user_ids):
+    # Other databases: read the states first, then verify_pending_users
+    return select(user.user_id, user.verification_state).where(user.user_id.in_(user_ids))
+
+
+def verify_pending_users(user, user_ids):
+    return (update(user).where(user.user_id.in_(user_ids), user.verification_state != "VERIFIED")
+            .values({"verification_state": "VERIFIED"}).execution_options(synchronize_session=False))
@@ -0,0 +1,70 @@
+"""
+Signup - helpers shared by the sync and async POST /signup and POST /signup/batch
+
+Concept: One flow, two kinds of I/O
+- publish_view and async_publish_view take the same steps: claim the email,
+  check for a duplicate, hash the password, publish (or spool)
+- The decisions and the responses live here; the views only differ in how
+  they call the database, RabbitMQ, the spool and the password pool
+
+Concept: Publish or spool
+- With a spool, a signup is spooled behind the ones already waiting there
+  (backlog), or when RabbitMQ didn't take it within LATENCY_BUDGET (slow) or
+  at all (unavailable); the forwarder publishes it later
+- Without one, a failed publish fails the request
+"""
+from app.helpers.helper import normalize_email
+from concurrent.futures import TimeoutError as FutureTimeout
+from fastapi import HTTPException
+import asyncio
+import time
+
+
+def registered(row):
+    """user_exists' answer for a select_user_by_email row (None: the email is free)"""
+    if row:
+        return {"status": True, "user_id": row.user_id, "verification": row.verification_state}
+    return {"status": False, "user_id": None, "verification": None}
+
+
+def registered_many(rows):
+    """select_users_by_emails rows -> email -> (user_id, verification)"""
+    return {normalize_email(row.email): (row.user_id, row.verification_state) for row in rows}
+
+
+def already_exists(user_id, verification):
+    """The 409 for an email that is registered, or still waiting in the queue (PENDING)"""
+    return HTTPException(status_code=409, detail={"status": "SUCCESS", "message": "User already exists", "user_id": user_id , "verification": verification})
+
+
+def pending_user(data: dict, user_id: str):
+    """The signup as it is published, before its password is hashed"""
+    data["user_id"] = user_id
+    data["verification"] = "PENDING"
+    return data
+
+
+def created(user_id):
+    return {"status": "SUCCESS", "message": "User onboarded successfully", "user_id": user_id , "verification": "PENDING"}
+
+
+def stamp(messages):
+    # published_at lets the consumer measure signup -> persisted lag
+    for data in messages:
+        data["published_at"] = time.time()
+    return messages
+
+
+def backlogged(spool):
+    """Older signups are still waiting in the spool: new ones queue up behind them"""
+    return spool is not None and spool.depth > 0
+
+
+def spool_reason(error):
+    """Why a publish that failed is spooled: over the latency budget, or RabbitMQ unavailable"""
+    return "slow" if isinstance(error, (TimeoutError, FutureTimeout, asyncio.TimeoutError)) else "unavailable"
+
+
+def unsent(messages, errors):
+    """The messages of a pipelined publish that RabbitMQ didn't take"""
+    return [data for data, error in zip(messages, errors) if error is not None]
@@ -0,0 +1,90 @@
+"""
+Verification - helpers shared by the sync and async PUT /users/{user_id} and PUT /users/verify
+
+Concept: One conditional UPDATE
+- On Postgres a verification is a single statement (queries.verify_users):
+  UPDATE ... WHERE verification_state <> 'VERIFIED' RETURNING, wrapped in a
+  SELECT of the same ids. One round trip tells each id apart:
+  verified (by this request), already_verified or not_found
+- The state is checked by the UPDATE itself on the locked row, not read
+  first and written later: two concurrent verifications of a user can't
+  both report "verified now"
+- Other databases (the SQLite stand-in) read the states, then run the same
+  conditional UPDATE in that transaction
+
+Concept: Bulk verification
+- PUT /users/verify takes {"user_ids": [...]} and verifies them all in one
+  set-based statement per VERIFY_CHUNK ids (default 1000), so a burst of
+  email-link verifications uses one connection for one statement instead
+  of a select and an update per user
+- Every id gets {"user_id": ..., "outcome": ...} in input order;
+  VERIFY_MAX_IDS (default 10000) caps a request
+"""
+from fastapi import HTTPException
+from dotenv import load_dotenv
+import os
+
+load_dotenv(dotenv_path="app/configs/.env")
+
+CHUNK_SIZE = int(os.getenv("VERIFY_CHUNK", "1000"))
+MAX_IDS = int(os.getenv("VERIFY_MAX_IDS", "10000"))
+
+VERIFIED, ALREADY_VERIFIED, NOT_FOUND = "verified", "already_verified", "not_found"
+
+
+def normalize_user_id(user_id: str):
+    # user_ids are stored lowercase (uuid4)
+    return user_id.strip().lower()
+
+
+def validate_ids(user_ids):
+    """The request's user_ids, normalized and without repeats (first occurrence kept)"""
+    if not user_ids:
+        raise HTTPException(status_code=400, detail={"status": "FAILURE", "message": "user_ids must not be empty"})
+    if len(user_ids) > MAX_IDS:
+        raise HTTPException(status_code=413, detail={"status": "FAILURE",
+                                                     "message": f"At most {MAX_IDS} user_ids per request"})
+    return list(dict.fromkeys(normalize_user_id(user_id) for user_id in user_ids))
+
+
+def chunks(user_ids):
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        yield user_ids[start:start + CHUNK_SIZE]
+
+
+def is_postgres(database):
+    return database.engine.dialect.name == "postgresql"
+
+
+def pending(rows):
+    """select_verification_states rows -> (user_id, verified_now) like verify_users returns"""
+    return [(row.user_id, row.verification_state != "VERIFIED") for row in rows]
+
+
+def outcomes(user_ids, rows):
+    """(user_id, verified_now) rows -> {user_id: outcome} for every requested id"""
+    found = {user_id: VERIFIED if verified_now else ALREADY_VERIFIED for user_id, verified_now in rows}
+    return {user_id: found.get(user_id, NOT_FOUND) for user_id in user_ids}
+
+
+def verified(results):
+    """The user_ids this request verified: their cache entries go, reads stick to the primary for a while"""
+    return [user_id for user_id, outcome in results.items() if outcome == VERIFIED]
+
+
+def single(userid, outcome):
+    """The PUT /users/{user_id} response for one outcome (404 when not found)"""
+    if outcome == VERIFIED:
+        return {"status": "SUCCESS", "message": "User verified successfully", "user_id": userid}
+    if outcome == ALREADY_VERIFIED:
+        return {"status": "SUCCESS", "message": "User already verified", "user_id": userid}
+    raise HTTPException(status_code=404, detail={"status": "FAILURE", "message": "User not found", "user_id": userid})
+
+
+def summary(user_ids, results):
+    """The PUT /users/verify response: counts per outcome and one result per requested id"""
+    counts = {VERIFIED: 0, ALREADY_VERIFIED: 0, NOT_FOUND: 0}
+    for outcome in results.values():
+        counts[outcome] += 1
+    return {"status": "SUCCESS", **counts,
+            "results": [{"user_id": user_id, "outcome": results[normalize_user_id(user_id)]} for user_id in user_ids]}
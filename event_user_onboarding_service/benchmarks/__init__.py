@@ -0,0 +1,5 @@
+"""
+Benchmarks - measure the service without a live RabbitMQ or Postgres
+
+Run them with: python -m benchmarks.run --help
+"""
@@ -0,0 +1,81 @@
+"""
+Message codec micro-benchmark: JSON vs the binary format, with and without zlib
+
+What it runs
+1. json          - what was always published (compact separators)
+2. binary        - the struct layout of app/message_codec.py
+3. json_zlib /   - the same, compressed whatever the size (threshold 0 would
+   binary_zlib     turn compression off, so these force it with threshold 1)
+
+For each codec it encodes and decodes --count realistic signup messages
+(uuid4 user_id, scrypt password_hash, published_at) and prints ns per
+message for encode and decode, and bytes per message on the wire.
+
+Run it with:
+    python -m benchmarks.codec --count 100000
+"""
+import argparse
+import logging
+import time
+import uuid
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Message codec encode/decode cost and size")
+    parser.add_argument("--count", type=int, default=100000, help="messages per codec")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per codec, the fastest is reported")
+    return parser.parse_args()
+
+
+def sample_messages(count):
+    # One real hash reused: only its length matters here, and hashing is slow
+    from app.helpers.passwords import hash_password
+    password_hash = hash_password("benchmark-password", n=1024)
+    now = time.time()
+    return [{"email": f"user-{i}@example.com", "first_name": "Firstname", "last_name": f"Lastname{i}",
+             "password_hash": password_hash, "user_id": str(uuid.uuid4()), "verification": "PENDING",
+             "published_at": now + i} for i in range(count)]
+
+
+def measure(codec, messages, rounds):
+    from app.message_codec import decode
+    encode_ns = decode_ns = None
+    for _ in range(rounds):
+        started = time.perf_counter_ns()
+        encoded = [codec.encode(message) for message in messages]
+        elapsed = time.perf_counter_ns() - started
+        encode_ns = elapsed if encode_ns is None else min(encode_ns, elapsed)
+
+        started = time.perf_counter_ns()
+        for body, content_type, content_encoding in encoded:
+            decode(body, content_type, content_encoding)
+        elapsed = time.perf_counter_ns() - started
+        decode_ns = elapsed if decode_ns is None else min(decode_ns, elapsed)
+
+    count = len(messages)
+    return {"encode_ns": round(encode_ns / count), "decode_ns": round(decode_ns / count),
+            "bytes": round(sum(len(body) for body, _, _ in encoded) / count, 1)}
+
+
+def main(args):
+    from app.message_codec import MessageCodec
+
+    messages = sample_messages(args.count)
+    codecs = {
+        "json": MessageCodec("json", compress_threshold=0),
+        "binary": MessageCodec("binary", compress_threshold=0),
+        "json_zlib": MessageCodec("json", compress_threshold=1),
+        "binary_zlib": MessageCodec("binary", compress_threshold=1),
+    }
+    results = {name: measure(codec, messages, args.rounds) for name, codec in codecs.items()}
+
+    print(f"{args.count} messages, best of {args.rounds}")
+    for name, result in results.items():
+        print(f"{name:<14} encode={result['encode_ns']:>6} ns/msg  decode={result['decode_ns']:>6} ns/msg  "
+              f"{result['bytes']:>6} bytes/msg ({result['bytes'] / results['json']['bytes']:.0%} of json)")
+    return results
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    main(parse_args())
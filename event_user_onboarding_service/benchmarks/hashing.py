@@ -0,0 +1,93 @@
+"""
+Password hashing throughput: scrypt inline vs. on the PasswordHasher process pool
+
+What it runs
+1. inline       - hash_password() in this process, one after another (what a
+                  request thread or the consumer would pay per user)
+2. pool_<n>     - the same number of hashes through PasswordHasher with n
+                  workers, for n = 1, 2, 4, ... up to --workers
+
+For every run it prints hashes/s and hashes/s per worker process (per core,
+as long as n <= CPU count), and the time from submitting a hash until it is
+ready (on the pool that includes waiting for a free worker).
+
+Run it with:
+    python -m benchmarks.hashing --count 200
+    python -m benchmarks.hashing --n 32768 --workers 8   # try another cost
+"""
+from concurrent.futures import wait
+import argparse
+import logging
+import time
+import os
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Password hashing throughput")
+    parser.add_argument("--count", type=int, default=200, help="hashes per run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="largest pool to try")
+    parser.add_argument("--n", type=int, default=None, help="scrypt n (default PASSWORD_SCRYPT_N)")
+    parser.add_argument("--r", type=int, default=None, help="scrypt r (default PASSWORD_SCRYPT_R)")
+    parser.add_argument("--p", type=int, default=None, help="scrypt p (default PASSWORD_SCRYPT_P)")
+    return parser.parse_args()
+
+
+def run_inline(count, cost):
+    from app.helpers.passwords import hash_password
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        hash_password(f"password-{i}", **cost)
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - started
+
+
+def run_pool(count, workers, cost):
+    from app.password_hasher import PasswordHasher
+    # Enough slots that submitting never waits: this measures the pool, not the backpressure
+    hasher = PasswordHasher(workers=workers, queue_size=count, **cost).start()
+    latencies, futures = [], []
+    try:
+        started = time.perf_counter()
+        for i in range(count):
+            submitted = time.perf_counter()
+            future = hasher.submit(f"password-{i}")
+            # Submit -> hash ready, including the wait for a free worker
+            future.add_done_callback(lambda _, submitted=submitted: latencies.append(time.perf_counter() - submitted))
+            futures.append(future)
+        wait(futures)
+        return latencies, time.perf_counter() - started
+    finally:
+        hasher.close()
+
+
+def main(args):
+    from app.helpers.passwords import cost_from_env
+    from benchmarks.report import summarize, print_results
+
+    cost = cost_from_env()
+    cost.update({key: value for key, value in (("n", args.n), ("r", args.r), ("p", args.p)) if value})
+    print(f"scrypt n={cost['n']} r={cost['r']} p={cost['p']} "
+          f"({128 * cost['r'] * cost['n'] // (1024 * 1024)} MiB per hash), {os.cpu_count()} CPUs")
+
+    results = {}
+    latencies, elapsed = run_inline(args.count, cost)
+    results["inline"] = summarize(latencies, elapsed, unit="hashes")
+    results["inline"]["hashes_per_s_per_core"] = results["inline"]["hashes_per_s"]
+
+    for workers in sorted({min(2 ** i, args.workers) for i in range(args.workers.bit_length() + 1)}):
+        latencies, elapsed = run_pool(args.count, workers, cost)
+        result = summarize(latencies, elapsed, unit="hashes")
+        result["hashes_per_s_per_core"] = round(result["hashes_per_s"] / min(workers, os.cpu_count() or 1), 1)
+        results[f"pool_{workers}"] = result
+
+    print_results(results)
+    for name, result in results.items():
+        print(f"{name:<28} {result['hashes_per_s_per_core']}/s per core")
+    return results
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    main(parse_args())
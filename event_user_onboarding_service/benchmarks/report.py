@@ -0,0 +1,80 @@
+"""
+Latency summaries and baseline files shared by the benchmarks
+
+Concept: Percentiles
+- p50 is the typical request, p95/p99 are the slow tail users actually notice
+- An average hides the tail, so it is only reported next to them
+
+Concept: Baseline
+- save_baseline() writes the results to a JSON file, compare() prints how a
+  new run differs from it, so local runs can be compared over time
+"""
+from datetime import datetime, timezone
+import platform
+import json
+import os
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, elapsed, errors=0, unit="requests"):
+    """latencies in seconds (one per operation), elapsed = wall time of the whole run"""
+    values = sorted(latencies)
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "count": len(values),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        f"{unit}_per_s": round(len(values) / elapsed, 1) if elapsed else None,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+def print_results(results):
+    for name, result in results.items():
+        rate = next((f"{value}/s {key[:-6]}" for key, value in result.items() if key.endswith("_per_s")), "")
+        print(f"{name:<28} n={result['count']:<7} err={result['errors']:<5} {rate:<24} "
+              f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms")
+
+
+def save_baseline(path, results, config):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "config": config,
+            "results": results,
+        }, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+
+def compare(path, results):
+    """Print the change of every rate and percentile against the baseline in path"""
+    if not os.path.exists(path):
+        print(f"No baseline at {path}, run with --save-baseline first")
+        return
+    with open(path) as f:
+        baseline = json.load(f)
+    print(f"Compared with baseline from {baseline['created']}:")
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if not old:
+            continue
+        changes = []
+        for key, value in result.items():
+            if key in ("count", "errors", "elapsed_s") or value is None or not old.get(key):
+                continue
+            changes.append(f"{key} {(value - old[key]) / old[key] * 100:+.1f}%")
+        print(f"  {name:<26} " + ", ".join(changes))
@@ -0,0 +1,109 @@
+"""
+Response serialization: FastAPI's response_model path vs FastJSONResponse
+
+What it runs
+Two routes per response shape, both returning the same prepared dict the way
+the views build it, called straight through the ASGI interface (no HTTP
+client, no database):
+1. model_<shape> - response_model=..., FastAPI validates the dict into the
+                   model, runs jsonable_encoder and json.dumps (the old path)
+2. fast_<shape>  - the dict wrapped by app.responses.respond() (orjson when
+                   installed, no validation)
+Shapes: details (GET /users/{user_id}), signup (POST /signup) and a page of
+--page-size users (GET /users).
+
+For each it prints the CPU time per request (time.process_time, so waiting
+doesn't count) and how much the fast path saves.
+
+Run it with:
+    python -m benchmarks.responses --requests 20000
+"""
+from datetime import datetime
+import argparse
+import asyncio
+import logging
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Per-request CPU of response serialization")
+    parser.add_argument("--requests", type=int, default=20000, help="requests per route")
+    parser.add_argument("--page-size", type=int, default=100, help="users in the GET /users page")
+    return parser.parse_args()
+
+
+def build_app(page_size):
+    import app.responses as responses
+    from fastapi import FastAPI
+    from app.schema import UserDetailsResponse, UserResponse, UserListResponse
+
+    responses.FAST_JSON_RESPONSES = True
+    user = {"user_id": "4b1d2a6e-0c1f-4d3b-9a57-2f6f2f0f8c11", "email": "ann.lee@example.com", "first_name": "Ann",
+            "last_name": "Lee", "verification_state": "PENDING", "created_on": datetime(2026, 1, 1, 12, 30, 15, 123456)}
+    bodies = {
+        "details": (UserDetailsResponse, {"status": "SUCCESS", "message": "User details fetched successfully", **user}),
+        "signup": (UserResponse, {"status": "SUCCESS", "message": "User onboarded successfully",
+                                  "user_id": user["user_id"], "verification": "PENDING"}),
+        "list": (UserListResponse, {"status": "SUCCESS", "users": [dict(user) for _ in range(page_size)],
+                                    "next_cursor": "WyIyMDI2LTAxLTAxVDEyOjMwOjE1LjEyMzQ1NiIsMTAwXQ"}),
+    }
+
+    app = FastAPI()
+    for shape, (model, body) in bodies.items():
+        app.get(f"/model_{shape}", response_model=model)(_route(lambda body=body: body))
+        app.get(f"/fast_{shape}", response_model=model)(_route(lambda body=body: responses.respond(body)))
+    return app, list(bodies)
+
+
+def _route(result):
+    # async def without parameters: the route runs on the event loop and has no
+    # query parameters to parse, so only serialization differs between the two
+    async def route():
+        return result()
+    return route
+
+
+async def call(app, path):
+    """One GET through the ASGI interface, returns the status code"""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": [],
+             "server": ("bench", 80), "client": ("bench", 1)}
+    sent = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+
+    await app(scope, receive, send)
+    return sent["status"]
+
+
+async def run(app, path, requests):
+    for _ in range(min(200, requests)):  # warm up
+        await call(app, path)
+    started = time.process_time()
+    for _ in range(requests):
+        assert await call(app, path) == 200
+    return (time.process_time() - started) / requests
+
+
+def main(args):
+    import app.responses as responses
+    fastapi_app, shapes = build_app(args.page_size)
+    print(f"encoder: {'orjson' if responses.orjson else 'json (orjson not installed)'}, {args.requests} requests per route")
+    results = {}
+    for shape in shapes:
+        model = asyncio.run(run(fastapi_app, f"/model_{shape}", args.requests))
+        fast = asyncio.run(run(fastapi_app, f"/fast_{shape}", args.requests))
+        results[shape] = {"model_us": round(model * 1e6, 1), "fast_us": round(fast * 1e6, 1)}
+        print(f"{shape:<10} response_model={model * 1e6:>8.1f} us CPU/request  fast={fast * 1e6:>8.1f} us CPU/request  "
+              f"({1 - fast / model:.0%} less)")
+    return results
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    main(parse_args())
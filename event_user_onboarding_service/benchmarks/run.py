@@ -0,0 +1,168 @@
+"""
+Load test: API endpoints and the consumer, on local stand-ins
+
+What it runs (in this order, each one feeds the next)
+1. POST /signup        - `requests` signups with unique emails, `concurrency` at a time
+2. consumer            - process_user_onboarding (or the batch version with
+                         --batch-size > 1) on every message the signups published
+3. GET /users/{id}     - reads of the users created above
+4. PUT /users/{id}     - verifies them
+
+Requests go through the real FastAPI app in this process (httpx ASGI
+transport, sync endpoints run on the threadpool as under uvicorn). The broker is
+InMemoryBroker, the database is a SQLite file unless --db-url points at a
+(local or embedded) Postgres, which is then migrated.
+
+Run it with:
+    python -m benchmarks.run --requests 2000 --concurrency 32
+    python -m benchmarks.run --save-baseline      # write benchmarks/results/baseline.json
+    python -m benchmarks.run --compare            # print the change against it
+"""
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+import os
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "results", "baseline.json")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="User onboarding service load test")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at once")
+    parser.add_argument("--batch-size", type=int, default=1, help="consumer batch size (1 = one message at a time)")
+    parser.add_argument("--db-url", help="use this Postgres instead of the SQLite stand-in")
+    parser.add_argument("--no-email-filter", action="store_true", help="disable the Bloom filter in front of the duplicate check")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare this run with the baseline")
+    parser.add_argument("--verbose", action="store_true", help="keep the service's INFO logs")
+    return parser.parse_args()
+
+
+def install_standins(args):
+    """Put the stand-ins into the resource registry before anything asks for the real ones"""
+    os.environ.setdefault("POOL_SIZE", str(max(5, args.concurrency)))
+    os.environ.setdefault("MAX_OVERFLOW", "0")
+    os.environ["EMAIL_FILTER_ENABLED"] = "false" if args.no_email_filter else "true"
+    os.environ["RMQ_PUBLISHER_CONFIRMS"] = "false"
+
+    from app.resources import get_resources
+    from benchmarks.standins import InMemoryBroker, InMemoryRabbitMQHelper, InMemoryChannelPool, SqliteDatabase
+
+    resources = get_resources()
+    broker = InMemoryBroker()
+    resources.publisher_confirms = False
+    resources._rmq = InMemoryRabbitMQHelper(broker)
+    resources._rmq_pool = InMemoryChannelPool(broker)
+    resources._rmq.setup_queue()
+
+    if args.db_url:
+        from app.db_conn import Database
+        os.environ["DB_URL"] = args.db_url
+        os.environ["DB_AUTO_MIGRATE"] = "true"
+        resources._db = Database()
+    else:
+        resources._db = SqliteDatabase()
+    return resources, broker
+
+
+async def drive(client, method, paths, concurrency, body=None):
+    """Send one request per path with `concurrency` workers, return (latencies, errors, elapsed)"""
+    latencies, errors = [], 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < len(paths):
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, paths[index], json=body(index) if body else None)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def run_consumer(rmq, batch_size):
+    """Drain the queue through the consumer's callback, timing every call"""
+    from app.consumers.user_consumer import process_user_onboarding, process_user_onboarding_batch
+    latencies = []
+    processed = 0
+
+    def timed(callback, size_of):
+        def wrapper(payload):
+            nonlocal processed
+            started = time.perf_counter()
+            try:
+                return callback(payload)
+            finally:
+                latencies.append(time.perf_counter() - started)
+                processed += size_of(payload)
+        return wrapper
+
+    started = time.perf_counter()
+    if batch_size > 1:
+        rmq.consume_batches("user_onboarding_queue", timed(process_user_onboarding_batch, len), batch_size=batch_size)
+    else:
+        rmq.consume_messages("user_onboarding_queue", timed(process_user_onboarding, lambda _: 1))
+    return latencies, processed, time.perf_counter() - started
+
+
+async def main(args):
+    import httpx
+    from app.main import app
+    from app import message_codec
+    from benchmarks.report import summarize, print_results, save_baseline, compare
+
+    resources, broker = install_standins(args)
+    run_id = uuid.uuid4().hex[:8]
+    results = {}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        signup = lambda i: {"email": f"bench-{run_id}-{i}@example.com", "first_name": "Bench",
+                            "last_name": str(i), "password": f"password-{i}"}
+        latencies, errors, elapsed = await drive(client, "POST", ["/signup"] * args.requests, args.concurrency, signup)
+        results["signup"] = summarize(latencies, elapsed, errors)
+
+        # Collect the user_ids before the consumer takes the messages
+        user_ids = [message_codec.decode(*encoded)["user_id"] for encoded in broker.peek("user_onboarding_queue")]
+
+        latencies, processed, elapsed = await asyncio.to_thread(run_consumer, resources.rmq, args.batch_size)
+        consume = summarize(latencies, elapsed, broker.depth("user_onboarding_queue_dlq"), unit="calls")
+        consume["messages_per_s"] = round(processed / elapsed, 1) if elapsed else None
+        results[f"consume_batch_{args.batch_size}" if args.batch_size > 1 else "consume"] = consume
+
+        paths = [f"/users/{user_id}" for user_id in user_ids]
+        latencies, errors, elapsed = await drive(client, "GET", paths, args.concurrency)
+        results["get_user"] = summarize(latencies, elapsed, errors)
+
+        latencies, errors, elapsed = await drive(client, "PUT", paths, args.concurrency)
+        results["verify_user"] = summarize(latencies, elapsed, errors)
+
+    resources.shutdown()
+
+    print_results(results)
+    config = {"requests": args.requests, "concurrency": args.concurrency, "batch_size": args.batch_size,
+              "database": "postgres" if args.db_url else "sqlite", "email_filter": not args.no_email_filter}
+    if args.compare:
+        compare(args.baseline, results)
+    if args.save_baseline:
+        save_baseline(args.baseline, results, config)
+    return results
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if not arguments.verbose:
+        logging.disable(logging.INFO)
+    asyncio.run(main(arguments))
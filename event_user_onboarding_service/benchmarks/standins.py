@@ -0,0 +1,237 @@
+"""
+Local stand-ins for RabbitMQ and Postgres
+
+Concept: Stand-in
+- Same methods as the real class, so the service code can't tell the
+  difference, but everything happens in this process
+- InMemoryBroker: queues are deques of encoded messages (body, content_type,
+  content_encoding - see app/message_codec.py), a NACKed message goes to <queue>_dlq
+- InMemoryRabbitMQHelper: RabbitMQHelper interface on top of the broker
+  (used as the consumer's connection and, via InMemoryChannelPool, by the API)
+- SqliteDatabase: Database interface on a SQLite file with the same users
+  table and unique indexes as the migrations
+
+The numbers are for comparing runs of this code with each other, not for
+predicting production throughput (no network, no fsync to a real server).
+"""
+from app.db_conn import Database, RoutingSession
+from app.models import Base
+from app.rmq_adapter import RabbitMQHelper
+from app.message_codec import Encoded
+from app import message_codec
+from sqlalchemy import create_engine, orm
+from sqlalchemy.pool import QueuePool
+from collections import deque
+import threading
+import tempfile
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryBroker:
+    """Thread-safe queues, shared by every InMemoryRabbitMQHelper built on it"""
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self.published = 0
+
+    def declare(self, queue_name):
+        with self._lock:
+            self._queues.setdefault(queue_name, deque())
+            self._queues.setdefault(f"{queue_name}_dlq", deque())
+
+    def publish(self, queue_name, message: Encoded):
+        with self._lock:
+            if queue_name not in self._queues:
+                # Same as mandatory=True on an undeclared queue: the message is refused
+                raise ValueError(f"Queue '{queue_name}' is not declared")
+            self._queues[queue_name].append(message)
+            self.published += 1
+            self._not_empty.notify()
+
+    def get(self, queue_name, timeout=None):
+        """Next message, or None if the queue stayed empty for `timeout` seconds"""
+        with self._lock:
+            queue = self._queues[queue_name]
+            if not queue and timeout:
+                self._not_empty.wait_for(lambda: queue, timeout=timeout)
+            return queue.popleft() if queue else None
+
+    def dead_letter(self, queue_name, message: Encoded):
+        with self._lock:
+            self._queues[f"{queue_name}_dlq"].append(message)
+
+    def peek(self, queue_name):
+        """Messages waiting in the queue (still encoded), without taking them"""
+        with self._lock:
+            return list(self._queues.get(queue_name, ()))
+
+    def depth(self, queue_name):
+        with self._lock:
+            return len(self._queues.get(queue_name, ()))
+
+
+class InMemoryRabbitMQHelper(RabbitMQHelper):
+    """
+    RabbitMQHelper backed by an InMemoryBroker.
+    consume_* return once the queue is empty, or keep waiting until
+    stop_event is set when one is given
+    """
+
+    def __init__(self, broker: InMemoryBroker):
+        super().__init__()
+        self.broker = broker
+
+    def connect(self):
+        return True
+
+    def _ensure_connection(self):
+        pass
+
+    def setup_queue(self, queue_name="user_onboarding_queue"):
+        self.broker.declare(queue_name)
+        return True
+
+    def publish_message(self, queue_name, message_data):
+        self.broker.publish(queue_name, message_codec.encode(message_data))
+        return True
+
+    def _next(self, queue_name, stop_event):
+        if stop_event is None:
+            return self.broker.get(queue_name)
+        while not stop_event.is_set():
+            message = self.broker.get(queue_name, timeout=0.1)
+            if message is not None:
+                return message
+        return None
+
+    def consume_messages(self, queue_name, callback_function, stop_event=None):
+        while True:
+            encoded = self._next(queue_name, stop_event)
+            if encoded is None:
+                return
+            try:
+                ok = callback_function(message_codec.decode(*encoded))
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+                ok = False
+            if not ok:
+                self.broker.dead_letter(queue_name, encoded)
+
+    def consume_batches(self, queue_name, batch_callback, batch_size=100, max_linger=0.05,
+                        prefetch_count=None, stop_event=None):
+        while True:
+            encoded = self._next(queue_name, stop_event)
+            if encoded is None:
+                return
+            batch = [encoded]
+            deadline = time.monotonic() + max_linger
+            while len(batch) < batch_size:
+                encoded = self.broker.get(queue_name, timeout=max(0, deadline - time.monotonic()))
+                if encoded is None:
+                    break
+                batch.append(encoded)
+            try:
+                results = batch_callback([message_codec.decode(*encoded) for encoded in batch])
+            except Exception as e:
+                logger.error(f"Error processing batch of {len(batch)} messages: {e}")
+                results = [False] * len(batch)
+            for encoded, ok in zip(batch, results):
+                if not ok:
+                    self.broker.dead_letter(queue_name, encoded)
+
+    def close(self):
+        pass
+
+
+class InMemoryChannelPool:
+    """RabbitMQChannelPool interface (publish from any thread) backed by an InMemoryBroker"""
+
+    def __init__(self, broker: InMemoryBroker):
+        self.broker = broker
+        self.size = 1
+        self.checked_out = 0
+
+    def publish(self, queue_name, message_data):
+        self.broker.publish(queue_name, message_codec.encode(message_data))
+
+    def publish_many(self, queue_name, messages):
+        errors = []
+        for message_data in messages:
+            try:
+                self.publish(queue_name, message_data)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def checkout(self, timeout=None):
+        # What the dependency supervisor's health check uses
+        return self
+
+    def checkin(self, rmq, discard=False):
+        pass
+
+    def setup_queue(self, queue_name="user_onboarding_queue"):
+        self.broker.declare(queue_name)
+
+    def close(self):
+        pass
+
+
+class SqliteDatabase(Database):
+    """
+    Database on a SQLite file, with the users table created from the models instead of migrations
+
+    replica_paths: SQLite files used as read replicas. Pass the primary's own
+    path for a replica without lag, another file to see which engine a read hit.
+    shared: the store that carries read-your-writes marks between instances
+    """
+
+    def __init__(self, path=None, pool_size=None, replica_paths=(), shared=None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="onboarding-bench-", suffix=".db")
+            os.close(fd)
+            os.remove(path)
+        self.path = path
+        self.engine = self._sqlite_engine(path, pool_size)
+
+        # Same table and unique indexes as the migrations (see app/models.py)
+        self.metadata = Base.metadata
+        self.metadata.create_all(self.engine)
+
+        replicas = [self._sqlite_engine(replica_path, pool_size) for replica_path in replica_paths]
+        for engine in replicas:
+            self.metadata.create_all(engine)
+        self._init_routing(self.engine, replicas, shared)
+        self._session_factory = orm.scoped_session(
+            orm.sessionmaker(
+                class_=RoutingSession,
+                router=self,
+                autocommit=False,
+                autoflush=False,
+                bind=self.engine,
+            )
+        )
+        logger.info(f"SQLite stand-in database at {path}")
+
+    @staticmethod
+    def _sqlite_engine(path, pool_size=None):
+        return create_engine(f"sqlite:///{path}",
+                             poolclass=QueuePool,
+                             pool_size=pool_size or int(os.getenv("POOL_SIZE", "5")),
+                             max_overflow=0,
+                             connect_args={"check_same_thread": False},
+                             echo=False)
+
+    def db_connection_close(self):
+        super().db_connection_close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
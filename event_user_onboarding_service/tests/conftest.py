@@ -0,0 +1,55 @@
+"""
+Fixtures shared by the tests: every test gets its own resource registry,
+filled with the local stand-ins (SQLite files from benchmarks/standins.py,
+the in-memory shared store) instead of Postgres, RabbitMQ and Redis.
+
+Run from event_user_onboarding_service/:
+    python -m pytest tests
+"""
+import os
+
+os.environ.setdefault("POOL_SIZE", "5")
+os.environ.setdefault("MAX_OVERFLOW", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["RMQ_PUBLISHER_CONFIRMS"] = "false"
+
+from app import resources
+from app.shared_store import InMemoryStore
+from benchmarks.standins import SqliteDatabase
+import pytest
+
+
+@pytest.fixture
+def store():
+    return InMemoryStore()
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """A fresh ResourceRegistry as the process' resources (no Bloom filter, no shared store)"""
+    registry = resources.ResourceRegistry()
+    registry._email_filter = None
+    registry._shared_store = None
+    monkeypatch.setattr(resources, "_resources", registry)
+    yield registry
+    if registry._password_hasher is not None:
+        registry._password_hasher.close()
+
+
+@pytest.fixture
+def lagging_replica(tmp_path):
+    """
+    database(shared=None) -> a SqliteDatabase on primary.db with replica.db as its
+    read replica. Nothing copies rows between the two files: the replica lags forever
+    """
+    created = []
+
+    def database(shared=None):
+        db = SqliteDatabase(str(tmp_path / "primary.db"), replica_paths=[str(tmp_path / "replica.db")], shared=shared)
+        created.append(db)
+        return db
+    yield database
+    for db in created:
+        db.engine.dispose()
+        for replica in db.replicas:
+            replica.dispose()
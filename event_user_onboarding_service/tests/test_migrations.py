@@ -0,0 +1,29 @@
+"""The migration runner's batched UPDATEs, see app/migrations/__init__.py"""
+from app.migrations import MIGRATIONS_DIR, FILTERED_UPDATE, _statements, update_in_batches
+from app.models import User
+from datetime import datetime
+from sqlalchemy import create_engine, event, select
+
+
+def test_normalizing_emails_runs_in_id_ranges_and_only_touches_changed_rows(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'users.db'}")
+    User.__table__.create(engine)
+    emails = ["ann@example.com", " Bob@Example.com", "cy@example.com", "DEE@example.com ", "eve@example.com"]
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [dict(email=email, user_id=f"id{i}", verification_state="PENDING",
+                                                    created_on=datetime(2026, 1, 1)) for i, email in enumerate(emails)])
+
+    updates = []
+    event.listen(engine, "after_cursor_execute",
+                 lambda conn, cursor, statement, *args: updates.append(cursor.rowcount) if statement.startswith("UPDATE") else None)
+
+    email_update = next(statement for statement in _statements(MIGRATIONS_DIR / "002_users_lookup_indexes.sql")
+                        if FILTERED_UPDATE.fullmatch(statement) and "email" in statement)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        update_in_batches(conn, email_update, batch_rows=2)
+        rows = conn.execute(select(User.email).order_by(User.id)).scalars().all()
+
+    assert rows == ["ann@example.com", "bob@example.com", "cy@example.com", "dee@example.com", "eve@example.com"]
+    # ids 1-2, 3-4, 5: one statement per range, each changing only the rows that needed it
+    assert updates == [1, 1, 0]
+    engine.dispose()
@@ -0,0 +1,52 @@
+"""Read/write routing between a primary and a (lagging) read replica, see app/db_conn.py"""
+from app.models import User
+from app.views import publish_view
+from datetime import datetime
+
+USER_ID = "0f6d1a52-6c1b-4cfe-9a5e-1f4b1f0c2d11"
+
+
+def add_user(engine):
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [dict(email="ann@example.com", first_name="Ann", last_name="Lee", user_id=USER_ID,
+                                                    verification_state="PENDING", created_on=datetime(2026, 1, 1))])
+
+
+def test_plain_reads_go_to_the_replica(registry, lagging_replica):
+    database = registry._db = lagging_replica()
+    add_user(database.replicas[0])
+
+    assert publish_view.get_user_details(USER_ID)["user_id"] == USER_ID
+
+
+def test_read_after_write_in_another_process_goes_to_the_primary(registry, lagging_replica, store):
+    # Two API workers: same primary, same replica, one shared store
+    worker_a, worker_b = lagging_replica(store), lagging_replica(store)
+    add_user(worker_a.engine)
+    add_user(worker_a.replicas[0])
+
+    registry._db = worker_a
+    assert publish_view.update_user_details(USER_ID)["message"] == "User verified successfully"
+
+    # The replica still has PENDING; worker B has never seen the write itself
+    registry._db = worker_b
+    assert worker_b._recent_writes == {}
+    assert worker_b.wrote_recently(USER_ID)
+    assert publish_view.get_user_details(USER_ID)["verification_state"] == "VERIFIED"
+
+
+def test_without_a_shared_store_only_the_writing_process_knows(registry, lagging_replica):
+    worker_a, worker_b = lagging_replica(), lagging_replica()
+    worker_a.note_writes([USER_ID])
+
+    assert worker_a.wrote_recently(USER_ID)
+    assert not worker_b.wrote_recently(USER_ID)
+
+
+def test_unreachable_shared_store_reads_from_the_primary(lagging_replica, store):
+    def down(*args):
+        raise ConnectionError("store down")
+    store.get = down
+    database = lagging_replica(store)
+
+    assert database.wrote_recently(USER_ID)
@@ -0,0 +1,67 @@
+"""Delivery tag bookkeeping of the confirming publisher, see app/rmq_confirms.py"""
+from app import message_codec
+from app.rmq_confirms import ConfirmingPublisher
+from concurrent.futures import Future
+from types import SimpleNamespace
+import pika
+import pytest
+
+
+class Channel:
+    """Stands in for the pika channel: fails the publishes it is told to"""
+
+    is_open = True
+
+    def __init__(self):
+        self.fail_next = False
+        self.sent = []
+
+    def basic_publish(self, exchange, routing_key, body, properties, mandatory):
+        if self.fail_next:
+            self.fail_next = False
+            raise pika.exceptions.UnroutableError([])
+        self.sent.append(int(properties.message_id))
+
+
+def ack(delivery_tag):
+    return SimpleNamespace(method=pika.spec.Basic.Ack(delivery_tag=delivery_tag, multiple=False))
+
+
+@pytest.fixture
+def publisher():
+    publisher = ConfirmingPublisher(window=10, confirm_timeout=1)
+    publisher._channel = Channel()
+    return publisher
+
+
+def publish(publisher):
+    future = Future()
+    publisher._publish("user_onboarding", message_codec.encode({"email": "ann@example.com"}), future)
+    return future
+
+
+def test_a_failed_basic_publish_does_not_use_up_a_tag(publisher):
+    first = publish(publisher)
+    publisher._channel.fail_next = True
+    failed = publish(publisher)
+    third = publish(publisher)
+
+    assert failed.exception() is not None
+    assert publisher._channel.sent == [1, 2]
+
+    # The broker numbered the two publishes it got 1 and 2
+    publisher._on_confirm(ack(2))
+    assert third.result(timeout=0) is True
+    assert not first.done()
+
+
+def test_channel_close_fails_outstanding_and_restarts_the_tags(publisher):
+    futures = [publish(publisher), publish(publisher)]
+
+    publisher._on_channel_closed(publisher._channel, "gone")
+
+    assert all(isinstance(future.exception(timeout=0), ConnectionError) for future in futures)
+    assert publisher.in_flight == 0
+    publisher._channel = Channel()
+    publish(publisher)
+    assert publisher._channel.sent == [1]
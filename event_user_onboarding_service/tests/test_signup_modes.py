@@ -0,0 +1,118 @@
+"""The sync and async signup endpoints answer the same, see app/views/signup.py"""
+from app import async_db_conn, message_codec, resources
+from app.async_db_conn import AsyncDatabase
+from app.endpoints.async_publish_endpoint import router as async_router
+from app.endpoints.publish_endpoint import router as sync_router
+from app.password_hasher import PasswordHasher
+from benchmarks.standins import InMemoryBroker, InMemoryChannelPool, SqliteDatabase
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import pytest
+
+
+def user(email):
+    return {"email": email, "first_name": "Ann", "last_name": "Lee", "password": "secret"}
+
+
+class AsyncChannel:
+    """Stands in for the aio-pika helper on top of an InMemoryChannelPool"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def publish_message(self, queue_name, message_data):
+        self.pool.publish(queue_name, message_data)
+
+    async def publish_many(self, queue_name, messages, return_exceptions=False):
+        return self.pool.publish_many(queue_name, messages)
+
+    async def close(self):
+        pass
+
+
+def masked(value, user_ids):
+    """value with the (random) user_ids replaced by the order they were handed out in"""
+    if isinstance(value, dict):
+        return {key: masked(item, user_ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [masked(item, user_ids) for item in value]
+    if isinstance(value, str) and len(value) == 36 and value.count("-") == 4:
+        return f"user-{user_ids.setdefault(value, len(user_ids))}"
+    return value
+
+
+def signup_session(client):
+    """The same signups in both modes -> [(status code, body)] with user_ids masked"""
+    responses = [
+        client.post("/signup", json=user("ann@example.com")),
+        client.post("/signup", json=user(" ANN@example.com")),  # still pending
+        client.post("/signup/batch", json=[user("bob@example.com"), user("ann@example.com"), user("Bob@example.com"),
+                                           {"email": "not-an-email"}, user("cy@example.com")]),
+        client.get("/users/0f6d1a52-6c1b-4cfe-9a5e-1f4b1f0c2d11"),
+    ]
+    user_ids = {}
+    return [(response.status_code, masked(response.json(), user_ids)) for response in responses]
+
+
+def published(broker):
+    return sorted((message["email"], message["verification"], "password" in message, "password_hash" in message)
+                  for message in map(decode, broker.peek("user_onboarding_queue")))
+
+
+def decode(encoded):
+    return message_codec.decode(encoded.body, encoded.content_type, encoded.content_encoding)
+
+
+@pytest.fixture
+def hasher(registry):
+    registry._password_hasher = PasswordHasher(workers=1, n=1024).start()
+    return registry._password_hasher
+
+
+def fresh_registry(monkeypatch, hasher):
+    """A second process' resources: no pending signups or cached users from the first"""
+    registry = resources.ResourceRegistry()
+    registry._email_filter = None
+    registry._shared_store = None
+    registry._password_hasher = hasher
+    monkeypatch.setattr(resources, "_resources", registry)
+    return registry
+
+
+def run(router):
+    app = FastAPI()
+    app.include_router(router)
+    with TestClient(app) as client:
+        return signup_session(client)
+
+
+def test_sync_and_async_signups_answer_the_same(registry, hasher, tmp_path, monkeypatch):
+    # Sync: psycopg2/pika stand-ins
+    broker = InMemoryBroker()
+    broker.declare("user_onboarding_queue")
+    registry._db = SqliteDatabase(str(tmp_path / "sync.db"))
+    registry._rmq_pool = InMemoryChannelPool(broker)
+    sync = run(sync_router), published(broker)
+    registry._db.engine.dispose()
+
+    # Async: asyncpg/aio-pika stand-ins, on a fresh database and broker
+    broker = InMemoryBroker()
+    broker.declare("user_onboarding_queue")
+    SqliteDatabase(str(tmp_path / "async.db")).engine.dispose()
+    monkeypatch.setenv("ASYNC_DB_URL", f"sqlite+aiosqlite:///{tmp_path / 'async.db'}")
+    monkeypatch.setenv("ASYNC_DB_REPLICA_URLS", "")
+    monkeypatch.delenv("DB_REPLICA_URLS", raising=False)
+    create_async_engine = async_db_conn.create_async_engine
+    monkeypatch.setattr(async_db_conn, "create_async_engine",
+                        lambda url, **kwargs: create_async_engine(url, poolclass=AsyncAdaptedQueuePool, **kwargs))
+    registry = fresh_registry(monkeypatch, hasher)
+    registry._async_db = AsyncDatabase()
+    registry._async_rmq = AsyncChannel(InMemoryChannelPool(broker))
+    asynchronous = run(async_router), published(broker)
+
+    assert sync == asynchronous
+    responses, messages = sync
+    assert [status for status, _ in responses] == [201, 409, 200, 404]
+    assert [result["status"] for result in responses[2][1]["results"]] == ["created", "conflict", "conflict", "invalid", "created"]
+    assert messages == [(email, "PENDING", False, True) for email in ("ann@example.com", "bob@example.com", "cy@example.com")]
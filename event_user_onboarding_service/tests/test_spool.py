@@ -0,0 +1,55 @@
+"""The signup spool's forwarder, see app/spool.py"""
+from app.spool import Spool
+import fcntl
+import json
+import os
+import time
+
+
+def leave_behind(directory, messages):
+    """A slot as a worker that is gone left it: one segment, never forwarded"""
+    os.makedirs(directory)
+    with open(os.path.join(directory, "000000000001.log"), "wb") as f:
+        f.write(b"".join(json.dumps(message).encode() + b"\n" for message in messages))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_lines_are_forwarded_only_once_fsynced(tmp_path):
+    spool = Spool(str(tmp_path))
+    with spool._lock:
+        spool._file.write(b'{"user_id": "a"}\n')
+        spool._file.flush()
+
+    assert spool._read_batch() == []
+    with spool._lock:
+        spool._sync()
+    assert [message for message, _ in spool._read_batch()] == [{"user_id": "a"}]
+    spool.close()
+
+
+def test_free_slots_above_the_worker_count_are_adopted_and_drained(tmp_path):
+    leave_behind(str(tmp_path / "slot-1"), [{"user_id": "live"}])
+    leave_behind(str(tmp_path / "slot-3"), [{"user_id": "a"}, {"user_id": "b"}])
+    leave_behind(str(tmp_path / "slot-4"), [{"user_id": "c"}])
+    # slot-4 still belongs to a running worker
+    held = open(tmp_path / "slot-4" / "lock", "w")
+    fcntl.flock(held, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    forwarded = []
+    spool = Spool.open_slot(str(tmp_path), slots=2)
+    assert spool.directory == str(tmp_path / "slot-0")
+    assert [orphan.directory for orphan in spool._orphans] == [str(tmp_path / "slot-3")]
+    assert spool.depth == 2
+
+    spool.start(lambda messages: forwarded.extend(messages) or [None] * len(messages))
+    wait_for(lambda: spool.depth == 0)
+    wait_for(lambda: not spool._orphans[0]._threads[0].is_alive())
+    assert forwarded == [{"user_id": "a"}, {"user_id": "b"}]
+    spool.close()
+    held.close()
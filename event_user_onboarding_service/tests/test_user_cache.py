@@ -0,0 +1,62 @@
+"""The user cache with a shared store, see app/cache.py"""
+from app.cache import UserCache
+from app.shared_store import write_marker
+from datetime import datetime
+
+USER_ID = "0f6d1a52-6c1b-4cfe-9a5e-1f4b1f0c2d11"
+
+
+def details(verification_state):
+    return {"status": "SUCCESS", "user_id": USER_ID, "email": "ann@example.com", "first_name": "Ann", "last_name": "Lee",
+            "verification_state": verification_state, "created_on": datetime(2026, 1, 1)}
+
+
+class Loader:
+    """Stands in for the database: counts the loads and returns the current row"""
+
+    def __init__(self, verification_state="PENDING"):
+        self.verification_state = verification_state
+        self.loads = 0
+
+    def __call__(self):
+        self.loads += 1
+        return details(self.verification_state)
+
+
+def test_a_row_loaded_by_one_process_is_served_to_another(store):
+    worker_a, worker_b = UserCache(shared=store), UserCache(shared=store)
+    database = Loader()
+
+    worker_a.get_or_load(USER_ID, database)
+    assert worker_b.get_or_load(USER_ID, database)["verification_state"] == "PENDING"
+    assert database.loads == 1
+
+
+def test_invalidation_in_one_process_is_seen_by_the_others(store):
+    worker_a, worker_b = UserCache(shared=store), UserCache(shared=store)
+    database = Loader()
+    worker_a.get_or_load(USER_ID, database)
+    worker_b.get_or_load(USER_ID, database)
+
+    # Worker B verifies the user
+    database.verification_state = "VERIFIED"
+    worker_b.invalidate(USER_ID)
+
+    assert worker_a.get_or_load(USER_ID, database)["verification_state"] == "VERIFIED"
+
+
+def test_a_row_read_during_the_write_window_is_not_cached(store):
+    cache = UserCache(shared=store)
+    database = Loader()
+
+    def stale_read():
+        # Read from a lagging replica while another process verifies and invalidates
+        row = database()
+        store.set(write_marker(USER_ID), "1", 2)
+        cache.invalidate(USER_ID)
+        database.verification_state = "VERIFIED"
+        return row
+
+    assert cache.get_or_load(USER_ID, stale_read)["verification_state"] == "PENDING"
+    assert store.get(UserCache._key(USER_ID)) is None
+    assert cache.get_or_load(USER_ID, database)["verification_state"] == "VERIFIED"